@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio-native processing API built on the stage functions of run_process_0100.
+
+Rendering, OCR and page assembly run on executors: all PyMuPDF work goes
+through one dedicated thread (MuPDF is not thread-safe), OCR runs on a
+thread pool backed by a shared EnginePool. Many documents can be in flight
+at once; they share the engines and the next pages of each document are
+rendered while the current one is being recognized.
+
+Usage:
+    processor = AsyncPDFProcessor(engines=2)
+    async for page in processor.process_pages('in.pdf', 'out.pdf', hide_text=True):
+        print(page['page'], page['pages'], page['blocks'])
+    stats = await processor.process('other.pdf', 'other_searchable.pdf')
+    processor.close()
+
+Cancelling the consuming task stops the document after the page currently
+being recognized; no output is saved. To leave the async for loop early,
+iterate inside contextlib.aclosing(processor.process_pages(...)) so the
+document is closed right away.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+
+from ocr_utils_fixed import TechnicalOCRProcessor
+from pdf_output import describe_save, save_pdf
+from run_process_0100 import (analyze_page_content, assemble_page, create_ocr_engine,
+                              ocr_page, render_page, rotation_from_raw)
+
+
+class EnginePool:
+    """A fixed set of OCR engines handed out to one OCR call at a time.
+
+    Engines are created lazily on first use by the factory; an engine is
+    returned to the pool only when the executor call using it has really
+    finished, so cancellation never lets two calls share one engine.
+    """
+
+    def __init__(self, size: int = 1, factory=None, cpu_threads=None):
+        self.size = max(1, int(size))
+        self.factory = factory or (lambda: create_ocr_engine(cpu_threads=cpu_threads))
+        self._free = None
+        self._created = 0
+
+    def _queue(self) -> asyncio.Queue:
+        if self._free is None:
+            self._free = asyncio.Queue()
+        return self._free
+
+    async def run(self, executor, func, *args):
+        """Run func(engine, *args) on the executor with an engine from the pool"""
+        loop = asyncio.get_running_loop()
+        free = self._queue()
+        if free.empty() and self._created < self.size:
+            self._created += 1
+            engine = None
+        else:
+            engine = await free.get()
+
+        def call():
+            nonlocal engine
+            if engine is None:
+                engine = self.factory()
+            return func(engine, *args)
+
+        def release(_):
+            if engine is not None:
+                loop.call_soon_threadsafe(free.put_nowait, engine)
+            else:
+                # The factory failed (or the call never started): allow another attempt
+                loop.call_soon_threadsafe(self._forget_one)
+
+        future = executor.submit(call)
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def _forget_one(self):
+        self._created -= 1
+
+
+class AsyncPDFProcessor:
+    """Schedule render/OCR/assembly of many documents onto shared executors"""
+
+    def __init__(self, engines: int = 1, cpu_threads=None, engine_factory=None, prefetch: int = 2):
+        self.pool = EnginePool(engines, factory=engine_factory, cpu_threads=cpu_threads)
+        self.prefetch = max(1, int(prefetch))
+        self.pdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf')
+        self.ocr_executor = ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix='ocr')
+        self.processor = TechnicalOCRProcessor()
+
+    async def _pdf(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pdf_executor, func, *args)
+
+    @staticmethod
+    def _render(doc, index, dpi):
+        page = doc[index]
+        page_type = analyze_page_content(page)
+        img, img_data = render_page(page, dpi)
+        return page_type, img, img_data
+
+    def _recognize(self, engine, img):
+        ocr_results, raw_ret = ocr_page(img, engine, self.processor)
+        return ocr_results, rotation_from_raw(raw_ret) or 0
+
+    async def process_pages(self, input_path: str, output_path: str,
+                            hide_text: bool = False,
+                            flip_x: bool = False,
+                            flip_y: bool = True,
+                            top_shift_px: float = 20.0,
+                            font_size: int = 8,
+                            dpi: int = 300,
+                            garbage: int = 3,
+                            linearize: bool = False,
+                            log_callback=None):
+        """Async iterator over per-page results; saves output_path after the last page.
+
+        The output is written by pdf_output.save_pdf (garbage / linearize as
+        in process_pdf).
+
+        Each item: {'page', 'pages', 'page_type', 'blocks', 'rotation',
+        'results', 'seconds'} where results are the normalized OCR lines.
+        """
+        log_message = log_callback or (lambda msg: None)
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+
+        doc = await self._pdf(fitz.open, input_path)
+        new_doc = await self._pdf(fitz.open)
+        renders = {}
+        try:
+            total_pages = len(doc)
+
+            def schedule(index):
+                if index < total_pages and index not in renders:
+                    renders[index] = asyncio.ensure_future(self._pdf(self._render, doc, index, dpi))
+
+            for i in range(total_pages):
+                t_page = time.perf_counter()
+                for ahead in range(i, i + self.prefetch + 1):
+                    schedule(ahead)
+                page_type, img, img_data = await renders.pop(i)
+                log_message(f"📄 Page {i+1}: type = {page_type}")
+
+                ocr_results, rotation_angle = await self.pool.run(self.ocr_executor, self._recognize, img)
+                log_message(f"  OCR blocks: {len(ocr_results)}")
+
+                def assemble(index=i):
+                    assemble_page(new_doc, doc[index], index, input_path, page_type, img, img_data,
+                                  ocr_results, rotation_angle, hide_text, flip_x, flip_y,
+                                  top_shift_px, font_size, log_message)
+
+                await self._pdf(assemble)
+                yield {
+                    'page': i + 1,
+                    'pages': total_pages,
+                    'page_type': page_type,
+                    'blocks': len(ocr_results),
+                    'rotation': rotation_angle,
+                    'results': ocr_results,
+                    'seconds': round(time.perf_counter() - t_page, 3),
+                }
+            saved = await self._pdf(save_pdf, new_doc, output_path, garbage, linearize)
+            log_message(describe_save(saved))
+        finally:
+            for task in renders.values():
+                task.cancel()
+            # Let already running renders finish before the document is closed under them
+            await asyncio.gather(*renders.values(), return_exceptions=True)
+            await self._pdf(new_doc.close)
+            await self._pdf(doc.close)
+
+    async def process(self, input_path: str, output_path: str, **options) -> dict:
+        """Process a whole document; returns a summary in the shape of process_pdf's statistics.
+
+        Only 'pages', 'blocks', 'output_bytes' and the total time are known
+        here: stages overlap across documents, so there are no per-stage
+        timings.
+        """
+        started = time.perf_counter()
+        pages = blocks = 0
+        async for page in self.process_pages(input_path, output_path, **options):
+            pages = page['pages']
+            blocks += page['blocks']
+        return {
+            'input': input_path,
+            'output': output_path,
+            'pages': pages,
+            'blocks': blocks,
+            'output_bytes': os.path.getsize(output_path),
+            'timings': {'total': round(time.perf_counter() - started, 3)},
+        }
+
+    def close(self):
+        self.ocr_executor.shutdown(wait=True)
+        self.pdf_executor.shutdown(wait=True)
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless command line interface for PDF2Searchable.
+
+Processes files, directories, glob patterns or a manifest (JSON/CSV with
+per-file options) and runs several files concurrently inside a global CPU
+thread budget. Writes a machine-readable JSON summary and returns a proper
+exit code:
+
+    0 - all files processed
+    1 - at least one file failed
+    2 - usage error / nothing to process
+
+Examples:
+    python batch_cli.py drawings/*.pdf --output-dir out --jobs 2 --workers 8
+    python batch_cli.py --manifest batch.csv --summary summary.json
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# Options accepted per file (CLI flags, settings.json, manifest columns) and their types
+PROCESS_OPTIONS = {
+    'hide_text': bool,
+    'flip_x': bool,
+    'flip_y': bool,
+    'top_shift_px': float,
+    'font_size': int,
+    'dpi': int,
+    'clip_to_content': bool,
+    'color_mode': str,
+    'page_index': str,
+    'near_duplicates': int,
+    'previous_source': str,
+    'previous_output': str,
+    'hybrid_text': bool,
+    'orientation': str,
+    'render_process': bool,
+    'memory_budget': int,
+    'page_timeout': float,
+    'retry_dpi': int,
+    'profile': bool,
+    'garbage': int,
+    'linearize': bool,
+    'text_overlay': bool,
+    'crop_to_ink': bool,
+    'ink_threshold': int,
+}
+
+# Options naming files on the machine running the job (not accepted from remote clients)
+PATH_OPTIONS = ('page_index', 'previous_source', 'previous_output')
+
+# settings.json (GUI) keys that map to a different process_pdf argument name
+SETTINGS_ALIASES = {
+    'top_shift': 'top_shift_px',
+}
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+_WORKER_ENGINE = None
+_WORKER_THREADS = None
+_WORKER_REC_CACHE = 0
+_WORKER_LOG_STDERR = False  # stdout carries the JSON summary (--summary -)
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+
+
+def coerce_options(raw: dict) -> dict:
+    """Keep known processing options and convert them to their proper types"""
+    options = {}
+    for key, value in raw.items():
+        key = SETTINGS_ALIASES.get(key, key)
+        if key not in PROCESS_OPTIONS or value is None or value == '':
+            continue
+        kind = PROCESS_OPTIONS[key]
+        options[key] = _to_bool(value) if kind is bool else kind(value)
+    return options
+
+
+def load_settings(path: str) -> dict:
+    """Load GUI settings.json as default processing options"""
+    with open(path, 'r', encoding='utf-8') as fh:
+        return coerce_options(json.load(fh))
+
+
+def default_output_path(input_path: str, hide_text: bool, output_dir: str = None) -> str:
+    """Build the output name the same way the GUI does (<name>_searchable[_Hide].pdf)"""
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    suffix = "_searchable"
+    if hide_text:
+        suffix += "_Hide"
+    target_dir = output_dir or os.path.dirname(os.path.abspath(input_path))
+    return os.path.join(target_dir, f"{base_name}{suffix}.pdf")
+
+
+def expand_inputs(patterns) -> list:
+    """Expand files, directories and glob patterns into a sorted list of PDF paths"""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '*.pdf')) + glob.glob(os.path.join(pattern, '*.PDF'))
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            matches = [pattern]
+        for path in sorted(matches):
+            if path not in found:
+                found.append(path)
+    return found
+
+
+def load_manifest(path: str) -> list:
+    """Read a JSON or CSV manifest into a list of {'input', 'output', **options} entries.
+
+    JSON: either a list of entries or {"defaults": {...}, "files": [...]}; an
+    entry may also be a plain path string. CSV: header row with an 'input'
+    column, an optional 'output' column and any option columns. An optional
+    'priority' (higher first) orders files in the page scheduler.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries = []
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as fh:
+            rows = list(csv.DictReader(fh))
+        defaults = {}
+    else:
+        with open(path, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+        if isinstance(data, dict):
+            defaults = data.get('defaults') or {}
+            rows = data.get('files') or []
+        else:
+            defaults = {}
+            rows = data
+
+    for row in rows:
+        if isinstance(row, str):
+            row = {'input': row}
+        input_path = (row.get('input') or '').strip()
+        if not input_path:
+            continue
+        if not os.path.isabs(input_path):
+            input_path = os.path.join(base_dir, input_path)
+        output_path = (row.get('output') or '').strip() or None
+        if output_path and not os.path.isabs(output_path):
+            output_path = os.path.join(base_dir, output_path)
+        options = coerce_options(defaults)
+        options.update(coerce_options(row))
+        entry = {'input': input_path, 'output': output_path, 'options': options}
+        priority = row.get('priority', defaults.get('priority'))
+        if priority not in (None, ''):
+            entry['priority'] = int(priority)
+        entries.append(entry)
+    return entries
+
+
+def init_worker(cpu_threads, rec_cache=0, log_stderr=False):
+    """Process pool initializer: pin the thread budget before Paddle is imported"""
+    global _WORKER_THREADS, _WORKER_REC_CACHE, _WORKER_LOG_STDERR
+    _WORKER_THREADS = cpu_threads
+    _WORKER_REC_CACHE = rec_cache
+    _WORKER_LOG_STDERR = log_stderr
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(cpu_threads)
+
+
+def _get_worker_engine():
+    """Load the OCR engine once per worker process and reuse it for every file"""
+    global _WORKER_ENGINE
+    if _WORKER_ENGINE is None:
+        from run_process_0100 import create_ocr_engine
+        _WORKER_ENGINE = create_ocr_engine(cpu_threads=_WORKER_THREADS, rec_cache=_WORKER_REC_CACHE)
+    return _WORKER_ENGINE
+
+
+def run_job(job: dict, quiet: bool = False) -> dict:
+    """Process one file; never raises, the result dict carries the status"""
+    from run_process_0100 import process_pdf
+
+    name = os.path.basename(job['input'])
+    record = {
+        'input': job['input'],
+        'output': job['output'],
+        'status': 'failed',
+        'pages': 0,
+        'blocks': 0,
+        'timings': {},
+        'error': None,
+    }
+
+    def log(msg):
+        if not quiet:
+            print(f"[{name}] {msg}", file=sys.stderr if _WORKER_LOG_STDERR else sys.stdout, flush=True)
+
+    started = time.perf_counter()
+    try:
+        stats = process_pdf(job['input'], job['output'],
+                            dump_debug_first_page=False,
+                            log_callback=log,
+                            cpu_threads=_WORKER_THREADS,
+                            rec_cache=_WORKER_REC_CACHE,
+                            # a supervised run loads the models in its own worker process
+                            ocr_engine=None if job['options'].get('page_timeout') else _get_worker_engine(),
+                            **job['options'])
+        record.update(pages=stats['pages'], blocks=stats['blocks'], timings=stats['timings'],
+                      output_bytes=stats.get('output_bytes', 0))
+        if stats.get('saved', True):
+            record['status'] = 'ok'
+        else:
+            # Nothing was written: the output of this job does not exist
+            record['error'] = ("Cancelled before the first page" if stats.get('cancelled')
+                               else "No pages to process") + ", output not written"
+            log(f"❌ {record['error']}")
+        if stats.get('failed_pages'):
+            record['failed_pages'] = stats['failed_pages']
+        if stats.get('profile'):
+            record['profile'] = stats['profile']['dir']
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        log(f"❌ Error: {e}")
+        from metrics import FILES
+        FILES.inc(status='failed')
+    record['elapsed'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def build_jobs(args, defaults: dict) -> list:
+    """Combine positional inputs and manifest entries into job dicts"""
+    entries = []
+    if args.manifest:
+        entries.extend(load_manifest(args.manifest))
+    for path in expand_inputs(args.inputs):
+        entries.append({'input': path, 'output': None, 'options': {}})
+
+    jobs = []
+    for entry in entries:
+        options = dict(defaults)
+        options.update(entry['options'])
+        output = entry['output'] or default_output_path(entry['input'], options.get('hide_text', False),
+                                                        args.output_dir)
+        if args.previous_dir and 'previous_source' not in entry['options']:
+            # <previous-dir>/<name>.pdf and its searchable PDF with the usual name next to it
+            previous = os.path.join(args.previous_dir, os.path.basename(entry['input']))
+            options['previous_source'] = previous
+            options['previous_output'] = default_output_path(previous, options.get('hide_text', False))
+        job = {'input': entry['input'], 'output': output, 'options': options}
+        if 'priority' in entry:
+            job['priority'] = entry['priority']
+        jobs.append(job)
+    return jobs
+
+
+def add_option_arguments(parser):
+    """Add the per-file processing option flags (shared with watch_service.py)"""
+    options = parser.add_argument_group('processing options (override settings and manifest defaults)')
+    options.add_argument('--hide-text', dest='hide_text', action='store_true', default=None)
+    options.add_argument('--visible-text', dest='hide_text', action='store_false')
+    options.add_argument('--flip-x', dest='flip_x', action='store_true', default=None)
+    options.add_argument('--no-flip-x', dest='flip_x', action='store_false')
+    options.add_argument('--flip-y', dest='flip_y', action='store_true', default=None)
+    options.add_argument('--no-flip-y', dest='flip_y', action='store_false')
+    options.add_argument('--top-shift', dest='top_shift_px', type=float)
+    options.add_argument('--font-size', dest='font_size', type=int)
+    options.add_argument('--dpi', type=int)
+    options.add_argument('--full-render', dest='clip_to_content', action='store_false', default=None,
+                         help='Rasterize whole vector pages instead of their content bounding box')
+    options.add_argument('--no-ink-crop', dest='crop_to_ink', action='store_false', default=None,
+                         help='Send whole pages to OCR: no cropping to the inked area, no skipping of blank pages')
+    options.add_argument('--ink-threshold', dest='ink_threshold', type=int, metavar='0-255',
+                         help='Gray level below which a pixel counts as ink for cropping and blank pages '
+                              '(default 200; raise it for faint scans)')
+    options.add_argument('--color-mode', choices=('rgb', 'gray', 'bitonal'),
+                         help='Render colorspace; gray/bitonal cut render memory ~3x on monochrome sets')
+    options.add_argument('--hybrid-text', dest='hybrid_text', action='store_true', default=None,
+                         help="Use the PDF's own text where it exists and OCR only the rest")
+    options.add_argument('--orientation', choices=('prepass', 'engine'),
+                         help="Page orientation: thumbnail pre-pass honouring /Rotate (default) "
+                              "or the OCR engine's classifier on the full image")
+    options.add_argument('--render-process', dest='render_process', action='store_true', default=None,
+                         help='Render pages ahead in a separate process (rasters passed in shared memory)')
+    options.add_argument('--memory-budget', dest='memory_budget', type=int, metavar='MB',
+                         help='Admit pages only within this process memory budget; pages that do not fit '
+                              'are rendered at a lower DPI or OCRed in bands')
+    options.add_argument('--page-timeout', dest='page_timeout', type=float, metavar='SEC',
+                         help='Run OCR in a supervised worker process; a page that takes longer or crashes '
+                              'it is retried at a lower DPI, then kept without OCR')
+    options.add_argument('--retry-dpi', dest='retry_dpi', type=int,
+                         help='DPI for the retry of a failed page (default: two thirds of --dpi)')
+    options.add_argument('--linearize', action='store_true', default=None,
+                         help='Write linearized PDFs (fast web view: page 1 opens before the whole file arrives)')
+    options.add_argument('--text-overlay', dest='text_overlay', action='store_true', default=None,
+                         help='Keep the original pages and add only the OCR text layer '
+                              '(no re-rendered page images, smaller output)')
+    options.add_argument('--garbage', type=int, choices=range(5), metavar='0-4',
+                         help='Output garbage collection: 3 merges duplicate objects (default), '
+                              '4 also duplicate streams (slower), 0 keeps everything')
+    options.add_argument('--profile', action='store_true', default=None,
+                         help='Profile every stage and page into <output>_profile/ (pstats files, '
+                              'collapsed stacks for flame graphs) and print the top hotspots')
+    options.add_argument('--page-index', dest='page_index', metavar='SQLITE',
+                         help='Shared index of recognized pages; repeated sheets reuse their OCR results '
+                              '(":memory:": only repeated sheets within each file; default: no index)')
+    options.add_argument('--near-duplicates', dest='near_duplicates', type=int, metavar='BITS',
+                         help='With --page-index, also reuse results of visually identical pages within BITS '
+                              'of dhash distance')
+    return options
+
+
+def option_defaults(args) -> dict:
+    """Default options from --settings overridden by explicit CLI flags"""
+    defaults = load_settings(args.settings) if args.settings else {}
+    defaults.update(coerce_options({key: getattr(args, key, None) for key in PROCESS_OPTIONS}))
+    return defaults
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Create searchable PDFs from drawings without the GUI.')
+    parser.add_argument('inputs', nargs='*', help='PDF files, directories or glob patterns')
+    parser.add_argument('-m', '--manifest', help='JSON or CSV manifest with per-file options')
+    parser.add_argument('-o', '--output-dir', help='Directory for results (default: next to each input)')
+    parser.add_argument('--settings', help='settings.json to use as default options (GUI format)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Files processed concurrently (default: 1)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='Global CPU thread budget shared by all jobs (default: CPU count)')
+    parser.add_argument('--schedule', choices=('files', 'pages'), default='files',
+                        help="'files': each job processes whole files; 'pages': files are split into page "
+                             "chunks balanced across the jobs with work stealing (see batch_scheduler.py)")
+    parser.add_argument('--chunk-pages', type=int, default=20, metavar='N',
+                        help='Pages per chunk with --schedule pages (default: 20)')
+    parser.add_argument('--rec-cache', type=int, default=0, metavar='N',
+                        help='Run detection and recognition separately and cache up to N recognized '
+                             'line crops per worker (repeated title blocks and notes)')
+    parser.add_argument('--summary', help="Write the JSON summary to this path ('-' for stdout)")
+    parser.add_argument('--previous-dir', help='Folder with the previous version of the inputs and their '
+                                               'searchable PDFs; unchanged pages are carried over')
+    parser.add_argument('--skip-existing', action='store_true', help='Skip files whose output already exists')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the final result line')
+
+    add_option_arguments(parser)
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    parser, args = parse_args(argv)
+
+    try:
+        defaults = option_defaults(args)
+    except Exception as e:
+        parser.print_usage(sys.stderr)
+        print(f"Cannot read settings: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    try:
+        jobs = build_jobs(args, defaults)
+    except Exception as e:
+        print(f"Cannot read manifest: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if not jobs:
+        parser.print_usage(sys.stderr)
+        print("No input files found", file=sys.stderr)
+        return EXIT_USAGE
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # Page chunks keep every job busy even with fewer files than jobs
+    n_jobs = max(1, args.jobs if args.schedule == 'pages' else min(args.jobs, len(jobs)))
+    cpu_threads = max(1, args.workers // n_jobs)
+    started = time.time()
+    results = []
+    # With the summary on stdout all progress output goes to stderr
+    log_stderr = args.summary == '-'
+    log_out = sys.stderr if log_stderr else sys.stdout
+
+    pending = []
+    for job in jobs:
+        if not os.path.exists(job['input']):
+            results.append({'input': job['input'], 'output': job['output'], 'status': 'failed',
+                            'pages': 0, 'blocks': 0, 'timings': {}, 'elapsed': 0.0,
+                            'error': 'Input file not found'})
+        elif args.skip_existing and os.path.exists(job['output']):
+            results.append({'input': job['input'], 'output': job['output'], 'status': 'skipped',
+                            'pages': 0, 'blocks': 0, 'timings': {}, 'elapsed': 0.0, 'error': None})
+        else:
+            pending.append(job)
+
+    if not args.quiet:
+        print(f"🚀 {len(pending)} file(s), {n_jobs} concurrent job(s), {cpu_threads} CPU thread(s) each",
+              file=log_out, flush=True)
+
+    if args.schedule == 'pages' and pending:
+        from batch_scheduler import run_batch
+        results.extend(run_batch(pending, n_jobs, cpu_threads, args.rec_cache, args.chunk_pages, args.quiet,
+                                 log=lambda msg: print(msg, file=log_out, flush=True), log_stderr=log_stderr))
+    elif n_jobs == 1:
+        init_worker(cpu_threads, args.rec_cache, log_stderr)
+        for job in pending:
+            results.append(run_job(job, args.quiet))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_worker,
+                                 initargs=(cpu_threads, args.rec_cache, log_stderr)) as pool:
+            futures = [pool.submit(run_job, job, args.quiet) for job in pending]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+    order = {job['input']: i for i, job in enumerate(jobs)}
+    results.sort(key=lambda r: order.get(r['input'], 0))
+    failed = sum(1 for r in results if r['status'] == 'failed')
+    summary = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'elapsed': round(time.time() - started, 3),
+        'jobs': n_jobs,
+        'cpu_threads_per_job': cpu_threads,
+        'totals': {
+            'files': len(results),
+            'ok': sum(1 for r in results if r['status'] == 'ok'),
+            'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+            'failed': failed,
+            'pages': sum(r['pages'] for r in results),
+            'blocks': sum(r['blocks'] for r in results),
+        },
+        'files': results,
+    }
+
+    if log_stderr:
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as fh:
+            json.dump(summary, fh, ensure_ascii=False, indent=2)
+
+    totals = summary['totals']
+    print(f"{'✅' if not failed else '❌'} {totals['ok']}/{totals['files']} succeeded, "
+          f"{totals['skipped']} skipped, {failed} failed, {totals['pages']} pages, "
+          f"{totals['blocks']} OCR blocks in {summary['elapsed']}s", file=log_out)
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Page-level scheduling of a batch across worker processes.
+
+Running a batch file by file (or one file per worker) leaves cores idle at
+the end: one 800-page file keeps a single worker busy long after fifty
+2-page files are done. Here every file is split into chunks of a few pages
+(process_pdf(page_range=...)), the chunks are dealt to one deque per
+worker, whole files at a time, largest and most urgent files first, and a
+worker that runs out of work steals chunks from the busiest other deque.
+Each output is assembled from its chunk parts as soon as the last chunk of
+that file is done, so small files are finished early instead of at the end
+of the batch.
+
+    records = run_batch(jobs, workers=4, cpu_threads=2, chunk_pages=20)
+
+jobs are batch_cli job dicts ({'input', 'output', 'options'} and optionally
+'priority': files with a higher priority are started first and stolen
+first); the result is one run_job-style record per job.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+
+from batch_cli import init_worker, run_job
+from pdf_output import save_pdf
+from profiler import profile_dir
+
+
+class StealingQueues:
+    """One deque of chunk tasks per worker with work stealing.
+
+    A worker takes its own tasks from the front (priority order, chunks of a
+    file in page order). An idle worker steals from the deque whose front
+    task has the highest priority (most queued pages on a tie), taking the
+    last task of that priority, i.e. the end of the file its owner is
+    working on.
+    """
+
+    def __init__(self, workers: int):
+        self.queues = [deque() for _ in range(max(1, int(workers)))]
+        self.lock = threading.Lock()
+        self.steals = 0
+
+    @staticmethod
+    def _order(task):
+        return -task['priority'], task['file'], task['index']
+
+    def deal(self, files: list):
+        """Give every file's chunks to the least loaded worker, big and urgent files first"""
+        load = [0] * len(self.queues)
+        with self.lock:
+            for chunks in sorted(files, key=lambda c: (-c[0]['priority'], -sum(t['pages'] for t in c),
+                                                       c[0]['file'])):
+                worker = load.index(min(load))
+                self.queues[worker].extend(chunks)
+                load[worker] += sum(t['pages'] for t in chunks)
+            for n, queue in enumerate(self.queues):
+                self.queues[n] = deque(sorted(queue, key=self._order))
+
+    def take(self, worker: int):
+        """Next task for a worker (its own or a stolen one); None when all are empty"""
+        with self.lock:
+            own = self.queues[worker]
+            if own:
+                return own.popleft()
+            victims = [q for q in self.queues if q]
+            if not victims:
+                return None
+            victim = max(victims, key=lambda q: (q[0]['priority'], sum(t['pages'] for t in q)))
+            top = victim[0]['priority']
+            for i in range(len(victim) - 1, -1, -1):
+                if victim[i]['priority'] == top:
+                    task = victim[i]
+                    del victim[i]
+                    self.steals += 1
+                    return task
+
+    def drop(self, file: int) -> int:
+        """Remove the queued chunks of a file (one of its chunks failed)"""
+        dropped = 0
+        with self.lock:
+            for n, queue in enumerate(self.queues):
+                kept = deque(t for t in queue if t['file'] != file)
+                dropped += len(queue) - len(kept)
+                self.queues[n] = kept
+        return dropped
+
+    def queued(self) -> int:
+        with self.lock:
+            return sum(len(q) for q in self.queues)
+
+
+def _empty_record(job: dict, error=None) -> dict:
+    return {'input': job['input'], 'output': job['output'], 'status': 'failed', 'pages': 0,
+            'blocks': 0, 'timings': {}, 'elapsed': 0.0, 'error': error}
+
+
+def assemble(parts: list, output_path: str, garbage: int = 3, linearize: bool = False) -> dict:
+    """Concatenate chunk outputs into the final PDF; returns the save_pdf() result"""
+    merged = fitz.open()
+    try:
+        for part in parts:
+            with fitz.open(part) as doc:
+                merged.insert_pdf(doc)
+        tmp = f"{output_path}.part"
+        # Chunks embed the same OCR font; garbage collection keeps a single copy
+        saved = save_pdf(merged, tmp, max(3, garbage), linearize)
+        os.replace(tmp, output_path)
+    finally:
+        merged.close()
+    return saved
+
+
+def run_batch(jobs: list, workers: int = 2, cpu_threads=None, rec_cache: int = 0, chunk_pages: int = 20,
+              quiet: bool = False, log=print, progress_callback=None, cancel_event=None,
+              log_stderr: bool = False) -> list:
+    """Process jobs as page chunks on `workers` processes; returns one record per job.
+
+    progress_callback receives {'event': 'chunk', 'input', 'pages', 'status'}
+    after every chunk and {'event': 'file', **record} when a file is
+    finished. cancel_event stops handing out chunks; files that are not
+    complete then are reported as 'cancelled' and not written. log_stderr
+    sends the workers' file logs to stderr (stdout reserved for a summary).
+    """
+    chunk_pages = max(1, int(chunk_pages))
+    cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+    work_dir = tempfile.mkdtemp(prefix='pdf2searchable-batch-')
+    records = [None] * len(jobs)
+    chunks_of = {}  # job number -> its chunk tasks
+    state_lock = threading.Lock()
+
+    def report(event, **data):
+        if progress_callback:
+            try:
+                progress_callback(dict(event=event, **data))
+            except Exception as cb_err:
+                print(f"Progress callback error: {cb_err}")
+
+    for seq, job in enumerate(jobs):
+        try:
+            with fitz.open(job['input']) as doc:
+                pages = len(doc)
+        except Exception as e:
+            records[seq] = _empty_record(job, f"{type(e).__name__}: {e}")
+            continue
+        starts = list(range(0, pages, chunk_pages)) or [0]
+        chunks = []
+        for index, start in enumerate(starts):
+            # A file of one chunk is written straight to its output
+            part = job['output'] if len(starts) == 1 else os.path.join(work_dir, f"{seq:05d}.{index:05d}.pdf")
+            chunks.append({'file': seq, 'index': index, 'priority': int(job.get('priority') or 0),
+                           'page_range': [start, min(start + chunk_pages, pages)],
+                           'pages': min(start + chunk_pages, pages) - start, 'part': part})
+        chunks_of[seq] = chunks
+        records[seq] = {'input': job['input'], 'output': job['output'], 'status': 'running', 'pages': 0,
+                        'blocks': 0, 'timings': {}, 'error': None, 'chunks': len(chunks),
+                        'chunks_done': 0, 'started': None}
+
+    queues = StealingQueues(workers)
+    queues.deal(list(chunks_of.values()))
+    if not quiet:
+        log(f"🧩 {sum(map(len, chunks_of.values()))} chunk(s) of up to {chunk_pages} pages from "
+            f"{len(chunks_of)} file(s) on {len(queues.queues)} worker(s)")
+
+    def finish_chunk(task, result):
+        job = jobs[task['file']]
+        record = records[task['file']]
+        with state_lock:
+            if record['status'] != 'running':
+                return  # the file already failed
+            if result['status'] != 'ok':
+                record.update(status='failed', error=f"Pages {task['page_range'][0] + 1}-{task['page_range'][1]}: "
+                                                      f"{result['error']}")
+                queues.drop(task['file'])
+            else:
+                record['pages'] += result['pages']
+                record['blocks'] += result['blocks']
+                for stage, seconds in result['timings'].items():
+                    record['timings'][stage] = round(record['timings'].get(stage, 0.0) + seconds, 3)
+                if result.get('failed_pages'):
+                    record.setdefault('failed_pages', []).extend(result['failed_pages'])
+                record['chunks_done'] += 1
+                record['output_bytes'] = result.get('output_bytes', 0)  # final size once assembled
+            complete = record['status'] == 'running' and record['chunks_done'] == record['chunks']
+        report('chunk', input=job['input'], pages=task['pages'], status=result['status'])
+        if record['status'] == 'failed':
+            if not quiet:
+                log(f"[{os.path.basename(job['input'])}] ❌ {record['error']}")
+            report('file', **record)
+            return
+        if not complete:
+            return
+        try:
+            if record['chunks'] > 1:
+                saved = assemble([t['part'] for t in chunks_of[task['file']]], job['output'],
+                                 job['options'].get('garbage', 3), job['options'].get('linearize', False))
+                record['output_bytes'] = saved['bytes']
+            record['status'] = 'ok'
+        except Exception as e:
+            record.update(status='failed', error=f"Assembly failed: {type(e).__name__}: {e}")
+        record['elapsed'] = round(time.perf_counter() - record['started'], 3)
+        if not quiet:
+            mark = '✅' if record['status'] == 'ok' else f"❌ {record['error']}"
+            log(f"[{os.path.basename(job['input'])}] {mark} {record['pages']} pages from "
+                f"{record['chunks']} chunk(s) in {record['elapsed']}s")
+        report('file', **record)
+
+    def drive(worker):
+        pool = ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                                   initargs=(cpu_threads, rec_cache, log_stderr))
+        try:
+            while not (cancel_event is not None and cancel_event.is_set()):
+                task = queues.take(worker)
+                if task is None:
+                    return
+                job = jobs[task['file']]
+                with state_lock:
+                    if records[task['file']]['started'] is None:
+                        records[task['file']]['started'] = time.perf_counter()
+                chunk = {'input': job['input'], 'output': task['part'],
+                         'options': dict(job['options'], page_range=task['page_range'])}
+                if task['part'] != job['output']:
+                    chunk['options']['linearize'] = False  # only the assembled file is linearized
+                if job['options'].get('profile'):
+                    # Next to the final output, not the temporary part
+                    start, stop = task['page_range']
+                    chunk['options']['profile'] = os.path.join(profile_dir(job['output']),
+                                                               f"pages_{start + 1:04d}-{stop:04d}")
+                try:
+                    result = pool.submit(run_job, chunk, True).result()
+                except BrokenProcessPool as e:
+                    # The worker process died (out of memory, native crash): fail the chunk, start a new one
+                    result = _empty_record(chunk, f"Worker process died: {e}")
+                    pool.shutdown(wait=False)
+                    pool = ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                                               initargs=(cpu_threads, rec_cache, log_stderr))
+                finish_chunk(task, result)
+        finally:
+            pool.shutdown(wait=True)
+
+    threads = [threading.Thread(target=drive, args=(n,), name=f'batch-worker-{n}', daemon=True)
+               for n in range(len(queues.queues))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for seq, record in enumerate(records):
+        if record['status'] == 'running':
+            record.update(status='cancelled', error='Cancelled before all pages were processed')
+        record.setdefault('elapsed', round(time.perf_counter() - record['started'], 3)
+                          if record.get('started') else 0.0)
+        record.pop('started', None)
+        record.pop('chunks_done', None)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    if not quiet and queues.steals:
+        log(f"🔀 {queues.steals} chunk(s) moved to idle workers")
+    return records
@@ -4,8 +4,14 @@
 Скрипт для загрузки моделей PaddleOCR в локальную папку models
 """
 
+import argparse
+import hashlib
+import json
 import os
 import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import requests
 import zipfile
@@ -32,58 +38,257 @@ def create_models_directory():
     
     return base_path
 
-def download_paddleocr_models(base_path):
+# URL для загрузки моделей PaddleOCR PP-OCRv5
+DEFAULT_BASE_URL = 'https://paddleocr.bj.bcebos.com'
+MODEL_FILES = {
+    'det': ('PP-OCRv5/english/en_PP-OCRv5_det_infer.tar', 'det'),
+    'rec': ('PP-OCRv5/english/en_PP-OCRv5_rec_infer.tar', 'rec'),
+    'cls': ('dygraph_v2.0/ch/ch_ppocr_mobile_v2.0_cls_infer.tar', 'cls'),
+}
+MANIFEST_PATH = Path(__file__).parent / "models_manifest.json"
+CHUNK_SIZE = 1024 * 1024
+
+
+def load_manifest(path):
     """
-    Загружает модели PaddleOCR
+    Читает манифест контрольных сумм {имя_архива: sha256}
     
-    Args:
-        base_path (Path): Базовый путь к папке models
+    Returns:
+        dict: пустой словарь, если файла нет
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def save_manifest(path, manifest):
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _sha256_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+
+class _TeeReader:
+    """
+    Файловый объект для tarfile: читает ответ по частям, одновременно
+    сохраняя его в кэш и считая SHA-256 (распаковка идёт во время загрузки)
     """
+
+    def __init__(self, chunks, out_file, digest):
+        self.chunks = chunks
+        self.out_file = out_file
+        self.digest = digest
+        self.buffer = bytearray()
+        self.offset = 0  # начало непрочитанных данных в buffer
+        self.size = 0
+
+    def _feed(self, chunk):
+        self.out_file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def read(self, n=-1):
+        while n < 0 or len(self.buffer) - self.offset < n:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self._feed(chunk)
+            self.buffer += chunk
+        end = len(self.buffer) if n < 0 else min(len(self.buffer), self.offset + n)
+        data = bytes(self.buffer[self.offset:end])
+        self.offset = end
+        # Прочитанное начало удаляется, только когда оно больше остатка: каждый байт копируется O(1) раз
+        if self.offset > len(self.buffer) - self.offset:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        return data
+
+    def drain(self):
+        """Дочитывает остаток ответа (хвост архива после последнего файла)"""
+        for chunk in self.chunks:
+            self._feed(chunk)
+
+
+def _safe_members(tar, extract_to):
+    """Пропускает элементы архива, которые выходят за пределы папки назначения"""
+    root = os.path.realpath(extract_to)
+    for member in tar:
+        target = os.path.realpath(os.path.join(root, member.name))
+        if not (target == root or target.startswith(root + os.sep)) or member.issym() or member.islnk():
+            logger.warning(f"⚠️ Пропущен небезопасный элемент архива: {member.name}")
+            continue
+        yield member
+
+
+def _extract_stream(fileobj, extract_to):
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        for member in _safe_members(tar, extract_to):
+            tar.extract(member, extract_to)
+
+
+def _install(staging, extract_to):
+    """Переносит распакованные файлы из временной папки на место"""
+    extract_to.mkdir(parents=True, exist_ok=True)
+    for item in staging.iterdir():
+        target = extract_to / item.name
+        if target.is_dir():
+            shutil.rmtree(target)
+        elif target.exists():
+            target.unlink()
+        shutil.move(str(item), str(target))
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def fetch_model(model_type, rel_url, extract_to, cache_dir, base_url=DEFAULT_BASE_URL,
+                mirror=None, expected_sha=None, retries=3, timeout=60):
+    """
+    Загружает один архив модели с докачкой (HTTP Range), проверяет SHA-256
+    и распаковывает его в extract_to
     
-    # URL для загрузки моделей PaddleOCR PP-OCRv5
-    model_urls = {
-        'det': {
-            'url': 'https://paddleocr.bj.bcebos.com/PP-OCRv5/english/en_PP-OCRv5_det_infer.tar',
-            'filename': 'en_PP-OCRv5_det_infer.tar',
-            'extract_to': base_path / 'det'
-        },
-        'rec': {
-            'url': 'https://paddleocr.bj.bcebos.com/PP-OCRv5/english/en_PP-OCRv5_rec_infer.tar',
-            'filename': 'en_PP-OCRv5_rec_infer.tar',
-            'extract_to': base_path / 'rec'
-        },
-        'cls': {
-            'url': 'https://paddleocr.bj.bcebos.com/dygraph_v2.0/ch/ch_ppocr_mobile_v2.0_cls_infer.tar',
-            'filename': 'ch_ppocr_mobile_v2.0_cls_infer.tar',
-            'extract_to': base_path / 'cls'
-        }
-    }
-    
-    for model_type, info in model_urls.items():
-        logger.info(f"📥 Загрузка модели {model_type}...")
-        
+    Архив остаётся в cache_dir, повторный запуск берёт его оттуда без сети.
+    mirror - локальная папка с архивами (например, кэш другого узла).
+    
+    Returns:
+        str: SHA-256 архива
+    """
+    filename = rel_url.rsplit('/', 1)[-1]
+    cached = cache_dir / filename
+    partial = cache_dir / f"{filename}.part"
+    staging = cache_dir / f".{model_type}.extract"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    if not cached.exists() and mirror:
+        mirrored = Path(mirror) / filename
+        if mirrored.exists():
+            logger.info(f"📂 {model_type}: копия из зеркала {mirrored}")
+            shutil.copyfile(mirrored, partial)
+            os.replace(partial, cached)
+
+    if cached.exists():
+        sha = _sha256_file(cached).hexdigest()
+        if expected_sha and sha != expected_sha:
+            logger.warning(f"⚠️ {model_type}: архив в кэше повреждён, загружаем заново")
+            cached.unlink()
+        else:
+            staging.mkdir(parents=True)
+            with open(cached, 'rb') as fh:
+                _extract_stream(fh, staging)
+            _install(staging, extract_to)
+            logger.info(f"✅ {model_type}: распакован из кэша {cached}")
+            return sha
+
+    url = f"{base_url.rstrip('/')}/{rel_url}"
+    for attempt in range(1, retries + 1):
+        offset = partial.stat().st_size if partial.exists() else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
         try:
-            # Загружаем файл
-            response = requests.get(info['url'], stream=True)
-            response.raise_for_status()
-            
-            # Сохраняем во временный файл
-            temp_file = base_path / info['filename']
-            with open(temp_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            logger.info(f"✅ Модель {model_type} загружена: {temp_file}")
-            
-            # Извлекаем архив
-            extract_tar_file(temp_file, info['extract_to'])
-            
-            # Удаляем временный файл
-            temp_file.unlink()
-            logger.info(f"🗑️ Временный файл удален: {temp_file}")
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка загрузки модели {model_type}: {e}")
+            with requests.get(url, stream=True, headers=headers, timeout=timeout) as response:
+                if response.status_code == 416:
+                    # Файл уже скачан полностью
+                    response.close()
+                    os.replace(partial, cached)
+                    return fetch_model(model_type, rel_url, extract_to, cache_dir, base_url,
+                                       None, expected_sha, retries, timeout)
+                response.raise_for_status()
+                resumed = offset and response.status_code == 206
+                digest = hashlib.sha256()
+                chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                if resumed:
+                    # Докачка: распаковка только после загрузки всего архива
+                    logger.info(f"⏯️ {model_type}: докачка с {offset // 1024} КБ")
+                    _sha256_file(partial, digest)
+                    with open(partial, 'ab') as out:
+                        for chunk in chunks:
+                            out.write(chunk)
+                            digest.update(chunk)
+                else:
+                    logger.info(f"📥 {model_type}: загрузка {url}")
+                    staging.mkdir(parents=True, exist_ok=True)
+                    with open(partial, 'wb') as out:
+                        reader = _TeeReader(chunks, out, digest)
+                        _extract_stream(reader, staging)
+                        reader.drain()
+        except (requests.RequestException, OSError, tarfile.TarError) as e:
+            logger.warning(f"⚠️ {model_type}: попытка {attempt}/{retries} не удалась: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+            if attempt == retries:
+                raise
+            time.sleep(2 * attempt)
+            continue
+
+        sha = digest.hexdigest()
+        if expected_sha and sha != expected_sha:
+            partial.unlink()
+            shutil.rmtree(staging, ignore_errors=True)
+            raise ValueError(f"SHA-256 не совпадает для {filename}: {sha} (ожидалось {expected_sha})")
+        os.replace(partial, cached)
+        if staging.exists():
+            _install(staging, extract_to)
+            logger.info(f"✅ {model_type}: загружен и распакован в {extract_to}")
+        else:
+            extract_tar_file(cached, extract_to)
+        return sha
+
+
+def download_paddleocr_models(base_path, workers=3, cache_dir=None, base_url=DEFAULT_BASE_URL,
+                              mirror=None, manifest_path=MANIFEST_PATH, update_manifest=False,
+                              models=None):
+    """
+    Загружает модели PaddleOCR параллельно
+    
+    Args:
+        base_path (Path): Базовый путь к папке models
+        workers (int): Число одновременных загрузок
+        cache_dir (Path): Папка для архивов (по умолчанию models/.cache)
+        base_url (str): Адрес сервера моделей (или локального HTTP-зеркала)
+        mirror (str): Локальная папка с уже скачанными архивами
+        manifest_path (Path): Манифест SHA-256 для проверки архивов
+        update_manifest (bool): Записать в манифест суммы загруженных архивов
+        models (list): Какие модели загружать (по умолчанию все)
+    
+    Returns:
+        bool: True, если все модели установлены
+    """
+    cache_dir = Path(cache_dir) if cache_dir else base_path / '.cache'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+    if not manifest and not update_manifest:
+        logger.warning(f"⚠️ Манифест {manifest_path} не найден - архивы не проверяются "
+                       f"(создайте его с --update-manifest на доверенной машине)")
+
+    selected = {k: v for k, v in MODEL_FILES.items() if not models or k in models}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {}
+        for model_type, (rel_url, folder) in selected.items():
+            filename = rel_url.rsplit('/', 1)[-1]
+            futures[pool.submit(fetch_model, model_type, rel_url, base_path / folder, cache_dir,
+                                base_url, mirror, manifest.get(filename))] = (model_type, filename)
+        for future in as_completed(futures):
+            model_type, filename = futures[future]
+            try:
+                sha = future.result()
+                if update_manifest:
+                    manifest[filename] = sha
+            except Exception as e:
+                failed.append(model_type)
+                logger.error(f"❌ Ошибка загрузки модели {model_type}: {e}")
+
+    if update_manifest:
+        save_manifest(manifest_path, manifest)
+        logger.info(f"📝 Манифест обновлён: {manifest_path}")
+    return not failed
+
 
 def extract_tar_file(tar_path, extract_to):
     """
@@ -94,15 +299,13 @@ def extract_tar_file(tar_path, extract_to):
         extract_to (Path): Папка для извлечения
     """
     try:
-        import tarfile
-        
         with tarfile.open(tar_path, 'r') as tar:
-            tar.extractall(extract_to)
+            tar.extractall(extract_to, members=list(_safe_members(tar, extract_to)))
         
         logger.info(f"📦 Архив извлечен в: {extract_to}")
         
         # Показываем содержимое извлеченной папки
-        extracted_files = list(extract_to.rglob('*'))
+        extracted_files = list(Path(extract_to).rglob('*'))
         logger.info(f"📋 Извлеченные файлы: {[f.name for f in extracted_files if f.is_file()]}")
         
     except Exception as e:
@@ -163,10 +366,31 @@ def copy_models_from_default_location():
     except Exception as e:
         logger.error(f"❌ Ошибка копирования моделей: {e}")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Загрузка моделей PaddleOCR в папку models')
+    parser.add_argument('-j', '--jobs', type=int, default=3, help='Одновременных загрузок (по умолчанию 3)')
+    parser.add_argument('--cache', help='Папка для архивов (по умолчанию models/.cache)')
+    parser.add_argument('--mirror', help='Локальная папка с архивами (без сети)')
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL,
+                        help='Сервер моделей или локальное HTTP-зеркало')
+    parser.add_argument('--manifest', default=str(MANIFEST_PATH), help='Манифест SHA-256')
+    parser.add_argument('--update-manifest', action='store_true',
+                        help='Записать суммы загруженных архивов в манифест')
+    parser.add_argument('--no-fallback', action='store_true',
+                        help='Не пробовать загрузку через PaddleOCR при ошибке')
+    parser.add_argument('models', nargs='*', help=f"Какие модели загружать: {', '.join(MODEL_FILES)} (по умолчанию все)")
+    args = parser.parse_args(argv)
+    unknown = [m for m in args.models if m not in MODEL_FILES]
+    if unknown:
+        parser.error(f"неизвестные модели: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None):
     """
     Основная функция для загрузки моделей
     """
+    args = parse_args(argv)
     logger.info("🚀 Запуск загрузки моделей PaddleOCR")
     
     try:
@@ -176,7 +400,15 @@ def main():
         # Пробуем загрузить модели напрямую
         logger.info("📥 Попытка прямой загрузки моделей...")
         try:
-            download_paddleocr_models(base_path)
+            ok = download_paddleocr_models(base_path, workers=args.jobs, cache_dir=args.cache,
+                                           base_url=args.base_url, mirror=args.mirror,
+                                           manifest_path=args.manifest,
+                                           update_manifest=args.update_manifest,
+                                           models=args.models)
+            if not ok:
+                if args.no_fallback:
+                    sys.exit(1)
+                raise RuntimeError("не все модели загружены")
         except Exception as e:
             logger.warning(f"⚠️ Прямая загрузка не удалась: {e}")
             logger.info("🔄 Переход к альтернативному способу...")
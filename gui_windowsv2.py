@@ -3,10 +3,24 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import threading
+import queue
 import os
 import json
+import time
+from collections import deque
 from pathlib import Path
-from run_process_0100 import process_pdf
+import base64
+import fitz
+from run_process_0100 import process_pdf, create_ocr_engine, recognize_preview_page, rotation_from_raw, render_preview
+from ocr_utils_fixed import TechnicalOCRProcessor
+from batch_scheduler import run_batch
+
+LOG_MAX_LINES = 2000      # lines kept in the log view (older lines are dropped)
+LOG_POLL_MS = 100         # how often worker events are drained into the UI
+LOG_BATCH_LIMIT = 5000    # events handled per poll so the UI thread never stalls
+PAGE_TIMEOUT = 120        # seconds a page may take in the isolated OCR worker
+BATCH_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 4))  # OCR processes of a balanced batch
+
 
 class ModernApp:
     def __init__(self, root):
@@ -16,6 +30,7 @@ class ModernApp:
         self.setup_styles()
         self.create_widgets()
         self.load_settings()
+        self.root.after(LOG_POLL_MS, self.drain_events)
         
     def setup_window(self):
         """Настройка основного окна"""
@@ -45,7 +60,27 @@ class ModernApp:
         self.flip_y_var = tk.BooleanVar(value=True)
         self.font_size_var = tk.IntVar(value=8)
         self.top_shift_var = tk.IntVar(value=20)
+        self.log_to_file_var = tk.BooleanVar(value=False)
+        self.isolate_ocr_var = tk.BooleanVar(value=False)
+        self.balance_batch_var = tk.BooleanVar(value=False)
+        self.profile_var = tk.BooleanVar(value=False)
+        self.linearize_var = tk.BooleanVar(value=False)
+        self.text_overlay_var = tk.BooleanVar(value=False)
+        self.crop_to_ink_var = tk.BooleanVar(value=True)
+        self.ink_threshold_var = tk.IntVar(value=200)
         self.batch_files = []  # список выбранных входных файлов для пакетной обработки
+        self.events = queue.Queue()  # worker -> UI: ('log', text) / ('call', func, args)
+        self.log_file = None
+        self.preview_window = None
+        self.preview_engine = None  # OCR engine kept for previews after the first use
+        self.preview_cache = {}     # (path, page index, text overlay, ink options) -> (ocr results, rotation, image shape)
+        self.preview_lock = threading.Lock()  # one preview OCR at a time on the shared engine
+        self.cancel_event = threading.Event()
+        self.progress_var = tk.DoubleVar(value=0)
+        self.progress_text_var = tk.StringVar(value="Idle")
+        self.progress_total = 0
+        self.progress_done = 0
+        self.progress_started = None
         
         # Путь к настройкам
         self.settings_path = Path(__file__).parent / 'settings.json'
@@ -118,6 +153,9 @@ class ModernApp:
         # Action buttons
         self.create_action_section(main_frame)
         
+        # Progress bar
+        self.create_progress_section(main_frame)
+        
         # Log section
         self.create_log_section(main_frame)
         
@@ -163,6 +201,11 @@ class ModernApp:
         ttk.Label(settings_frame, text="Top shift (px):").grid(row=0, column=2, sticky='e', padx=(0, 10))
         ttk.Entry(settings_frame, textvariable=self.top_shift_var, width=10).grid(row=0, column=3, sticky='w')
         
+        # Ink threshold: gray level below which a pixel counts as ink (cropping, blank pages)
+        ttk.Label(settings_frame, text="Ink threshold:").grid(row=1, column=0, sticky='e', padx=(0, 10), pady=(5, 0))
+        ttk.Spinbox(settings_frame, from_=1, to=255, textvariable=self.ink_threshold_var,
+                    width=10, command=self.save_settings).grid(row=1, column=1, sticky='w', pady=(5, 0))
+        
     def create_options_section(self, parent):
         """Create options section"""
         # Section frame
@@ -179,6 +222,43 @@ class ModernApp:
                                             variable=self.visible_hide_var, command=self.update_output_filename)
         self.visible_hide_cb.pack(anchor='w', pady=2)
         
+        # Full log to file checkbox
+        self.log_to_file_cb = ttk.Checkbutton(options_frame, text="Save full log to file (logs folder)",
+                                            variable=self.log_to_file_var, command=self.save_settings)
+        self.log_to_file_cb.pack(anchor='w', pady=2)
+        
+        # OCR in a supervised worker process: a hanging or crashing page cannot stop the run
+        self.isolate_ocr_cb = ttk.Checkbutton(options_frame,
+                                            text=f"Isolate OCR (skip pages that hang > {PAGE_TIMEOUT} s)",
+                                            variable=self.isolate_ocr_var, command=self.save_settings)
+        self.isolate_ocr_cb.pack(anchor='w', pady=2)
+        
+        # Batch split into page chunks shared by several OCR processes
+        self.balance_batch_cb = ttk.Checkbutton(options_frame,
+                                            text=f"Balance batch pages over {BATCH_WORKERS} OCR process(es)",
+                                            variable=self.balance_batch_var, command=self.save_settings)
+        self.balance_batch_cb.pack(anchor='w', pady=2)
+        
+        # cProfile / sampled stacks of every stage into <output>_profile
+        self.profile_cb = ttk.Checkbutton(options_frame, text="Profile (pstats and flame graph stacks next to the output)",
+                                        variable=self.profile_var, command=self.save_settings)
+        self.profile_cb.pack(anchor='w', pady=2)
+        
+        # Linearized output: page 1 shows before the whole file is downloaded
+        self.linearize_cb = ttk.Checkbutton(options_frame, text="Fast web view (linearized output)",
+                                          variable=self.linearize_var, command=self.save_settings)
+        self.linearize_cb.pack(anchor='w', pady=2)
+        
+        # Original pages are copied as they are, only the text layer is added
+        self.text_overlay_cb = ttk.Checkbutton(options_frame, text="Keep original pages (add text layer only)",
+                                             variable=self.text_overlay_var, command=self.save_settings)
+        self.text_overlay_cb.pack(anchor='w', pady=2)
+        
+        # OCR only the inked area; pages without ink are skipped (and logged)
+        self.crop_to_ink_cb = ttk.Checkbutton(options_frame, text="Crop OCR to ink (skip blank pages)",
+                                            variable=self.crop_to_ink_var, command=self.save_settings)
+        self.crop_to_ink_cb.pack(anchor='w', pady=2)
+        
     def create_action_section(self, parent):
         """Create action buttons section"""
         action_frame = ttk.Frame(parent)
@@ -188,10 +268,28 @@ class ModernApp:
                                  command=self.on_run, style='Success.TButton')
         self.run_btn.pack(side=tk.LEFT, padx=(0, 10))
         
+        self.cancel_btn = ttk.Button(action_frame, text="⏹ Cancel",
+                                    command=self.on_cancel, style='Modern.TButton', state='disabled')
+        self.cancel_btn.pack(side=tk.LEFT, padx=(0, 10))
+        
+        self.preview_btn = ttk.Button(action_frame, text="🔍 Preview",
+                                     command=self.open_preview, style='Modern.TButton')
+        self.preview_btn.pack(side=tk.LEFT, padx=(0, 10))
+        
         self.clear_btn = ttk.Button(action_frame, text="🗑️ Clear Log", 
                                   command=self.clear_log, style='Modern.TButton')
         self.clear_btn.pack(side=tk.LEFT)
         
+    def create_progress_section(self, parent):
+        """Create progress bar with throughput and ETA"""
+        progress_frame = ttk.Frame(parent)
+        progress_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        self.progress_bar = ttk.Progressbar(progress_frame, variable=self.progress_var,
+                                            mode='determinate', maximum=1)
+        self.progress_bar.pack(fill=tk.X)
+        ttk.Label(progress_frame, textvariable=self.progress_text_var).pack(anchor='w', pady=(2, 0))
+        
     def create_log_section(self, parent):
         """Create log section"""
         # Section frame
@@ -257,7 +355,15 @@ class ModernApp:
                 'hide_text': self.hide_text_var.get(),
                 'visible_hide': self.visible_hide_var.get(),
                 'flip_x': self.flip_x_var.get(),
-                'flip_y': self.flip_y_var.get()
+                'flip_y': self.flip_y_var.get(),
+                'log_to_file': self.log_to_file_var.get(),
+                'isolate_ocr': self.isolate_ocr_var.get(),
+                'balance_batch': self.balance_batch_var.get(),
+                'profile': self.profile_var.get(),
+                'linearize': self.linearize_var.get(),
+                'text_overlay': self.text_overlay_var.get(),
+                'crop_to_ink': self.crop_to_ink_var.get(),
+                'ink_threshold': int(self.ink_threshold_var.get())
             }
             with open(self.settings_path, 'w', encoding='utf-8') as fh:
                 json.dump(data, fh, ensure_ascii=False, indent=2)
@@ -276,19 +382,163 @@ class ModernApp:
                     self.visible_hide_var.set(data.get('visible_hide', False))
                     self.flip_x_var.set(data.get('flip_x', True))
                     self.flip_y_var.set(data.get('flip_y', True))
+                    self.log_to_file_var.set(data.get('log_to_file', False))
+                    self.isolate_ocr_var.set(data.get('isolate_ocr', False))
+                    self.balance_batch_var.set(data.get('balance_batch', False))
+                    self.profile_var.set(data.get('profile', False))
+                    self.linearize_var.set(data.get('linearize', False))
+                    self.text_overlay_var.set(data.get('text_overlay', False))
+                    self.crop_to_ink_var.set(data.get('crop_to_ink', True))
+                    self.ink_threshold_var.set(int(data.get('ink_threshold', 200)))
         except Exception as e:
             self.log_message(f"Error loading settings: {e}")
     
+    def ink_options(self):
+        """crop_to_ink / ink_threshold for process_pdf and TechnicalOCRProcessor (UI thread only)"""
+        try:
+            threshold = min(max(int(self.ink_threshold_var.get()), 1), 255)
+        except (tk.TclError, ValueError):
+            threshold = 200  # поле ещё редактируется
+        return {'crop_to_ink': self.crop_to_ink_var.get(), 'ink_threshold': threshold}
+    
     def log_message(self, message):
-        """Add message to log"""
-        self.log.insert(tk.END, f"{message}\n")
-        self.log.see(tk.END)
-        self.root.update_idletasks()
+        """Queue a log line (safe to call from any thread)"""
+        self.events.put(('log', str(message)))
+    
+    def call_in_ui(self, func, *args):
+        """Run func(*args) on the UI thread with the next event batch"""
+        self.events.put(('call', func, args))
+    
+    def ask_in_ui(self, func, *args):
+        """call_in_ui for a worker thread that needs the result (e.g. a messagebox answer)"""
+        done = threading.Event()
+        answer = []
+        
+        def run():
+            try:
+                answer.append(func(*args))
+            finally:
+                done.set()
+        
+        self.call_in_ui(run)
+        done.wait()
+        return answer[0] if answer else None
+    
+    def drain_events(self):
+        """Tk poller: move queued worker events into the UI in one batch"""
+        lines = deque(maxlen=LOG_MAX_LINES)
+        calls = []
+        to_file = []
+        try:
+            for _ in range(LOG_BATCH_LIMIT):
+                item = self.events.get_nowait()
+                if item[0] == 'log':
+                    lines.append(item[1])
+                    to_file.append(item[1])
+                else:
+                    calls.append(item)
+        except queue.Empty:
+            pass
+        
+        if to_file and self.log_file is not None:
+            try:
+                self.log_file.write("\n".join(to_file) + "\n")
+                self.log_file.flush()
+            except Exception:
+                self.log_file = None
+        if lines:
+            self.log.insert(tk.END, "\n".join(lines) + "\n")
+            # Ring buffer: keep only the last LOG_MAX_LINES lines in the widget
+            line_count = int(self.log.index('end-1c').split('.')[0]) - 1
+            if line_count > LOG_MAX_LINES:
+                self.log.delete('1.0', f"{line_count - LOG_MAX_LINES + 1}.0")
+            self.log.see(tk.END)
+        for _, func, args in calls:
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.insert(tk.END, f"UI update error: {e}\n")
+        
+        delay = 1 if self.events.qsize() > 0 else LOG_POLL_MS
+        self.root.after(delay, self.drain_events)
+    
+    def open_log_file(self):
+        """Start a full log file for this run when enabled"""
+        self.close_log_file()
+        if not self.log_to_file_var.get():
+            return
+        try:
+            log_dir = Path(__file__).parent / 'logs'
+            log_dir.mkdir(exist_ok=True)
+            path = log_dir / time.strftime('pdf2searchable_%Y%m%d_%H%M%S.log')
+            self.log_file = open(path, 'w', encoding='utf-8')
+            self.log_message(f"📝 Full log: {path}")
+        except Exception as e:
+            self.log_message(f"Error opening log file: {e}")
+    
+    def close_log_file(self):
+        if self.log_file is not None:
+            try:
+                self.log_file.close()
+            except Exception:
+                pass
+            self.log_file = None
     
     def clear_log(self):
         """Clear log"""
         self.log.delete(1.0, tk.END)
     
+    def open_preview(self):
+        """Open (or focus) the layout preview window for the current input file"""
+        input_file = self.input_var.get()
+        if not input_file or not os.path.exists(input_file):
+            messagebox.showerror("Error", "Please select an existing input PDF file")
+            return
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_window.set_file(input_file)
+            self.preview_window.lift()
+            return
+        self.preview_window = PreviewWindow(self, input_file)
+    
+    def on_cancel(self):
+        """Request a clean stop after the current page"""
+        self.cancel_event.set()
+        self.cancel_btn.config(state='disabled')
+        self.log_message("⏹ Cancelling after the current page...")
+    
+    def start_progress(self, total_pages):
+        """Size the progress bar for a batch of total_pages pages"""
+        self.progress_total = max(1, total_pages)
+        self.progress_bar.config(maximum=self.progress_total)
+        self.update_progress()
+    
+    def on_progress(self, event):
+        """process_pdf progress callback (runs in the worker thread)"""
+        if event.get('event') == 'page':
+            self.progress_done += 1
+            self.call_in_ui(self.update_progress)
+    
+    def update_progress(self):
+        """Show pages done, measured pages/sec across the batch and ETA"""
+        done, total = self.progress_done, self.progress_total
+        self.progress_var.set(done)
+        elapsed = time.monotonic() - self.progress_started if self.progress_started else 0
+        rate = done / elapsed if elapsed > 0 else 0
+        text = f"Page {done}/{total}"
+        if rate > 0:
+            eta = int((total - done) / rate)
+            text += f" · {rate:.2f} pages/s · ETA {eta // 3600:d}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+        self.progress_text_var.set(text)
+    
+    def finish_progress(self, cancelled):
+        """Final progress line and button states"""
+        elapsed = time.monotonic() - self.progress_started if self.progress_started else 0
+        status = "Cancelled" if cancelled else "Done"
+        self.progress_text_var.set(f"{status}: {self.progress_done}/{self.progress_total} pages in {int(elapsed)}s")
+        self.run_btn.config(state='normal')
+        self.cancel_btn.config(state='disabled')
+        self.close_log_file()
+    
     def update_output_filename(self):
         """Update output filename based on options"""
         input_file = self.input_var.get()
@@ -331,7 +581,15 @@ class ModernApp:
         
         # Disable interface
         self.run_btn.config(state='disabled')
+        self.cancel_event.clear()
+        self.cancel_btn.config(state='normal')
+        self.progress_done = 0
+        self.progress_total = 1
+        self.progress_started = time.monotonic()
+        self.progress_var.set(0)
+        self.progress_text_var.set("Counting pages...")
         self.clear_log()
+        self.open_log_file()
         
         if visible_hide:
             self.log_message(f"🚀 Starting Visible&Hide processing: {os.path.basename(input_file)}")
@@ -357,12 +615,84 @@ class ModernApp:
                 suffix += "_Hide"
             return f"{base_name}{suffix}.pdf"
 
+        def count_pages(paths):
+            total = 0
+            for path in paths:
+                try:
+                    with fitz.open(path) as doc:
+                        total += len(doc)
+                except Exception:
+                    pass
+            return total * (2 if visible_hide else 1)
+
+        cancel_event = self.cancel_event
+        common = dict(flip_x=flip_x,
+                      flip_y=flip_y,
+                      top_shift_px=top_shift_px,
+                      font_size=font_size,
+                      log_callback=self.log_message,
+                      progress_callback=self.on_progress,
+                      cancel_event=cancel_event)
+        if self.isolate_ocr_var.get():
+            common['page_timeout'] = PAGE_TIMEOUT
+        if self.profile_var.get():
+            common['profile'] = True
+        if self.linearize_var.get():
+            common['linearize'] = True
+        if self.text_overlay_var.get():
+            common['text_overlay'] = True
+        common.update(self.ink_options())
+
+        def split_base_name(path: str):
+            base_name = os.path.splitext(path)[0]
+            if base_name.endswith('_Hide'):
+                base_name = base_name[:-5]
+            if base_name.endswith('_searchable'):
+                base_name = base_name[:-11]
+            return base_name
+
+        def on_batch_event(event):
+            if event.get('event') == 'chunk':
+                self.progress_done += event['pages']
+                self.call_in_ui(self.update_progress)
+
         def worker():
             try:
-                if self.batch_files:
+                total_pages = count_pages(self.batch_files or [input_file])
+                self.call_in_ui(self.start_progress, total_pages)
+                if self.batch_files and self.balance_batch_var.get():
+                    # Page chunks of all files on several processes; each file is saved when complete
+                    options = {key: value for key, value in common.items()
+                               if key not in ('log_callback', 'progress_callback', 'cancel_event')}
+                    jobs = []
+                    for in_file in self.batch_files:
+                        if visible_hide:
+                            base_name = split_base_name(in_file)
+                            jobs.append({'input': in_file, 'output': f"{base_name}_searchable.pdf",
+                                         'options': dict(options, hide_text=False)})
+                            jobs.append({'input': in_file, 'output': f"{base_name}_searchable_Hide.pdf",
+                                         'options': dict(options, hide_text=True)})
+                        else:
+                            jobs.append({'input': in_file, 'output': build_output_paths_for(in_file),
+                                         'options': dict(options, hide_text=hide_text)})
+                    records = run_batch(jobs, workers=BATCH_WORKERS, log=self.log_message,
+                                        progress_callback=on_batch_event, cancel_event=cancel_event)
+                    success = sum(1 for r in records if r['status'] == 'ok')
+                    self.log_message(f"✅ Batch completed: {success}/{len(records)} outputs succeeded")
+                    if cancel_event.is_set():
+                        self.log_message("⏹ Processing cancelled; unfinished files were not saved")
+                    elif success > 0 and self.ask_in_ui(messagebox.askyesno, "Success", "Batch completed. Open output folder?"):
+                        try:
+                            os.startfile(os.path.dirname(self.batch_files[0]))
+                        except Exception:
+                            pass
+                elif self.batch_files:
                     total = len(self.batch_files)
                     success = 0
                     for idx, in_file in enumerate(self.batch_files, start=1):
+                        if cancel_event.is_set():
+                            self.log_message(f"⏹ Batch cancelled: {total - idx + 1} file(s) not started")
+                            break
                         try:
                             self.log_message(f"[{idx}/{total}] 📁 Input file: {in_file}")
                             if visible_hide:
@@ -374,38 +704,23 @@ class ModernApp:
 
                                 visible_output = f"{base_name}_searchable.pdf"
                                 self.log_message(f"   → Visible: {os.path.basename(visible_output)}")
-                                process_pdf(in_file, visible_output,
-                                            hide_text=False,
-                                            flip_x=flip_x,
-                                            flip_y=flip_y,
-                                            top_shift_px=top_shift_px,
-                                            font_size=font_size,
-                                            log_callback=self.log_message)
+                                process_pdf(in_file, visible_output, hide_text=False, **common)
 
                                 hide_output = f"{base_name}_searchable_Hide.pdf"
                                 self.log_message(f"   → Hidden: {os.path.basename(hide_output)}")
-                                process_pdf(in_file, hide_output,
-                                            hide_text=True,
-                                            flip_x=flip_x,
-                                            flip_y=flip_y,
-                                            top_shift_px=top_shift_px,
-                                            font_size=font_size,
-                                            log_callback=self.log_message)
+                                process_pdf(in_file, hide_output, hide_text=True, **common)
                             else:
                                 out_path = build_output_paths_for(in_file)
                                 self.log_message(f"   → Output: {os.path.basename(out_path)}")
-                                process_pdf(in_file, out_path,
-                                            hide_text=hide_text,
-                                            flip_x=flip_x,
-                                            flip_y=flip_y,
-                                            top_shift_px=top_shift_px,
-                                            font_size=font_size,
-                                            log_callback=self.log_message)
-                            success += 1
+                                process_pdf(in_file, out_path, hide_text=hide_text, **common)
+                            if not cancel_event.is_set():
+                                success += 1
                         except Exception as ie:
                             self.log_message(f"   ❌ Error on file: {ie}")
                     self.log_message(f"✅ Batch completed: {success}/{total} succeeded")
-                    if success > 0 and messagebox.askyesno("Success", "Batch completed. Open output folder?"):
+                    if cancel_event.is_set():
+                        self.log_message("⏹ Processing cancelled; partial outputs were saved")
+                    elif success > 0 and self.ask_in_ui(messagebox.askyesno, "Success", "Batch completed. Open output folder?"):
                         try:
                             folder = os.path.dirname(self.batch_files[0])
                             os.startfile(folder)
@@ -422,58 +737,224 @@ class ModernApp:
                     # First: visible text version
                     visible_output = f"{base_name}_searchable.pdf"
                     self.log_message(f"📄 Creating visible text version: {os.path.basename(visible_output)}")
-                    process_pdf(input_file, visible_output, 
-                              hide_text=False, 
-                              flip_x=flip_x, 
-                              flip_y=flip_y, 
-                              top_shift_px=top_shift_px, 
-                              font_size=font_size,
-                              log_callback=self.log_message)
+                    process_pdf(input_file, visible_output, hide_text=False, **common)
                     
                     # Second: hidden text version
                     hide_output = f"{base_name}_searchable_Hide.pdf"
-                    self.log_message(f"📄 Creating hidden text version: {os.path.basename(hide_output)}")
-                    process_pdf(input_file, hide_output, 
-                              hide_text=True, 
-                              flip_x=flip_x, 
-                              flip_y=flip_y, 
-                              top_shift_px=top_shift_px, 
-                              font_size=font_size,
-                              log_callback=self.log_message)
+                    if not cancel_event.is_set():
+                        self.log_message(f"📄 Creating hidden text version: {os.path.basename(hide_output)}")
+                        process_pdf(input_file, hide_output, hide_text=True, **common)
                     
+                    if cancel_event.is_set():
+                        self.log_message("⏹ Processing cancelled; partial output was saved")
+                        return
                     self.log_message("✅ Both versions created successfully!")
                     self.log_message(f"📄 Visible version: {visible_output}")
                     self.log_message(f"📄 Hidden version: {hide_output}")
                     
                     # Offer to open results
-                    if messagebox.askyesno("Success", "Both versions created successfully!\nOpen results?"):
+                    if self.ask_in_ui(messagebox.askyesno, "Success", "Both versions created successfully!\nOpen results?"):
                         os.startfile(visible_output)
                         os.startfile(hide_output)
                 else:
                     # Single version processing
-                    process_pdf(input_file, output_file, 
-                              hide_text=hide_text, 
-                              flip_x=flip_x, 
-                              flip_y=flip_y, 
-                              top_shift_px=top_shift_px, 
-                              font_size=font_size,
-                              log_callback=self.log_message)
+                    process_pdf(input_file, output_file, hide_text=hide_text, **common)
+                    if cancel_event.is_set():
+                        self.log_message(f"⏹ Processing cancelled; partial output saved: {output_file}")
+                        return
                     self.log_message("✅ Processing completed successfully!")
                     self.log_message(f"📄 Result saved: {output_file}")
                     
                     # Offer to open result
-                    if messagebox.askyesno("Success", "Processing completed successfully!\nOpen result?"):
+                    if self.ask_in_ui(messagebox.askyesno, "Success", "Processing completed successfully!\nOpen result?"):
                         os.startfile(output_file)
                     
             except Exception as e:
                 self.log_message(f"❌ Error: {str(e)}")
-                messagebox.showerror("Error", f"Processing error:\n{str(e)}")
+                self.call_in_ui(messagebox.showerror, "Error", f"Processing error:\n{str(e)}")
             finally:
-                self.run_btn.config(state='normal')
+                self.call_in_ui(self.finish_progress, cancel_event.is_set())
         
         # Run in separate thread
         threading.Thread(target=worker, daemon=True).start()
 
+
+class PreviewWindow(tk.Toplevel):
+    """Low-DPI page preview with the OCR text layer drawn on top.
+
+    OCR runs once per page in a background thread and is cached in
+    app.preview_cache; changing font size, top shift, hide text or flips
+    only re-runs the layout on the cached results. The "keep original pages"
+    option changes the render and the ink options change the OCR input, so
+    they are part of the cache key.
+    """
+
+    PREVIEW_DPI = 60
+    OCR_DPI = 300
+
+    def __init__(self, app, input_file):
+        super().__init__(app.root)
+        self.app = app
+        self.title("Layout Preview")
+        self.geometry('900x700')
+        self.doc = None
+        self.input_file = None
+        self.page_var = tk.IntVar(value=1)
+        self.dpi_var = tk.IntVar(value=self.PREVIEW_DPI)
+        self.status_var = tk.StringVar(value="")
+        self.photo = None
+        self._render_job = None
+        self._traces = []
+        self._ocr_pending = set()
+        
+        controls = ttk.Frame(self, padding="5")
+        controls.pack(fill=tk.X)
+        ttk.Label(controls, text="Page:").pack(side=tk.LEFT)
+        self.page_spin = ttk.Spinbox(controls, from_=1, to=1, textvariable=self.page_var, width=6)
+        self.page_spin.pack(side=tk.LEFT, padx=(5, 15))
+        ttk.Label(controls, text="Preview DPI:").pack(side=tk.LEFT)
+        ttk.Spinbox(controls, from_=30, to=150, increment=10, textvariable=self.dpi_var,
+                    width=5).pack(side=tk.LEFT, padx=(5, 15))
+        ttk.Checkbutton(controls, text="Flip X", variable=app.flip_x_var).pack(side=tk.LEFT)
+        ttk.Checkbutton(controls, text="Flip Y", variable=app.flip_y_var).pack(side=tk.LEFT, padx=(5, 15))
+        ttk.Button(controls, text="Re-run OCR", command=self.rerun_ocr).pack(side=tk.LEFT)
+        ttk.Label(controls, textvariable=self.status_var).pack(side=tk.LEFT, padx=(15, 0))
+        
+        canvas_frame = ttk.Frame(self)
+        canvas_frame.pack(fill=tk.BOTH, expand=True)
+        canvas_frame.columnconfigure(0, weight=1)
+        canvas_frame.rowconfigure(0, weight=1)
+        self.canvas = tk.Canvas(canvas_frame, bg='#808080')
+        xbar = ttk.Scrollbar(canvas_frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        ybar = ttk.Scrollbar(canvas_frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.canvas.configure(xscrollcommand=xbar.set, yscrollcommand=ybar.set)
+        self.canvas.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        ybar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        xbar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        
+        # Settings of the main window that change the preview
+        for var in (app.font_size_var, app.top_shift_var, app.hide_text_var, app.flip_x_var, app.flip_y_var,
+                    app.text_overlay_var, app.crop_to_ink_var, app.ink_threshold_var):
+            self._traces.append((var, var.trace_add('write', lambda *_: self.schedule_render())))
+        self.page_var.trace_add('write', lambda *_: self.schedule_render())
+        self.dpi_var.trace_add('write', lambda *_: self.schedule_render())
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.set_file(input_file)
+    
+    def set_file(self, input_file):
+        if self.doc is not None:
+            self.doc.close()
+        self.input_file = input_file
+        self.doc = fitz.open(input_file)
+        self.page_spin.config(to=len(self.doc))
+        self.page_var.set(1)
+        self.title(f"Layout Preview - {os.path.basename(input_file)}")
+        self.schedule_render()
+    
+    def on_close(self):
+        for var, trace_id in self._traces:
+            try:
+                var.trace_remove('write', trace_id)
+            except tk.TclError:
+                pass
+        if self._render_job is not None:
+            self.after_cancel(self._render_job)
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+        self.destroy()
+    
+    def page_index(self):
+        try:
+            return min(max(int(self.page_var.get()), 1), len(self.doc)) - 1
+        except (tk.TclError, ValueError):
+            return None
+    
+    def schedule_render(self):
+        """Debounce: re-render shortly after the last parameter change"""
+        if self._render_job is not None:
+            self.after_cancel(self._render_job)
+        self._render_job = self.after(120, self.render)
+    
+    def rerun_ocr(self):
+        index = self.page_index()
+        if index is not None:
+            self.app.preview_cache.pop(self.cache_key(index), None)
+            self.render()
+    
+    def render(self):
+        self._render_job = None
+        if self.doc is None:
+            return
+        index = self.page_index()
+        if index is None:
+            return
+        key = self.cache_key(index)
+        cached = self.app.preview_cache.get(key)
+        if cached is None:
+            self.start_ocr(key)
+            return
+        try:
+            layout = dict(hide_text=self.app.hide_text_var.get(),
+                          flip_x=self.app.flip_x_var.get(),
+                          flip_y=self.app.flip_y_var.get(),
+                          top_shift_px=float(self.app.top_shift_var.get()),
+                          font_size=int(self.app.font_size_var.get()))
+            dpi = min(max(int(self.dpi_var.get()), 30), 150)
+        except (tk.TclError, ValueError):
+            return  # поле ещё редактируется
+        ocr_results, rotation_angle, shape = cached
+        started = time.perf_counter()
+        png = render_preview(self.doc[index], index, self.input_file, ocr_results, rotation_angle, shape,
+                             preview_dpi=dpi, text_overlay=key[2], **layout)
+        self.photo = tk.PhotoImage(data=base64.b64encode(png))
+        self.canvas.delete('all')
+        self.canvas.create_image(0, 0, anchor='nw', image=self.photo)
+        self.canvas.configure(scrollregion=(0, 0, self.photo.width(), self.photo.height()))
+        self.status_var.set(f"{len(ocr_results)} blocks, rotation {rotation_angle}°, "
+                            f"layout {int((time.perf_counter() - started) * 1000)} ms")
+    
+    def cache_key(self, index):
+        # Tk variables are read in the UI thread
+        ink = self.app.ink_options()
+        return (self.input_file, index, self.app.text_overlay_var.get(), ink['crop_to_ink'], ink['ink_threshold'])
+    
+    def start_ocr(self, key):
+        """Run full-resolution OCR for one page in the background and cache it"""
+        if key in self._ocr_pending:
+            return
+        self._ocr_pending.add(key)
+        input_file, index, text_overlay, crop_to_ink, ink_threshold = key
+        self.status_var.set(f"Running OCR on page {index + 1}...")
+        
+        def worker():
+            try:
+                with self.app.preview_lock:
+                    if self.app.preview_engine is None:
+                        self.app.preview_engine = create_ocr_engine()
+                    # Same render, clip and orientation pre-pass as process_pdf with the GUI's options
+                    with fitz.open(input_file) as doc:
+                        ocr_results, raw_ret, shape = recognize_preview_page(
+                            doc[index], self.app.preview_engine,
+                            TechnicalOCRProcessor(crop_to_ink=crop_to_ink, ink_threshold=ink_threshold), self.OCR_DPI,
+                            text_overlay=text_overlay)
+                self.app.preview_cache[key] = (ocr_results, rotation_from_raw(raw_ret) or 0, shape[:2])
+            except Exception as e:
+                self.app.log_message(f"❌ Preview OCR error: {e}")
+            self.app.call_in_ui(self.ocr_finished, key)
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def ocr_finished(self, key):
+        self._ocr_pending.discard(key)
+        if self.doc is None or not self.winfo_exists():
+            return
+        if key not in self.app.preview_cache:
+            self.status_var.set("OCR failed, see log")
+        elif key == self.cache_key(self.page_index()):
+            self.render()
+
+
 def main():
     """Main function"""
     root = tk.Tk()
@@ -481,10 +962,12 @@ def main():
     
     # Handle window closing
     def on_closing():
+        app.cancel_event.set()
         try:
             app.save_settings()
         except:
             pass
+        app.close_log_file()
         root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local HTTP job API for PDF2Searchable (standard library only).
+
+Endpoints:
+    POST   /jobs?name=a.pdf&hide_text=1   upload a PDF (raw request body), returns {"id": ...}
+    GET    /jobs                          list jobs
+    GET    /jobs/<id>                     job status and statistics
+    GET    /jobs/<id>/events              progress stream (NDJSON, or SSE with ?format=sse)
+    GET    /jobs/<id>/result              searchable PDF once the job is done
+    DELETE /jobs/<id>                     forget a finished job and delete its files
+    GET    /health                        service status
+    GET    /metrics                       Prometheus metrics (see metrics.py)
+
+Jobs run on a fixed pool of worker threads, each with its own OCR engine,
+so at most --workers files are processed at once; uploads beyond
+--max-pending waiting jobs are rejected with 429.
+
+Example:
+    python http_service.py --port 8765 --workers 2
+    curl --data-binary @drawing.pdf "http://127.0.0.1:8765/jobs?name=drawing.pdf"
+    curl -N http://127.0.0.1:8765/jobs/<id>/events
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import metrics
+from batch_cli import PATH_OPTIONS, coerce_options, default_output_path
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """State of one submitted file plus its ordered event log"""
+
+    def __init__(self, job_id: str, name: str, input_path: str, output_path: str, options: dict):
+        self.id = job_id
+        self.name = name
+        self.input_path = input_path
+        self.output_path = output_path
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.stats = None
+        self.created = time.time()
+        self.events = []
+        self.cond = threading.Condition()
+
+    def add_event(self, event: dict, status: str = None):
+        """Append an event; a status change is published atomically with it"""
+        with self.cond:
+            if status:
+                self.status = status
+            event = dict(event, seq=len(self.events), job=self.id, time=round(time.time(), 3))
+            self.events.append(event)
+            self.cond.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def wait_events(self, start: int, timeout: float = 15.0):
+        """Return events after index start, blocking until some arrive or the job ends"""
+        with self.cond:
+            if len(self.events) <= start and not self.finished:
+                self.cond.wait(timeout)
+            return self.events[start:]
+
+    def to_dict(self) -> dict:
+        progress = next((e for e in reversed(self.events) if e.get('event') == 'page'), None)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'options': self.options,
+            'created': round(self.created, 3),
+            'page': progress['page'] if progress else 0,
+            'pages': progress['pages'] if progress else None,
+            'stats': self.stats,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """Run uploaded files through process_pdf with bounded concurrency"""
+
+    def __init__(self, work_dir: str, workers: int = 1, cpu_threads: int = None,
+                 max_pending: int = 20, options: dict = None):
+        self.work_dir = work_dir
+        self.workers = max(1, int(workers))
+        self.cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.max_pending = max(1, int(max_pending))
+        self.options = options or {}
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+        os.makedirs(work_dir, exist_ok=True)
+        metrics.QUEUE_LENGTH.set_function(self.pending, queue='http')
+        metrics.JOBS_RUNNING.set_function(self.running, queue='http')
+
+    def _engine(self):
+        """One OCR engine per worker thread (Paddle predictors are not shared between threads)"""
+        if getattr(self._local, 'engine', None) is None:
+            from run_process_0100 import create_ocr_engine
+            self._local.engine = create_ocr_engine(cpu_threads=self.cpu_threads)
+        return self._local.engine
+
+    def pending(self) -> int:
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.status == 'queued')
+
+    def running(self) -> int:
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.status == 'running')
+
+    def submit(self, data: bytes, name: str, options: dict) -> Job:
+        name = os.path.basename(name or 'document.pdf')
+        if name in ('', '.', '..'):
+            raise ValueError("Invalid file name")
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.work_dir, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, name)
+        with open(input_path, 'wb') as fh:
+            fh.write(data)
+        merged = dict(self.options)
+        merged.update(options)
+        output_path = default_output_path(input_path, merged.get('hide_text', False))
+        job = Job(job_id, name, input_path, output_path, merged)
+        with self.lock:
+            # Checked and inserted together: concurrent uploads cannot both take the last slot
+            full = sum(1 for other in self.jobs.values() if other.status == 'queued') >= self.max_pending
+            if not full:
+                self.jobs[job_id] = job
+        if full:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise OverflowError(f"Too many queued jobs ({self.max_pending})")
+        job.add_event({'event': 'queued', 'name': name})
+        self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job):
+        from run_process_0100 import process_pdf
+
+        job.add_event({'event': 'running'}, status='running')
+        try:
+            job.stats = process_pdf(job.input_path, job.output_path,
+                                    dump_debug_first_page=False,
+                                    log_callback=lambda msg: job.add_event({'event': 'log', 'message': msg}),
+                                    progress_callback=job.add_event,
+                                    ocr_engine=self._engine(),
+                                    **job.options)
+            if not job.stats['saved']:
+                job.error = "No pages processed, output not written"
+                job.add_event({'event': 'failed', 'error': job.error, 'stats': job.stats}, status='failed')
+                return
+            job.add_event({'event': 'done', 'stats': job.stats}, status='done')
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.error = f"{type(e).__name__}: {e}"
+            metrics.FILES.inc(status='failed')
+            job.add_event({'event': 'failed', 'error': job.error}, status='failed')
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or not job.finished:
+                return False
+            del self.jobs[job_id]
+        shutil.rmtree(os.path.dirname(job.input_path), ignore_errors=True)
+        return True
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'PDF2Searchable'
+    manager: JobManager = None
+    max_upload = 512 * 1024 * 1024
+
+    def log_message(self, fmt, *args):
+        logger.info("%s - %s", self.address_string(), fmt % args)
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        return parts, parse_qs(url.query)
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['health']:
+            self._send_json(200, {'status': 'ok', 'workers': self.manager.workers,
+                                  'pending': self.manager.pending(), 'jobs': len(self.manager.jobs)})
+            return
+        if parts == ['metrics']:
+            metrics.send_metrics(self)
+            return
+        if parts == ['jobs']:
+            with self.manager.lock:
+                jobs = [job.to_dict() for job in self.manager.jobs.values()]
+            self._send_json(200, jobs)
+            return
+        if len(parts) < 2 or parts[0] != 'jobs':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        job = self.manager.get(parts[1])
+        if job is None:
+            self._send_json(404, {'error': 'Unknown job'})
+            return
+        if len(parts) == 2:
+            self._send_json(200, job.to_dict())
+        elif parts[2] == 'events':
+            self._stream_events(job, sse=query.get('format', [''])[0] == 'sse')
+        elif parts[2] == 'result':
+            self._send_result(job)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def _stream_events(self, job: Job, sse: bool):
+        # HTTP/1.0 style streaming: no Content-Length, the stream ends when the job does
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if sse else 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                events = job.wait_events(sent)
+                for event in events:
+                    line = json.dumps(event, ensure_ascii=False)
+                    self.wfile.write((f"data: {line}\n\n" if sse else f"{line}\n").encode('utf-8'))
+                sent += len(events)
+                self.wfile.flush()
+                if job.finished and sent >= len(job.events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_result(self, job: Job):
+        if job.status != 'done':
+            self._send_json(409, {'error': f"Job is {job.status}", 'status': job.status})
+            return
+        size = os.path.getsize(job.output_path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(size))
+        self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(job.output_path)}"')
+        self.end_headers()
+        with open(job.output_path, 'rb') as fh:
+            shutil.copyfileobj(fh, self.wfile)
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts != ['jobs']:
+            self._send_json(404, {'error': 'Not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            self._send_json(400, {'error': 'Send the PDF as the request body'})
+            return
+        if length > self.max_upload:
+            self._send_json(413, {'error': 'File too large'})
+            return
+        data = self.rfile.read(length)
+        if not data.startswith(b'%PDF'):
+            self._send_json(400, {'error': 'Body is not a PDF file'})
+            return
+        try:
+            options = coerce_options({key: values[-1] for key, values in query.items() if key not in PATH_OPTIONS})
+            job = self.manager.submit(data, query.get('name', [self.headers.get('X-Filename')])[-1], options)
+        except OverflowError as e:
+            self._send_json(429, {'error': str(e)})
+            return
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(202, {'id': job.id, 'status': job.status,
+                              'events': f"/jobs/{job.id}/events", 'result': f"/jobs/{job.id}/result"})
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        if self.manager.delete(parts[1]):
+            self._send_json(200, {'deleted': parts[1]})
+        else:
+            self._send_json(409, {'error': 'Unknown or unfinished job'})
+
+
+def create_server(manager: JobManager, host: str = '127.0.0.1', port: int = 8765) -> ThreadingHTTPServer:
+    """Build the HTTP server bound to the given manager (port 0 picks a free port)"""
+    handler = type('BoundJobRequestHandler', (JobRequestHandler,), {'manager': manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None) -> int:
+    from batch_cli import add_option_arguments, option_defaults
+
+    parser = argparse.ArgumentParser(description='HTTP job API for searchable PDF conversion.')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port (default: 8765)')
+    parser.add_argument('--work-dir', default='.http_jobs', help='Folder for uploads and results')
+    parser.add_argument('--settings', help='settings.json to use as default options (GUI format)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Files processed concurrently')
+    parser.add_argument('--cpu-threads', type=int, help='CPU threads per worker (default: CPU count / workers)')
+    parser.add_argument('--max-pending', type=int, default=20, help='Reject uploads above this many queued jobs')
+    metrics.add_metrics_arguments(parser)
+    add_option_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    _, exporter = metrics.start_exporters(args, logger.info)
+    manager = JobManager(args.work_dir, workers=args.workers, cpu_threads=args.cpu_threads,
+                         max_pending=args.max_pending, options=option_defaults(args))
+    server = create_server(manager, args.host, args.port)
+    logger.info(f"🌐 Listening on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.shutdown()
+        if exporter is not None:
+            exporter.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory budget for page processing.
+
+An A0 sheet at 300 dpi is ~420 MB as an RGB raster and OCR makes working
+copies of it, so on a 4 GB machine one large page next to the models can
+already run out of memory. The governor estimates the peak cost of a page
+before it is rendered and
+
+- admits it only when the process budget and the free system memory allow
+  it (a page of another thread in the same process waits meanwhile),
+- lowers the render DPI of an image page that would not fit,
+- tells process_pdf to OCR a vector page in bands instead (the raster of
+  a vector page never goes into the output).
+
+Process RSS and available memory come from psutil when it is installed;
+without it only the budget and the estimates are used.
+
+Exempt from admission (not counted in the budget):
+
+- a page while no other page of the process is in flight: waiting could
+  not free anything, so a single-worker run is only limited by the lower
+  DPI / bands of plan_page();
+- look-ahead renders of process_pdf(render_process=...): they are made in
+  the render process, whose memory is not part of this process's RSS, at
+  the DPI plan_page() chose for them.
+"""
+import threading
+import time
+
+import fitz
+
+try:
+    import psutil
+except ImportError:  # optional dependency
+    psutil = None
+
+MB = 1024 * 1024
+
+
+def raster_size(page, dpi: int):
+    """(height, width) of the whole-page raster at dpi"""
+    full = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+    return full.height, full.width
+
+
+def page_cost(page, dpi: int, color_mode: str = 'rgb', tiles: int = None) -> int:
+    """Estimated peak bytes of rendering and recognizing a page (or one of its tiles).
+
+    The render itself, the BGR copy OCR works on and the PNG / temporary
+    buffers of the same order.
+    """
+    height, width = raster_size(page, dpi)
+    channels = 3 if color_mode == 'rgb' else 1
+    return height * width * (2 * channels + 3) // max(1, tiles or 1)
+
+
+class MemoryGovernor:
+    """Admission control and render-size decisions within a memory budget.
+
+    budget_mb limits the RSS of this process (None: no own limit), reserve_mb
+    is kept free for the system and other processes (needs psutil). Pages
+    are never rendered below min_dpi; vector pages are split into at most
+    max_tiles bands instead.
+    """
+
+    def __init__(self, budget_mb: int = None, reserve_mb: int = 512, min_dpi: int = 150,
+                 max_tiles: int = 16):
+        self.budget = int(budget_mb) * MB if budget_mb else None
+        self.reserve = int(reserve_mb) * MB
+        self.min_dpi = int(min_dpi)
+        self.max_tiles = int(max_tiles)
+        self.cond = threading.Condition()
+        self.reserved = {}  # thread id -> bytes admitted for its current page
+        self.waits = 0
+        self._process = psutil.Process() if psutil is not None else None
+
+    def rss(self) -> int:
+        return self._process.memory_info().rss if self._process is not None else 0
+
+    def available(self):
+        return psutil.virtual_memory().available if psutil is not None else None
+
+    def headroom(self):
+        """Bytes a new page of this thread may use now; None when nothing limits it"""
+        limits = []
+        if self.budget is not None:
+            limits.append(self.budget - self.rss())
+        available = self.available()
+        if available is not None:
+            limits.append(available - self.reserve)
+        if not limits:
+            return None
+        me = threading.get_ident()
+        # admit()/done() of other threads change reserved meanwhile
+        with self.cond:
+            others = sum(v for k, v in self.reserved.items() if k != me)
+        return min(limits) - others
+
+    def plan_page(self, page, dpi: int, color_mode: str = 'rgb', can_tile: bool = False):
+        """Render settings that fit the budget: (dpi, number of tiles or None)"""
+        room = self.headroom()
+        cost = page_cost(page, dpi, color_mode)
+        if room is None or cost <= room:
+            return dpi, None
+        if can_tile:
+            tiles = -(-cost // room) if room > 0 else self.max_tiles
+            return dpi, min(self.max_tiles, max(2, tiles))
+        page_dpi = dpi
+        while page_dpi > self.min_dpi and page_cost(page, page_dpi, color_mode) > room:
+            page_dpi = max(self.min_dpi, int(page_dpi * 0.85))
+        return page_dpi, None
+
+    def admit(self, cost: int, timeout: float = 600.0):
+        """Wait until a page of cost bytes fits, then count it for this thread.
+
+        A thread holds one admission at a time (the next admit() or done()
+        replaces it), so a page aborted by an exception cannot leak it. A
+        page is always admitted when no other page is in flight.
+        """
+        me = threading.get_ident()
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.reserved.pop(me, None)
+            waited = False
+            while any(self.reserved.values()) and time.monotonic() < deadline:
+                room = self.headroom()
+                if room is None or cost <= room:
+                    break
+                waited = True
+                # RSS and free memory change without notification: poll as well
+                self.cond.wait(0.5)
+            if waited:
+                self.waits += 1
+            self.reserved[me] = int(cost)
+
+    def done(self):
+        with self.cond:
+            self.reserved.pop(threading.get_ident(), None)
+            self.cond.notify_all()
+
+
+_GOVERNORS = {}
+_GOVERNORS_LOCK = threading.Lock()
+
+
+def get_governor(budget_mb: int = None) -> MemoryGovernor:
+    """Process-wide governor for a budget, shared by all threads using it"""
+    with _GOVERNORS_LOCK:
+        if budget_mb not in _GOVERNORS:
+            _GOVERNORS[budget_mb] = MemoryGovernor(budget_mb)
+        return _GOVERNORS[budget_mb]
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Service metrics in the Prometheus text format (standard library only).
+
+process_pdf feeds a process-wide registry (pages by type, stage seconds,
+OCR seconds and blocks per page, page index / recognition cache lookups and
+hits, failed pages and files); the services add their queue lengths and
+the memory of the process and its workers. The registry is exported
+
+- over HTTP: GET http://127.0.0.1:<port>/metrics (serve_metrics, or the
+  /metrics route of http_service.py),
+- as a textfile rewritten every few seconds (TextfileExporter), e.g. for
+  the node_exporter textfile collector.
+
+    python watch_service.py ... --metrics-port 9464 --metrics-file /var/lib/node_exporter/pdf2searchable.prom
+
+Counters and histograms of pool worker processes are sent back with each
+job record (drain() in the worker, merge() in the service).
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:  # optional dependency
+    psutil = None
+
+PREFIX = 'pdf2searchable_'
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, registry, name: str, help_text: str, labels=()):
+        self.registry = registry
+        self.name = PREFIX + name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}  # label values -> value
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, '')) for n in self.label_names)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def lines(self) -> list:
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(self.values.items())]
+
+
+class Gauge(_Metric):
+    """A value set by the caller or read from a function when exported"""
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, labels=()):
+        super().__init__(registry, name, help_text, labels)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, func, **labels):
+        with self.registry.lock:
+            self.functions[self._key(labels)] = func
+
+    def lines(self) -> list:
+        values = dict(self.values)
+        for key, func in list(self.functions.items()):
+            try:
+                value = func()
+            except Exception:
+                continue  # a service that went away must not break the export
+            if value is not None:
+                values[key] = value
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, buckets, labels=()):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            counts = self.values.setdefault(key, [0] * len(self.buckets) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+
+    def lines(self) -> list:
+        out = []
+        for key, counts in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                out.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), key + (_number(bound),))} {count}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(counts[-1])}")
+            out.append(f"{self.name}_count{_labels(self.label_names, key)} {counts[-2]}")
+        return out
+
+
+class Registry:
+    """Named metrics of this process"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(self, name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels=()) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, buckets, labels=()) -> Histogram:
+        return self._get(Histogram, name, help_text, buckets, labels=labels)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)"""
+        out = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines = metric.lines()
+                if lines:
+                    out.extend(metric.header() + lines)
+        return '\n'.join(out) + '\n'
+
+    def drain(self) -> dict:
+        """Counter and histogram values since the last drain (worker side), reset to zero"""
+        delta = {}
+        with self.lock:
+            for name, metric in self.metrics.items():
+                if isinstance(metric, (Counter, Histogram)) and metric.values:
+                    delta[name] = list(metric.values.items())
+                    metric.values = {}
+        return delta
+
+    def merge(self, delta: dict):
+        """Add the drained values of a worker process"""
+        with self.lock:
+            for name, items in (delta or {}).items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in items:
+                    key = tuple(key)
+                    if isinstance(metric, Histogram):
+                        counts = metric.values.setdefault(key, [0] * len(metric.buckets) + [0.0])
+                        metric.values[key] = [a + b for a, b in zip(counts, value)]
+                    else:
+                        metric.values[key] = metric.values.get(key, 0) + value
+
+
+REGISTRY = Registry()
+
+PAGES = REGISTRY.counter('pages_total', 'Pages processed by page type', ('type',))
+STAGE_SECONDS = REGISTRY.counter('stage_seconds_total', 'Seconds spent per processing stage', ('stage',))
+PAGE_OCR_SECONDS = REGISTRY.histogram('page_ocr_seconds', 'OCR time per recognized page',
+                                      (0.25, 0.5, 1, 2, 5, 10, 30, 60, 120))
+PAGE_BLOCKS = REGISTRY.histogram('page_blocks', 'OCR blocks per page', (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000))
+PAGE_FAILURES = REGISTRY.counter('page_failures_total', 'Pages kept without OCR after a timeout or crash')
+FILES = REGISTRY.counter('files_total', 'Files finished by status', ('status',))
+CACHE_LOOKUPS = REGISTRY.counter('cache_lookups_total', 'Cache lookups (page_index: repeated pages, '
+                                                        'rec: recognized line crops)', ('cache',))
+CACHE_HITS = REGISTRY.counter('cache_hits_total', 'Cache hits', ('cache',))
+CACHE_HIT_RATIO = REGISTRY.gauge('cache_hit_ratio', 'Cache hits / lookups since start', ('cache',))
+QUEUE_LENGTH = REGISTRY.gauge('queue_length', 'Jobs waiting in a service queue', ('queue',))
+JOBS_RUNNING = REGISTRY.gauge('jobs_running', 'Jobs being processed', ('queue',))
+RSS_BYTES = REGISTRY.gauge('resident_memory_bytes', 'Resident memory of the service and its workers', ('process',))
+
+
+def _hit_ratio(cache: str):
+    lookups = CACHE_LOOKUPS.values.get((cache,), 0)
+    return CACHE_HITS.values.get((cache,), 0) / lookups if lookups else None
+
+
+for _cache in ('page_index', 'rec'):
+    CACHE_HIT_RATIO.set_function(lambda cache=_cache: _hit_ratio(cache), cache=_cache)
+
+if psutil is not None:
+    _PROCESS = psutil.Process()
+    RSS_BYTES.set_function(lambda: _PROCESS.memory_info().rss, process='main')
+
+    def _workers_rss():
+        total = 0
+        for child in _PROCESS.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    RSS_BYTES.set_function(_workers_rss, process='workers')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        send_metrics(self, self.registry)
+
+
+def send_metrics(handler, registry: Registry = REGISTRY):
+    """Write the metrics as the response of a BaseHTTPRequestHandler"""
+    body = registry.render().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve GET /metrics in a background thread (port 0 picks a free port)"""
+    handler = type('BoundMetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+class TextfileExporter:
+    """Rewrite a .prom file with the current metrics every `interval` seconds"""
+
+    def __init__(self, path: str, interval: float = 15.0, registry: Registry = REGISTRY):
+        self.path = path
+        self.interval = max(1.0, float(interval))
+        self.registry = registry
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-textfile', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def write(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            fh.write(self.registry.render())
+        # Readers never see a half-written file
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Metrics textfile error: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        self.write()
+
+
+def add_metrics_arguments(parser):
+    """--metrics-port / --metrics-file / --metrics-interval of the services"""
+    group = parser.add_argument_group('metrics')
+    group.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on 127.0.0.1:PORT/metrics')
+    group.add_argument('--metrics-file', help='Rewrite this Prometheus textfile periodically')
+    group.add_argument('--metrics-interval', type=float, default=15.0,
+                       help='Seconds between textfile updates (default: 15)')
+    return group
+
+
+def start_exporters(args, log=print):
+    """Start the exporters requested on the command line; returns (server, textfile exporter)"""
+    server = exporter = None
+    if getattr(args, 'metrics_port', None) is not None:
+        server = serve_metrics(args.metrics_port)
+        log(f"📈 Metrics on http://127.0.0.1:{server.server_address[1]}/metrics")
+    if getattr(args, 'metrics_file', None):
+        exporter = TextfileExporter(args.metrics_file, args.metrics_interval).start()
+        log(f"📈 Metrics textfile {args.metrics_file} every {exporter.interval:g}s")
+    return server, exporter
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Supervised OCR worker: page inference in a child process with a wall-clock limit.
+
+A hang or a native crash inside Paddle inference would otherwise take the
+whole job (and the GUI) down with it. Here the engine lives in a separate
+process; each page image is handed over in shared memory and the caller
+waits at most `timeout` seconds for the answer. A page that times out or
+kills the worker raises PageFailed, the worker is killed and started again
+for the next page, and process_pdf retries the page at a lower DPI or keeps
+it without OCR (see process_pdf(page_timeout=...)). A worker that cannot
+load the models raises StartFailed instead: no page of the file can be
+recognized then, so the file fails at once.
+
+    supervisor = get_supervisor(timeout=120)
+    ocr_results, raw_ret = supervisor.ocr_page(img, angle)
+"""
+import atexit
+import multiprocessing as mp
+import queue
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class PageFailed(RuntimeError):
+    """OCR of a page timed out, failed or crashed its worker"""
+
+
+class StartFailed(RuntimeError):
+    """The OCR worker crashed or timed out while loading the models"""
+
+
+def _ocr_worker(requests, replies, cpu_threads, rec_cache):
+    """Child process: load the engine once, then recognize images from shared memory"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop
+    from ocr_utils_fixed import TechnicalOCRProcessor
+    from run_process_0100 import create_ocr_engine, is_blank_raw, ocr_page, rotation_from_raw
+
+    engine = create_ocr_engine(cpu_threads=cpu_threads, rec_cache=rec_cache)
+    processors = {}  # TechnicalOCRProcessor options -> processor
+    replies.put(('ready', 0, None))
+    shm = None
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        job, name, shape, dtype, angle, options = request
+        try:
+            key = tuple(sorted(options.items()))
+            if key not in processors:
+                processors[key] = TechnicalOCRProcessor(**options)
+            if shm is None or shm.name != name:
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name)
+            img = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+            ocr_results, raw_ret = ocr_page(img, engine, processors[key], angle)
+            del img
+            # Only the angle and the blank mark of the raw output are used by the caller;
+            # it may hold whole images
+            detected = rotation_from_raw(raw_ret)
+            reduced = {'doc_preprocessor_res': {'angle': detected}} if detected is not None else {}
+            if is_blank_raw(raw_ret):
+                reduced['blank_page'] = True
+            raw_ret = [reduced] if reduced else []
+            replies.put(('ok', job, (ocr_results, raw_ret)))
+        except Exception as e:
+            replies.put(('error', job, f"{type(e).__name__}: {e}"))
+    if shm is not None:
+        shm.close()
+
+
+class SupervisedOCR:
+    """One OCR worker process used by one thread at a time.
+
+    timeout: seconds a page may take; start_timeout: seconds for loading the
+    models when the worker (re)starts, which is not counted against a page.
+    """
+
+    def __init__(self, timeout: float = 120.0, cpu_threads=None, rec_cache: int = 0,
+                 start_timeout: float = 600.0):
+        self.timeout = float(timeout)
+        self.cpu_threads = cpu_threads
+        self.rec_cache = rec_cache
+        self.start_timeout = float(start_timeout)
+        self.process = None
+        self.shm = None
+        self.job = 0
+        self.restarts = 0
+
+    def _start(self):
+        ctx = mp.get_context('spawn')
+        self.requests = ctx.Queue()
+        self.replies = ctx.Queue()
+        self.process = ctx.Process(target=_ocr_worker, name='ocr-worker', daemon=True,
+                                   args=(self.requests, self.replies, self.cpu_threads, self.rec_cache))
+        self.process.start()
+        try:
+            self._wait(0, self.start_timeout, 'loading the OCR models')
+        except PageFailed as e:
+            raise StartFailed(str(e)) from None
+
+    def _kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join(timeout=10)
+            self.requests.close()
+            self.replies.close()
+        self.process = None
+        self.restarts += 1
+
+    def _wait(self, job: int, timeout: float, what: str):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status, reply_job, payload = self.replies.get(timeout=min(1.0, max(0.01, deadline - time.monotonic())))
+            except queue.Empty:
+                if not self.process.is_alive():
+                    code = self.process.exitcode
+                    self._kill()
+                    raise PageFailed(f"OCR worker crashed during {what} (exit code {code})")
+                if time.monotonic() >= deadline:
+                    self._kill()
+                    raise PageFailed(f"OCR worker did not finish {what} within {timeout:.0f}s")
+                continue
+            if reply_job != job:
+                continue
+            if status == 'error':
+                raise PageFailed(payload)
+            return payload
+
+    def ocr_page(self, img, angle=None, processor_options=None):
+        """Same contract as run_process_0100.ocr_page, run in the worker.
+
+        processor_options: TechnicalOCRProcessor arguments (ink cropping).
+
+        Raises PageFailed for the page, StartFailed when the worker cannot start.
+        """
+        if self.process is None or not self.process.is_alive():
+            if self.process is not None:
+                self._kill()
+            self._start()
+        img = np.ascontiguousarray(img)
+        if self.shm is None or self.shm.size < img.nbytes:
+            self._release_shm()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+        np.copyto(np.ndarray(img.shape, img.dtype, buffer=self.shm.buf), img)
+        self.job += 1
+        self.requests.put((self.job, self.shm.name, img.shape, img.dtype.str, angle, dict(processor_options or {})))
+        return self._wait(self.job, self.timeout, 'the page')
+
+    def _release_shm(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        if self.process is not None and self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process = None
+        self._release_shm()
+
+
+_SUPERVISORS = threading.local()
+_STARTED = []  # every supervisor created, closed at interpreter exit
+
+
+@atexit.register
+def _close_all():
+    for supervisor in _STARTED:
+        supervisor.close()
+
+
+def get_supervisor(timeout: float, cpu_threads=None, rec_cache: int = 0) -> SupervisedOCR:
+    """Supervised worker of the calling thread, kept for the following files"""
+    supervisor = getattr(_SUPERVISORS, 'supervisor', None)
+    if supervisor is not None and (supervisor.cpu_threads, supervisor.rec_cache) != (cpu_threads, rec_cache):
+        # The engine settings are fixed when the worker loads the models
+        supervisor.close()
+        _STARTED.remove(supervisor)
+        supervisor = None
+    if supervisor is None:
+        supervisor = _SUPERVISORS.supervisor = SupervisedOCR(timeout, cpu_threads, rec_cache)
+        _STARTED.append(supervisor)
+    supervisor.timeout = float(timeout)
+    return supervisor
@@ -4,11 +4,30 @@
 Lightweight, robust OCR utility wrapper for PaddleOCR used by the processing script.
 Provides TechnicalOCRProcessor.process_page_ocr(image, ocr_engine) which returns a list
 of normalized entries: [[x1,y1],[x2,y1],[x2,y2],[x1,y2]], [text, score]]
+and an ink pre-pass (find_ink_regions / prepare_ocr_input / map_to_page) that skips
+blank pages and crops empty margins before inference.
+SplitOCREngine runs detection and recognition separately with a cache of
+recognized line crops in between.
 """
+import hashlib
 import typing as _t
+from collections import OrderedDict
 import numpy as np
 import cv2
 
+# Параметры детекции и порог распознавания конвейера PaddleOCR (OCR.yaml), а не
+# значения модулей по умолчанию: PaddleOCR и SplitOCREngine получают одни и те же
+PIPELINE_DET_PARAMS = {'limit_side_len': 64, 'limit_type': 'min', 'thresh': 0.3,
+                       'box_thresh': 0.6, 'unclip_ratio': 1.5}
+PIPELINE_REC_SCORE_THRESH = 0.0
+
+
+def pipeline_kwargs() -> dict:
+    """PIPELINE_DET_PARAMS / PIPELINE_REC_SCORE_THRESH as PaddleOCR(...) arguments"""
+    kwargs = {f'text_det_{key}': value for key, value in PIPELINE_DET_PARAMS.items()}
+    kwargs['text_rec_score_thresh'] = PIPELINE_REC_SCORE_THRESH
+    return kwargs
+
 
 class TechnicalOCRProcessor:
     """Simple, robust processor that normalizes PaddleOCR outputs.
@@ -18,8 +37,13 @@ class TechnicalOCRProcessor:
     a list of [bbox, [text, score]] where bbox is [[x1,y1],[x2,y1],[x2,y2],[x1,y2]].
     """
 
-    def __init__(self, min_confidence: float = 0.3):
+    def __init__(self, min_confidence: float = 0.3, crop_to_ink: bool = True,
+                 ink_threshold: int = 200, ink_cell: int = 8, crop_padding: int = 24):
         self.min_confidence = float(min_confidence)
+        self.crop_to_ink = bool(crop_to_ink)
+        self.ink_threshold = int(ink_threshold)  # gray level below which a pixel counts as ink
+        self.ink_cell = max(1, int(ink_cell))     # downsampling factor of the ink map
+        self.crop_padding = int(crop_padding)     # px kept around the ink so glyph edges survive
 
     def _preprocess(self, image: np.ndarray) -> np.ndarray:
         # Basic grayscale + CLAHE + denoise + Otsu thresholding
@@ -35,6 +59,99 @@ class TechnicalOCRProcessor:
         _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         return binary
 
+    def _ink_map(self, image: np.ndarray) -> np.ndarray:
+        """Downsampled binary map: a cell is set if any of its pixels is dark"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+        c = self.ink_cell
+        h, w = gray.shape[0] // c, gray.shape[1] // c
+        # min-pooling keeps 1px strokes that an averaging resize would wash out
+        cells = gray[:h * c, :w * c].reshape(h, c, w, c).min(axis=(1, 3))
+        return (cells < self.ink_threshold).astype(np.uint8)
+
+    def find_ink_regions(self, image: np.ndarray, min_cells: int = 2) -> _t.List[_t.Tuple[int, int, int, int]]:
+        """Boxes (x0, y0, x1, y1) in image pixels of everything that may carry text.
+
+        Long straight lines (sheet frames, title block rules, dimension lines)
+        are removed from the ink map first, otherwise the frame of a drawing
+        alone would make every page look fully inked.
+        """
+        ink = self._ink_map(image)
+        if not ink.any():
+            return []
+        # линии длиннее ~25 ячеек (200 px при 300 dpi) текстом не являются
+        run = 25
+        horizontal = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (run, 1)))
+        vertical = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, run)))
+        text_ink = ink & ~(horizontal | vertical)
+        text_ink = cv2.dilate(text_ink, np.ones((3, 3), np.uint8), iterations=2)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(text_ink, connectivity=8)
+        c = self.ink_cell
+        regions = []
+        for x, y, w, h, area in stats[1:count]:
+            if area < min_cells:
+                continue
+            regions.append((int(x * c), int(y * c), int((x + w) * c), int((y + h) * c)))
+        return regions
+
+    def prepare_ocr_input(self, image: np.ndarray):
+        """Pick what to feed the detector: (image or crop, (x0, y0)), or (None, None) for a blank page"""
+        if not self.crop_to_ink or image is None:
+            return image, (0, 0)
+        regions = self.find_ink_regions(image)
+        if not regions:
+            return None, None
+        H, W = image.shape[:2]
+        pad = self.crop_padding
+        x0 = max(0, min(r[0] for r in regions) - pad)
+        y0 = max(0, min(r[1] for r in regions) - pad)
+        x1 = min(W, max(r[2] for r in regions) + pad)
+        y1 = min(H, max(r[3] for r in regions) + pad)
+        # a crop that saves less than ~10% of the pixels is not worth a copy
+        if (x1 - x0) * (y1 - y0) > 0.9 * W * H:
+            return image, (0, 0)
+        return np.ascontiguousarray(image[y0:y1, x0:x1]), (x0, y0)
+
+    def map_to_page(self, results, offset, crop_shape, page_shape, angle=0):
+        """Shift boxes found on a crop back into full-page coordinates.
+
+        The engine reports boxes in its own upright frame: the input turned
+        by np.rot90(k=angle // 90). The crop offset is therefore applied in
+        that rotated frame.
+        """
+        x0, y0 = offset
+        ch, cw = crop_shape[:2]
+        H, W = page_shape[:2]
+        angle = int(angle or 0) % 360
+        if angle == 90:
+            dx, dy = y0, W - x0 - cw
+        elif angle == 180:
+            dx, dy = W - x0 - cw, H - y0 - ch
+        elif angle == 270:
+            dx, dy = H - y0 - ch, x0
+        else:
+            dx, dy = x0, y0
+        if dx == 0 and dy == 0:
+            return results
+        return [[[[pt[0] + dx, pt[1] + dy] for pt in bbox], info] for bbox, info in results]
+
+    def rotate_boxes(self, results, angle, shape):
+        """Move boxes of an upright image into the engine frame np.rot90(k=angle // 90)"""
+        H, W = shape[:2]
+        k = (int(angle or 0) // 90) % 4
+        if not k:
+            return results
+        turn = {
+            1: lambda x, y: (y, W - x),
+            2: lambda x, y: (W - x, H - y),
+            3: lambda x, y: (H - y, x),
+        }[k]
+        out = []
+        for bbox, info in results:
+            pts = [turn(pt[0], pt[1]) for pt in bbox]
+            xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+            out.append([[[min(xs), min(ys)], [max(xs), min(ys)], [max(xs), max(ys)], [min(xs), max(ys)]], info])
+        return out
+
     def _normalize_bbox(self, bbox) -> _t.Optional[_t.List[_t.List[float]]]:
         if bbox is None:
             return None
@@ -139,25 +256,29 @@ class TechnicalOCRProcessor:
 
         return parsed
 
-    def process_page_ocr(self, image: np.ndarray, ocr_engine) -> _t.List[_t.List[_t.Any]]:
+    def process_page_ocr(self, image: np.ndarray, ocr_engine, raw=None, ocr_kwargs=None) -> _t.List[_t.List[_t.Any]]:
         """Run OCR and return normalized results suitable for PDF insertion.
 
+        raw: engine output the caller already has for this image; skips the
+        first (unpreprocessed) inference call.
+        ocr_kwargs: per-call options passed to every ocr_engine.ocr() call.
+
         Returns: list of [bbox, [text, score]] where bbox is normalized 4-pt list.
         """
         results = []
 
         # try raw image first
-        raw = []
-        try:
-            raw = ocr_engine.ocr(image)
-        except Exception:
-            raw = []
+        if raw is None:
+            try:
+                raw = ocr_engine.ocr(image, **(ocr_kwargs or {}))
+            except Exception:
+                raw = []
 
         # if nothing found, try preprocessed
         if not raw:
             try:
                 prep = self._preprocess(image)
-                raw = ocr_engine.ocr(prep)
+                raw = ocr_engine.ocr(prep, **(ocr_kwargs or {}))
             except Exception:
                 raw = []
 
@@ -188,3 +309,150 @@ class TechnicalOCRProcessor:
             results.append([norm, [txt, fscore]])
 
         return results
+
+
+def rotate_by_angle(image: np.ndarray, angle) -> np.ndarray:
+    """Turn an image counter-clockwise by a multiple of 90 degrees (the engine's convention)"""
+    k = (int(angle or 0) // 90) % 4
+    return np.ascontiguousarray(np.rot90(image, k=k)) if k else image
+
+
+def sort_text_lines(polys: list) -> list:
+    """Reading order of detected lines exactly as the PaddleOCR pipeline sorts them"""
+    lines = sorted(polys, key=lambda p: (float(p[0][1]), float(p[0][0])))
+    for i in range(len(lines) - 1):
+        for j in range(i, -1, -1):
+            # same row (within 10 px): left to right
+            if abs(lines[j + 1][0][1] - lines[j][0][1]) < 10 and lines[j + 1][0][0] < lines[j][0][0]:
+                lines[j], lines[j + 1] = lines[j + 1], lines[j]
+            else:
+                break
+    return lines
+
+
+def crop_text_line(image: np.ndarray, poly) -> np.ndarray:
+    """Perspective-crop a detected 4-point text box to an upright rectangle"""
+    pts = np.asarray(poly, dtype=np.float32).reshape(4, 2)
+    w = int(max(np.linalg.norm(pts[0] - pts[1]), np.linalg.norm(pts[2] - pts[3])))
+    h = int(max(np.linalg.norm(pts[0] - pts[3]), np.linalg.norm(pts[1] - pts[2])))
+    w, h = max(w, 1), max(h, 1)
+    dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    M = cv2.getPerspectiveTransform(pts, dst)
+    crop = cv2.warpPerspective(image, M, (w, h), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    # vertical lines are read after turning them (as PaddleOCR does)
+    if h / float(w) >= 1.5:
+        crop = np.ascontiguousarray(np.rot90(crop))
+    return crop
+
+
+def crop_key(crop: np.ndarray, height: int = 32) -> bytes:
+    """Cache key of a line crop: scaled to a fixed height and quantized to 8 gray levels.
+
+    Equal keys mean practically equal pixels, so the same label rendered on
+    another sheet hits the cache while any other text does not.
+    """
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if len(crop.shape) == 3 else crop
+    width = max(1, int(round(gray.shape[1] * height / float(max(gray.shape[0], 1)))))
+    small = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA) >> 5
+    return width.to_bytes(4, 'little') + hashlib.blake2b(small.tobytes(), digest_size=16).digest()
+
+
+class SplitOCREngine:
+    """PaddleOCR pipeline split into its models with a recognition cache in between.
+
+    Orientation classification, text detection, line cropping and
+    recognition run as separate PaddleOCR modules; recognized line crops are
+    kept in a bounded LRU cache, so title blocks, company names and standard
+    notes repeated on every sheet are recognized only once. ocr(image)
+    returns the same page-result shape as PaddleOCR.ocr, so the engine can
+    be used anywhere the pipeline is. Detection parameters, line order and
+    the recognition score threshold are those of the pipeline, so the cache
+    changes the speed, not the text.
+    """
+
+    def __init__(self, det_model_dir=None, rec_model_dir=None, doc_orient_model_dir=None,
+                 textline_ori_model_dir=None, cache_size: int = 4096, rec_batch_size: int = 8,
+                 cpu_threads=None, det_params: dict = None, rec_score_thresh: float = PIPELINE_REC_SCORE_THRESH):
+        from paddleocr import (TextDetection, TextRecognition,
+                               DocImgOrientationClassification, TextLineOrientationClassification)
+
+        common = {'cpu_threads': int(cpu_threads)} if cpu_threads else {}
+
+        def load(cls, model_dir, **params):
+            params.update(common)
+            return cls(model_dir=model_dir, **params) if model_dir else cls(**params)
+
+        self.det = load(TextDetection, det_model_dir, **(PIPELINE_DET_PARAMS if det_params is None else det_params))
+        self.rec_score_thresh = float(rec_score_thresh)
+        self.rec = load(TextRecognition, rec_model_dir)
+        self.doc_orient = load(DocImgOrientationClassification, doc_orient_model_dir)
+        self.textline_orient = load(TextLineOrientationClassification, textline_ori_model_dir)
+        self.cache_size = max(0, int(cache_size))
+        self.rec_batch_size = max(1, int(rec_batch_size))
+        self.cache = OrderedDict()  # crop key -> (text, score)
+        self.hits = 0
+        self.misses = 0
+
+    def _orientation(self, image: np.ndarray) -> int:
+        try:
+            res = next(iter(self.doc_orient.predict(image, batch_size=1)))
+            return int(res['label_names'][0])
+        except Exception:
+            return 0
+
+    def _recognize(self, crops):
+        """Text line orientation + recognition for crops not found in the cache"""
+        try:
+            for i, res in enumerate(self.textline_orient.predict(crops, batch_size=self.rec_batch_size)):
+                if str(res['label_names'][0]).startswith('180'):
+                    crops[i] = np.ascontiguousarray(np.rot90(crops[i], 2))
+        except Exception:
+            pass
+        return [(str(res['rec_text']), float(res['rec_score']))
+                for res in self.rec.predict(crops, batch_size=self.rec_batch_size)]
+
+    def ocr(self, image: np.ndarray, use_doc_orientation_classify: bool = True, **_):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        angle = self._orientation(image) if use_doc_orientation_classify else 0
+        image = rotate_by_angle(image, angle)
+
+        det = next(iter(self.det.predict(image, batch_size=1)))
+        polys = sort_text_lines([np.asarray(p).reshape(4, 2) for p in det['dt_polys']])
+
+        lines = [None] * len(polys)
+        todo = {}  # key -> (crop, [line indices])
+        for i, poly in enumerate(polys):
+            crop = crop_text_line(image, poly)
+            key = crop_key(crop)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                lines[i] = cached
+                self.hits += 1
+            elif key in todo:
+                todo[key][1].append(i)
+                self.hits += 1
+            else:
+                todo[key] = (crop, [i])
+                self.misses += 1
+
+        if todo:
+            keys = list(todo)
+            for key, result in zip(keys, self._recognize([todo[key][0] for key in keys])):
+                for i in todo[key][1]:
+                    lines[i] = result
+                if self.cache_size:
+                    self.cache[key] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+
+        # как в конвейере: строки ниже порога распознавания отбрасываются
+        keep = [i for i, line in enumerate(lines) if line is not None and line[1] >= self.rec_score_thresh]
+        return [{
+            'rec_texts': [lines[i][0] for i in keep],
+            'rec_scores': [lines[i][1] for i in keep],
+            'rec_polys': [polys[i] for i in keep],
+            'dt_polys': polys,
+            'doc_preprocessor_res': {'angle': angle},
+        }]
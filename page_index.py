@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Duplicate-page index: reuse OCR results for sheets that were already recognized.
+
+Every page gets two keys:
+
+- a content fingerprint (SHA-256 of the page size, rotation, content
+  streams and all resources they use, and the annotations) - equal for the same sheet copied
+  into another file or package;
+- a difference hash of a small grayscale raster - equal (or within a few
+  bits) for visually identical pages whose PDF bytes differ, e.g. the same
+  sheet re-exported.
+
+Results are stored per render DPI and color mode (OCR boxes are raster
+coordinates) in SQLite, so one index file can be shared by jobs, worker
+processes and later runs:
+
+    python batch_cli.py --page-index pages.sqlite packages/*.pdf
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 32  # dhash grid: HASH_SIZE x HASH_SIZE bits
+
+
+_REF = re.compile(r'(\d+) \d+ R')
+
+
+def _object_digest(doc, xref: int, memo: dict, active: dict):
+    """Digest of an object and everything it references (xref numbers excluded).
+
+    Returns (digest, depth in active of the object a reference cycle below
+    it returns to, or None). Objects of a cycle hash differently depending
+    on where the cycle is entered, so only digests that do not depend on
+    it are kept in memo.
+    """
+    if xref in memo:
+        return memo[xref], None
+    if xref <= 0 or xref >= doc.xref_length():
+        return 'ref', None
+    if xref in active:
+        return 'ref', active[xref]
+    depth = active[xref] = len(active)
+    text, loop = _digest_refs(doc, doc.xref_object(xref, compressed=True), memo, active)
+    h = hashlib.sha256(text.encode('utf-8', 'replace'))
+    if doc.xref_is_stream(xref):
+        h.update(doc.xref_stream_raw(xref) or b'')
+    del active[xref]
+    if loop is not None and loop <= depth:
+        return h.hexdigest(), loop
+    memo[xref] = h.hexdigest()
+    return memo[xref], None
+
+
+def _digest_refs(doc, text: str, memo: dict, active: dict):
+    """Object source with every reference replaced by the digest of its target"""
+    loops = []
+
+    def digest(m):
+        value, loop = _object_digest(doc, int(m.group(1)), memo, active)
+        if loop is not None:
+            loops.append(loop)
+        return value
+
+    text = _REF.sub(digest, text)
+    return text, min(loops) if loops else None
+
+
+def page_fingerprint(page, memo: dict = None) -> str:
+    """Content hash of a PyMuPDF page (independent of the file it is in).
+
+    Covers the content streams and, recursively, every resource they can
+    use (form XObjects, images, fonts, patterns), because CAD exports often
+    have identical one-line page contents that only invoke a different form.
+    Annotations (stamps, clouds, FreeText) count too, with their appearance
+    streams: a revision that only adds markup is a different page.
+
+    memo: object digests shared by the pages of one document, so resources
+    used by every sheet (title block forms, fonts) are hashed once.
+    """
+    doc = page.parent
+    if memo is None:
+        memo = {}
+    h = hashlib.sha256()
+    h.update(f"{page.rect.width:.2f}x{page.rect.height:.2f}/{page.rotation}".encode())
+    h.update(page.read_contents() or b'')
+    # Resources may be inherited from the page tree
+    xref = page.xref
+    kind, value = doc.xref_get_key(xref, 'Resources')
+    while kind == 'null':
+        kind, parent = doc.xref_get_key(xref, 'Parent')
+        if kind != 'xref':
+            break
+        xref = int(parent.split()[0])
+        kind, value = doc.xref_get_key(xref, 'Resources')
+    h.update(_digest_refs(doc, value, memo, {})[0].encode())
+    for xref, _, _ in page.annot_xrefs():
+        # References of an annotation point back to its page (/P, /Popup, link targets) and
+        # through it to the whole file, so only its own keys and appearance are followed
+        h.update(_REF.sub('ref', doc.xref_object(xref, compressed=True)).encode('utf-8', 'replace'))
+        kind, value = doc.xref_get_key(xref, 'AP')
+        if kind == 'xref':
+            h.update(_object_digest(doc, int(value.split()[0]), memo, {})[0].encode())
+        elif kind == 'dict':
+            h.update(_digest_refs(doc, value, memo, {})[0].encode())
+    return h.hexdigest()
+
+
+def difference_hash(img: np.ndarray, size: int = HASH_SIZE) -> str:
+    """Perceptual difference hash of a page raster (gray or BGR), as hex"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):0{size * size // 4}x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+class PageIndex:
+    """SQLite-backed store of OCR results keyed by page fingerprint and dhash.
+
+    path=None keeps the index in memory (reuse within one job only).
+    near_distance is the largest dhash Hamming distance still treated as
+    the same page; None (default) disables near matching. Even 0 can match
+    sheets that differ only in a small label (a revision letter changes few
+    or no hash bits), so enable it only for sets where that is acceptable.
+    """
+
+    def __init__(self, path: str = None, near_distance: int = None):
+        self.path = path or ':memory:'
+        self.near_distance = None if near_distance is None else int(near_distance)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            if path:
+                self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                ' fingerprint TEXT NOT NULL, dhash TEXT, size TEXT NOT NULL,'
+                ' dpi INTEGER NOT NULL, mode TEXT NOT NULL,'
+                ' rotation INTEGER, results TEXT NOT NULL, created REAL,'
+                ' PRIMARY KEY (fingerprint, dpi, mode))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS pages_near ON pages (size, dpi, mode)')
+
+    @staticmethod
+    def _size(page) -> str:
+        return f"{page.rect.width:.0f}x{page.rect.height:.0f}/{page.rotation}"
+
+    def lookup(self, fingerprint: str, dpi: int, mode: str = 'rgb'):
+        """Exact match: (ocr_results, rotation) or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT results, rotation FROM pages WHERE fingerprint=? AND dpi=? AND mode=?',
+                                    (fingerprint, int(dpi), mode)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return json.loads(row[0]), row[1] or 0
+
+    def contains(self, fingerprint: str, dpi: int, mode: str = 'rgb') -> bool:
+        """Whether lookup() would hit (without counting it)"""
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM pages WHERE fingerprint=? AND dpi=? AND mode=?',
+                                     (fingerprint, int(dpi), mode)).fetchone() is not None
+
+    def lookup_near(self, page, dhash: str, dpi: int, mode: str = 'rgb'):
+        """Closest visually identical page within near_distance: (ocr_results, rotation) or None"""
+        if self.near_distance is None:
+            return None
+        with self.lock:
+            rows = self.conn.execute('SELECT dhash, results, rotation FROM pages WHERE size=? AND dpi=? AND mode=?'
+                                     ' AND dhash IS NOT NULL', (self._size(page), int(dpi), mode)).fetchall()
+        best = None
+        for other, results, rotation in rows:
+            distance = hamming(dhash, other)
+            if distance <= self.near_distance and (best is None or distance < best[0]):
+                best = (distance, results, rotation)
+        if best is None:
+            return None
+        self.near_hits += 1
+        return json.loads(best[1]), best[2] or 0
+
+    def store(self, page, fingerprint: str, dhash: str, dpi: int, mode: str, ocr_results, rotation):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (fingerprint, dhash, self._size(page), int(dpi), mode, int(rotation or 0),
+                               json.dumps(ocr_results, ensure_ascii=False, default=float), time.time()))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Page rasterization shared by process_pdf and the render process.
+
+Only PyMuPDF, OpenCV and numpy: the render process of shm_transport.py
+imports this module instead of run_process_0100, so starting it does not
+import Paddle.
+"""
+import cv2
+import fitz
+import numpy as np
+
+
+def content_clip(page, margin: float = 6.0, min_saving: float = 0.1):
+    """Bounding box of everything drawn on the page, or None if it is not worth clipping.
+
+    Uses the page's bbox log (paths, text, images, shadings); invisible text
+    is ignored. None is returned for rotated pages and when the clip would
+    save less than min_saving of the page area.
+    """
+    if page.rotation:
+        return None
+    bbox = fitz.Rect()
+    try:
+        for kind, rect in page.get_bboxlog():
+            if kind.startswith(('fill-', 'stroke-')):
+                bbox |= fitz.Rect(rect)
+    except AttributeError:
+        # старый PyMuPDF без get_bboxlog
+        for path in page.get_drawings():
+            bbox |= path['rect']
+        for info in page.get_image_info():
+            bbox |= fitz.Rect(info['bbox'])
+        for block in page.get_text('blocks'):
+            bbox |= fitz.Rect(block[:4])
+    if bbox.is_empty:
+        return None
+    clip = (bbox + (-margin, -margin, margin, margin)) & page.rect
+    if clip.get_area() > (1.0 - min_saving) * page.rect.get_area():
+        return None
+    return clip
+
+
+def clip_offset(page, clip, dpi: int = 300):
+    """Pixel position of a clip rendered by render_page inside the full-page raster"""
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    full = (page.rect * mat).irect
+    part = (clip * mat).irect
+    return part.x0 - full.x0, part.y0 - full.y0
+
+
+def page_raster_shape(page, dpi: int = 300):
+    """Shape (h, w, 3) of the image render_page produces for the whole page"""
+    full = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+    return (full.height, full.width, 3)
+
+
+COLOR_MODES = ('rgb', 'gray', 'bitonal')
+
+
+def render_page(page, dpi: int = 300, clip=None, color_mode: str = 'rgb', encode: bool = True):
+    """Rasterize a page; returns (image for OCR, PNG bytes for the output page).
+
+    color_mode 'rgb' gives a BGR image, 'gray' a single-channel one rendered
+    straight into a gray pixmap (a third of the memory), 'bitonal' the gray
+    image binarized with Otsu. With clip only that part of the page is
+    rasterized (see content_clip); with encode=False no PNG is made and
+    None is returned in its place.
+    """
+    if color_mode not in COLOR_MODES:
+        raise ValueError(f"Unknown color mode: {color_mode}")
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    colorspace = fitz.csRGB if color_mode == 'rgb' else fitz.csGRAY
+    pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=colorspace, alpha=False)
+
+    # Samples are used in place instead of a PNG encode/decode round trip
+    img = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+    if color_mode == 'rgb':
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    else:
+        img = img[:, :, 0]
+        if color_mode == 'bitonal':
+            _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    img_data = None
+    if encode:
+        img_data = cv2.imencode('.png', img)[1].tobytes() if color_mode == 'bitonal' else pix.tobytes('png')
+    return img, img_data
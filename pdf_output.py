@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writing of the searchable PDF.
+
+A plain Document.save() keeps every object the pages were built from:
+unused objects, uncompressed content streams and one font resource per
+insert_text call. save_pdf() garbage-collects the file and merges duplicate
+objects (garbage=3; 4 also compares stream contents, slower on big files),
+compresses streams and packs small objects into object streams. With
+linearize=True the result is rewritten by qpdf (pikepdf) as a linearized
+"fast web view" PDF, so a viewer on a network share or web portal shows
+page 1 before the whole file has arrived; MuPDF no longer writes linearized
+files itself.
+"""
+import os
+import time
+
+import pikepdf
+
+
+def save_pdf(doc, output_path: str, garbage: int = 3, linearize: bool = False) -> dict:
+    """Save a fitz document compactly (and linearized); returns timings and the size.
+
+    {'write': seconds, 'linearize': seconds (0 if not asked), 'bytes': file size}
+    """
+    t_write = time.perf_counter()
+    target = f"{output_path}.tmp" if linearize else output_path
+    doc.save(target, garbage=int(garbage), deflate=True, deflate_fonts=True,
+             use_objstms=0 if linearize else 1)
+    result = {'write': time.perf_counter() - t_write, 'linearize': 0.0}
+    if linearize:
+        t_linear = time.perf_counter()
+        try:
+            with pikepdf.open(target) as pdf:
+                pdf.save(output_path, linearize=True, compress_streams=True,
+                         object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        finally:
+            os.remove(target)
+        result['linearize'] = time.perf_counter() - t_linear
+    result['bytes'] = os.path.getsize(output_path)
+    return result
+
+
+def describe_save(result: dict) -> str:
+    """Log line for a save_pdf() result"""
+    text = f"💾 Saved {result['bytes'] / (1024 * 1024):.1f} MB in {result['write'] + result['linearize']:.2f}s"
+    if result['linearize']:
+        text += f" (linearized in {result['linearize']:.2f}s)"
+    return text
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling of one process_pdf run: where does the time of a slow file go.
+
+process_pdf(profile=True) switches a fresh cProfile profile on for every
+stage of every page (init, render, ocr, assemble, save) and, next to it, a
+sampling thread records the Python stack of the processing thread every few
+milliseconds. The results are written into <output>_profile/:
+
+    stage_<name>.pstats   cProfile data of a stage over all pages
+    page_0001.pstats      cProfile data of one page (all its stages)
+    all.pstats            everything together
+    hotspots.txt          the top functions by own and cumulative time
+    stacks.collapsed      sampled stacks, stage first, in the "a;b;c count"
+                          format of flamegraph.pl and speedscope
+
+    python -m pstats page_0012.pstats
+    flamegraph.pl stacks.collapsed > flame.svg
+
+Only the calling process is profiled: render_process / page_timeout move
+rendering or OCR into child processes, which then show up as waiting.
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+
+
+def profile_dir(output_path: str) -> str:
+    """Default profile folder of an output PDF"""
+    return f"{os.path.splitext(output_path)[0]}_profile"
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _sample(ref, stop_event, interval: float):
+    """Sampling thread: count the stack of the processing thread, prefixed by its stage.
+
+    Holds the profiler only weakly: if process_pdf fails midway, the profiler
+    is collected, which switches cProfile off and ends this thread.
+    """
+    while not stop_event.wait(interval):
+        profiler = ref()
+        if profiler is None:
+            return
+        profiler.sample()
+        del profiler
+
+
+class Profiler:
+    """Per-stage / per-page cProfile plus a sampling thread for flame graphs.
+
+    switch(stage, page) ends the current stage and starts the next one, so
+    the profiler follows the existing stage boundaries of process_pdf;
+    finish() writes all files and returns the top hotspots.
+    """
+
+    def __init__(self, out_dir: str, sample_interval: float = 0.005, top: int = 15):
+        self.out_dir = out_dir
+        self.sample_interval = float(sample_interval)
+        self.top = int(top)
+        self.current = None          # (stage, page, cProfile.Profile or None)
+        self.stage_stats = {}        # stage -> pstats.Stats
+        self.page_stats = {}         # page -> pstats.Stats
+        self.stage_seconds = Counter()
+        self.stacks = Counter()
+        self.samples = 0
+        self.stage_started = None
+        self.thread_id = threading.get_ident()
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=_sample, name='profile-sampler', daemon=True,
+                                        args=(weakref.ref(self), self.stop_event, self.sample_interval))
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self, stage: str = 'init', page=None):
+        self.sampler.start()
+        self.switch(stage, page)
+        return self
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        current = self.current
+        if frame is None or current is None:
+            return
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        names.append(current[0])
+        self.stacks[';'.join(reversed(names))] += 1
+        self.samples += 1
+
+    def __del__(self):
+        self.stop_event.set()
+
+    def _end_stage(self):
+        if self.current is None:
+            return
+        stage, page, profile = self.current
+        self.current = None
+        self.stage_seconds[stage] += time.perf_counter() - self.stage_started
+        if profile is None:
+            return
+        profile.disable()
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:
+            return  # nothing was called
+        for table, key in ((self.stage_stats, stage), (self.page_stats, page)):
+            if key is None:
+                continue
+            if key in table:
+                table[key].add(stats)
+            else:
+                table[key] = pstats.Stats(profile)
+
+    def switch(self, stage: str, page=None):
+        """End the running stage and profile `stage` of `page` (0-based, None outside pages)"""
+        self._end_stage()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None  # another profiler (debugger, coverage) is active: sampling only
+        self.stage_started = time.perf_counter()
+        self.current = (stage, page, profile)
+
+    def close(self):
+        """Stop profiling without writing anything (the run failed); no-op after finish()"""
+        if self.current is not None:
+            profile = self.current[2]
+            self.current = None
+            if profile is not None:
+                profile.disable()
+        self.stop_event.set()
+
+    def finish(self) -> dict:
+        """Stop profiling, write the files; returns {'dir', 'stages', 'samples', 'hotspots'}"""
+        self._end_stage()
+        self.stop_event.set()
+        if self.sampler.is_alive():
+            self.sampler.join(timeout=5)
+
+        combined = None
+        for stage, stats in self.stage_stats.items():
+            stats.dump_stats(os.path.join(self.out_dir, f"stage_{stage}.pstats"))
+            if combined is None:
+                combined = pstats.Stats(os.path.join(self.out_dir, f"stage_{stage}.pstats"))
+            else:
+                combined.add(stats)
+        for page, stats in self.page_stats.items():
+            stats.dump_stats(os.path.join(self.out_dir, f"page_{page + 1:04d}.pstats"))
+        with open(os.path.join(self.out_dir, 'stacks.collapsed'), 'w', encoding='utf-8') as fh:
+            for stack, count in sorted(self.stacks.items()):
+                fh.write(f"{stack} {count}\n")
+
+        hotspots = []
+        if combined is not None:
+            combined.dump_stats(os.path.join(self.out_dir, 'all.pstats'))
+            with open(os.path.join(self.out_dir, 'hotspots.txt'), 'w', encoding='utf-8') as fh:
+                combined.stream = fh
+                fh.write("By own time\n")
+                combined.sort_stats('tottime').print_stats(self.top)
+                fh.write("By cumulative time\n")
+                combined.sort_stats('cumulative').print_stats(self.top)
+            for func, (_, calls, tottime, cumtime, _) in sorted(combined.stats.items(),
+                                                                key=lambda kv: kv[1][2], reverse=True)[:self.top]:
+                filename, line, name = func
+                where = f"{os.path.basename(filename)}:{line}({name})" if line else name
+                hotspots.append({'function': where, 'calls': calls,
+                                 'tottime': round(tottime, 3), 'cumtime': round(cumtime, 3)})
+        return {
+            'dir': self.out_dir,
+            'stages': {k: round(v, 3) for k, v in self.stage_seconds.items()},
+            'samples': self.samples,
+            'hotspots': hotspots,
+        }
@@ -1,20 +1,26 @@
 import sys
 import os
+import inspect
+import threading
+import time
 from pathlib import Path
-sys.path.append(r'c:\Esphome\PDF')
 
 import fitz
 import cv2
 import numpy as np
 from paddleocr import PaddleOCR
-from ocr_utils_fixed import TechnicalOCRProcessor
+from ocr_utils_fixed import TechnicalOCRProcessor, SplitOCREngine, pipeline_kwargs, rotate_by_angle
+from page_index import PageIndex, difference_hash, page_fingerprint
+from page_render import clip_offset, content_clip, page_raster_shape, render_page
+from shm_transport import RenderProcess, get_renderer
+from memory_governor import MemoryGovernor, get_governor, page_cost
+from ocr_supervisor import PageFailed, get_supervisor
+from profiler import Profiler, profile_dir
+import metrics
+from pdf_output import describe_save, save_pdf
 import json
 
 
-INPUT = r'c:\Esphome\OCR\PDF rezerv\0100.pdf'
-OUTPUT = r'c:\Esphome\OCR\PDF rezerv\0100_searchable.pdf'
-
-
 def analyze_page_content(page):
     """Analyze page content and determine its type"""
     try:
@@ -66,28 +72,14 @@ def analyze_page_content(page):
         return "unknown"
 
 
-def process_pdf(input_path: str,
-                output_path: str,
-                hide_text: bool = False,
-                flip_x: bool = False,
-                flip_y: bool = True,
-                top_shift_px: float = 20.0,
-                font_size: int = 8,
-                dump_debug_first_page: bool = True,
-                dpi: int = 300,
-                log_callback=None):
-    """Process a PDF and produce a searchable PDF using PaddleOCR."""
-
-    def log_message(msg):
-        """Log message using callback or print"""
-        if log_callback:
-            log_callback(msg)
-        else:
-            print(msg)
-
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"Input file not found: {input_path}")
+def create_ocr_engine(cpu_threads=None, rec_cache=0):
+    """Create a PaddleOCR engine from the local models folder.
 
+    The engine can be passed to process_pdf(ocr_engine=...) to reuse it
+    across several files instead of loading the models for every call.
+    With rec_cache > 0 a SplitOCREngine is built from the same models; it
+    caches up to rec_cache recognized line crops across pages and files.
+    """
     # ✅ Инициализация OCR с локальными моделями (как в test.py)
     try:
         base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -109,8 +101,17 @@ def process_pdf(input_path: str,
             'use_textline_orientation': True,
             'use_doc_orientation_classify': True,
             #'lang': 'en',
+            # explicit, so that SplitOCREngine (--rec-cache) detects and filters lines the same way
+            **pipeline_kwargs(),
         }
+        if cpu_threads:
+            ocr_kwargs['cpu_threads'] = int(cpu_threads)
 
+        if rec_cache:
+            return SplitOCREngine(det_model_dir=det_dir, rec_model_dir=rec_dir,
+                                  doc_orient_model_dir=doc_orient_dir,
+                                  textline_ori_model_dir=textline_ori_dir,
+                                  cache_size=rec_cache, cpu_threads=cpu_threads)
 
         ocr = PaddleOCR(**ocr_kwargs)
     except Exception as e:
@@ -120,199 +121,602 @@ def process_pdf(input_path: str,
             ocr = PaddleOCR(use_textline_orientation=True, lang='en')
         except Exception as e2:
             raise RuntimeError(f"Failed to initialize PaddleOCR: {e2}")
+    return ocr
 
-    processor = TechnicalOCRProcessor()
-    FONT_SIZE = 4
 
-    doc = fitz.open(input_path)
-    new_doc = fitz.open()
-    total_pages = len(doc)
-    total_blocks = 0
+def native_text_lines(page, dpi: int = 300):
+    """Horizontal native text lines of a page as OCR-style results in raster pixels.
+
+    Lines whose text did not extract cleanly (no Unicode mapping) are left
+    out so OCR still reads them; rotated pages return nothing.
+    """
+    if page.rotation:
+        return []
+    scale = dpi / 72
+    lines = []
+    for block in page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT)['blocks']:
+        for line in block.get('lines', []):
+            dx, dy = line['dir']
+            if dx <= 0 or abs(dy) > 1e-3:
+                continue
+            text = ' '.join(''.join(span['text'] for span in line['spans']).split())
+            if not text or text.count('\ufffd') > len(text) // 4:
+                continue
+            x0, y0, x1, y1 = (v * scale for v in line['bbox'])
+            lines.append([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], [text, 1.0]])
+    return lines
+
+
+def mask_boxes(img, boxes, offset=(0, 0), pad: int = 2):
+    """Paint boxes (full-page pixels) white on img, which may be a clip starting at offset"""
+    if not img.flags.writeable:
+        img = img.copy()
+    white = 255 if img.ndim == 2 else (255, 255, 255)
+    for bbox, _ in boxes:
+        xs, ys = [pt[0] - offset[0] for pt in bbox], [pt[1] - offset[1] for pt in bbox]
+        cv2.rectangle(img, (int(min(xs)) - pad, int(min(ys)) - pad), (int(max(xs)) + pad, int(max(ys)) + pad),
+                      white, -1)
+    return img
+
+
+def is_blank_raw(raw_ret) -> bool:
+    """Whether ocr_page / ocr_page_tiled skipped the page as blank"""
+    return bool(raw_ret) and isinstance(raw_ret[0], dict) and bool(raw_ret[0].get('blank_page'))
 
-    for i in range(total_pages):
-        FONT_SIZE = 8
-        page = doc[i]
-        
-        # Analyze page content type
-        page_type = analyze_page_content(page)
-        log_message(f"📄 Page {i+1}: type = {page_type}")
-        
-        mat = fitz.Matrix(dpi / 72, dpi / 72)
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes('png')
 
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+def ocr_page(img, ocr, processor, angle=None):
+    """Run inference once for a page; returns (normalized OCR results, raw engine output).
 
-        # Сырые результаты для отладки
+    Blank pages are not sent to the engine at all (raw output
+    [{'blank_page': True}], see is_blank_raw) and empty margins are cropped
+    away (see TechnicalOCRProcessor.prepare_ocr_input); the boxes are
+    returned in full-image coordinates either way.
+
+    angle: page orientation found by page_orientation(); the image is turned
+    here and the engine's own orientation classifier is switched off. None
+    leaves orientation to the engine.
+    """
+    ocr_img, offset = processor.prepare_ocr_input(img)
+    if ocr_img is None:
+        return [], [{'blank_page': True}]
+    crop = ocr_img
+    if ocr_img.ndim == 2:
+        # The engine expects 3 channels; gray pages are expanded only here, after cropping
+        ocr_img = cv2.cvtColor(ocr_img, cv2.COLOR_GRAY2BGR)
+    ocr_kwargs = None
+    if angle is not None:
+        ocr_img = rotate_by_angle(ocr_img, angle)
+        ocr_kwargs = {'use_doc_orientation_classify': False}
+    # Сырые результаты для отладки
+    raw_ret = []
+    try:
+        raw_ret = ocr.ocr(ocr_img, **(ocr_kwargs or {}))
+    except Exception:
         raw_ret = []
+    ocr_results = processor.process_page_ocr(ocr_img, ocr, raw=raw_ret, ocr_kwargs=ocr_kwargs)
+    if angle is not None and raw_ret and isinstance(raw_ret[0], dict):
+        # the rest of the pipeline reads the angle where the engine reports it
+        raw_ret[0]['doc_preprocessor_res'] = {'angle': int(angle)}
+    if crop is not img:
+        ocr_results = processor.map_to_page(ocr_results, offset, crop.shape, img.shape,
+                                            angle if angle is not None else rotation_from_raw(raw_ret))
+    return ocr_results, raw_ret
+
+
+def _upright_center(bbox, angle, shape):
+    """Centre (x, y) in the upright image of a box given in the engine frame"""
+    h, w = shape[:2]
+    cx = sum(pt[0] for pt in bbox) / len(bbox)
+    cy = sum(pt[1] for pt in bbox) / len(bbox)
+    return {0: (cx, cy), 90: (w - cy, cx), 180: (w - cx, h - cy), 270: (cy, h - cx)}[int(angle or 0) % 360]
+
+
+def ocr_page_tiled(page, ocr, processor, dpi: int = 300, tiles: int = 2, angle=None,
+                   color_mode: str = 'rgb', native_lines=(), overlap: int = 128, recognize=None):
+    """OCR a page in a number of bands so only one band is in memory at a time.
+
+    Bands run along the text lines (rows of the engine frame) and overlap by
+    overlap pixels; a line is kept from the band whose own part contains its
+    centre. Returns (results in full-page coordinates, raw output carrying
+    the angle) like ocr_page; the whole page uses one angle (0 when none is
+    given, a band is too small to classify). recognize(img, angle) replaces
+    ocr_page for the bands (e.g. a supervised worker). The page counts as
+    blank when every band is.
+    """
+    recognize = recognize or (lambda band, band_angle: ocr_page(band, ocr, processor, band_angle))
+    angle = int(angle or 0) % 360
+    full_shape = page_raster_shape(page, dpi)
+    across = 0 if angle in (90, 270) else 1  # upright axis the bands are cut along (0: x, 1: y)
+    length = full_shape[1 - across]
+    step = max(2 * overlap, -(-length // max(1, int(tiles))))
+    scale = dpi / 72
+    rect = page.rect
+    results = []
+    blank = True
+    start = 0
+    while start < length:
+        stop = min(length, start + step + overlap)
+        if across:
+            clip = fitz.Rect(rect.x0, rect.y0 + start / scale, rect.x1, rect.y0 + stop / scale)
+        else:
+            clip = fitz.Rect(rect.x0 + start / scale, rect.y0, rect.x0 + stop / scale, rect.y1)
+        img, _ = render_page(page, dpi, clip, color_mode, encode=False)
+        offset = clip_offset(page, clip, dpi)
+        if native_lines:
+            img = mask_boxes(img, native_lines, offset)
+        tile_results, tile_raw = recognize(img, angle)
+        blank = blank and is_blank_raw(tile_raw)
+        size = img.shape[1 - across]
+        own_start = 0 if start == 0 else overlap // 2
+        own_stop = size if stop >= length else size - overlap // 2
+        tile_results = [line for line in tile_results
+                        if own_start <= _upright_center(line[0], angle, img.shape)[across] < own_stop]
+        results += processor.map_to_page(tile_results, offset, img.shape, full_shape, angle)
+        del img
+        if stop >= length:
+            break
+        start = stop - overlap
+    raw = {'doc_preprocessor_res': {'angle': angle}}
+    if blank:
+        raw['blank_page'] = True
+    return results, [raw]
+
+
+_ORIENTATION = threading.local()
+
+
+def get_orientation_classifier(cpu_threads=None):
+    """Document orientation model from the local models folder, loaded once per thread (None if unavailable)"""
+    if not hasattr(_ORIENTATION, 'model'):
+        _ORIENTATION.model = None
         try:
-            raw_ret = ocr.ocr(img)
-        except Exception:
-            raw_ret = []
+            from paddleocr import DocImgOrientationClassification
+            model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'doc_orient')
+            kwargs = {'cpu_threads': int(cpu_threads)} if cpu_threads else {}
+            if os.path.isdir(model_dir):
+                kwargs['model_dir'] = model_dir
+            _ORIENTATION.model = DocImgOrientationClassification(**kwargs)
+        except Exception as e:
+            print(f"Orientation classifier not available: {e}")
+    return _ORIENTATION.model
 
-        if dump_debug_first_page and i == 0:
-            try:
-                input_basename = os.path.splitext(os.path.basename(input_path))[0]
-                raw_dbg = os.path.join(os.path.dirname(input_path), f'{input_basename}_page1_ocr_raw.txt')
-                with open(raw_dbg, 'w', encoding='utf-8') as fh:
-                    fh.write(repr(raw_ret))
-                print(f"  Wrote raw OCR dump: {raw_dbg}")
-            except Exception:
-                pass
-
-        # ⚙️ Process page (includes vertical text correction)
-        log_message(f"📄 Processing page {i+1}/{total_pages}")
-        ocr_results = processor.process_page_ocr(img, ocr)
+
+def engine_accepts_options(ocr) -> bool:
+    """True if ocr.ocr() takes per-call pipeline switches (PaddleOCR 3.x style **kwargs)"""
+    try:
+        params = inspect.signature(ocr.ocr).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.kind == p.VAR_KEYWORD or p.name == 'use_doc_orientation_classify' for p in params)
+
+
+def page_orientation(page, classifier, thumb_side: int = 448):
+    """Orientation angle (0/90/180/270) of a rendered page, decided on a thumbnail.
+
+    A page with /Rotate is taken as the author set it: the renderer already
+    applies the rotation, so no classification is needed.
+    """
+    if page.rotation or classifier is None:
+        return 0
+    zoom = thumb_side / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+    thumb = cv2.cvtColor(np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, 3),
+                         cv2.COLOR_RGB2BGR)
+    try:
+        res = next(iter(classifier.predict(thumb, batch_size=1)))
+        return int(res['label_names'][0])
+    except Exception:
+        return 0
+
+
+def rotation_from_raw(raw_ret):
+    """Page angle found by the engine's doc-orientation classifier (None if not reported)"""
+    if raw_ret and isinstance(raw_ret, list) and len(raw_ret) > 0:
+        if isinstance(raw_ret[0], dict) and 'doc_preprocessor_res' in raw_ret[0]:
+            doc_preprocessor = raw_ret[0]['doc_preprocessor_res']
+            if 'angle' in doc_preprocessor:
+                return doc_preprocessor['angle']
+    return None
+
+
+def assemble_page(new_doc, page, page_index, input_path, page_type, img, img_data,
+                  ocr_results, rotation_angle, hide_text, flip_x, flip_y,
+                  top_shift_px, font_size, log_message=print, overlay_page=None):
+    """Add the output page for one source page: page image/graphics plus OCR text layer.
+
+    overlay_page: a copy of the original page already in new_doc; only the
+    text layer is added to it, placed as on a page stored as an image.
+    """
+    # Создаем новую страницу (или добавляем текст на копию исходной)
+    if overlay_page is not None:
+        new_page = overlay_page
+    else:
+        new_page = new_doc.new_page(width=page.rect.width, height=page.rect.height)
+
+    # Apply different algorithms depending on page type
+    if page_type == "vector_based" and overlay_page is None:
+        log_message(f"  🔧 Using precise positioning for vector graphics")
+        # Сложная логика с pikepdf для точного позиционирования (строки 124-231 из оригинала)
+        import pikepdf
+        import tempfile
+
+        # Получаем оригинальные размеры через fitz (points)
+        _tmp_doc = fitz.open(input_path)
+        _src_page_for_size = _tmp_doc[page_index]
+        src_w, src_h = _src_page_for_size.rect.width, _src_page_for_size.rect.height
+        _tmp_doc.close()
+
+        # Подбираем запас (margin) — минимум 72pt (1"), плюс небольшой процент размера страницы
+        margin_x = max(300, src_w * 0.12)   # запас по горизонтали (влево и вправо)
+        margin_y = max(300, src_h * 0.12)   # запас по вертикали (вверх и вниз)
+
+        # Создаём временный файл и копируем в него страницу, меняя MediaBox
+        tmp_no_crop = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        tmp_no_crop_path = tmp_no_crop.name
+        tmp_no_crop.close()
+
+        with pikepdf.open(input_path) as src_pdf:
+            new_pdf = pikepdf.Pdf.new()
+            new_pdf.pages.append(src_pdf.pages[page_index])
+            pg = new_pdf.pages[0].obj
+
+            # Удаляем обрезающие box'ы, если есть
+            for key in ("/CropBox", "/TrimBox", "/BleedBox", "/ArtBox"):
+                if key in pg:
+                    try:
+                        del pg[key]
+                    except Exception:
+                        pass
+
+            # Устанавливаем расширенную MediaBox: двустороннее расширение
+            # MediaBox = [llx lly urx ury]
+            new_llx = -margin_x
+            new_lly = -margin_y
+            new_urx = src_w + margin_x
+            new_ury = src_h + margin_y
+            pg["/MediaBox"] = pikepdf.Array([new_llx, new_lly, new_urx, new_ury])
+
+            new_pdf.save(tmp_no_crop_path)
+
+        # Открываем модифицированный PDF через fitz и уменьшаем страницу
+        src_full = fitz.open(tmp_no_crop_path)
+        full_page = src_full[0]
+        full_w, full_h = full_page.rect.width, full_page.rect.height
+
+        # Настройки позиционирования для разных углов поворота
+        # 90 уже настроен корректно у вас — сохраняем его поведение
+        if rotation_angle == 90:
+            page_scale = 1.22
+            image_offset_x = -22
+            image_offset_y = -275
+            rotate_param = rotation_angle  # сохраняем прежний поворот
+        elif rotation_angle == 0: # Настроен для 0, проверен
+            # блок для 0°
+            page_scale = 1
+            image_offset_x = 0
+            image_offset_y = 0
+            rotate_param = 0
+        elif rotation_angle == 180:
+            # блок для 180°
+            page_scale = 1
+            image_offset_x = 0
+            image_offset_y = 0
+            rotate_param = 0
+        elif rotation_angle == 270: # Настроен для 270, проверен
+            # блок для 270°
+            page_scale = 1.22
+            image_offset_x = -22
+            image_offset_y = -275
+            rotate_param = (-rotation_angle)
+        else:
+            # дефолтные параметры для других углов
+            page_scale = 1.22
+            image_offset_x = -22
+            image_offset_y = -275
+            rotate_param = (rotation_angle)
+
+        scaled_w = full_w * page_scale
+        scaled_h = full_h * page_scale
+
+        # Создаём временный документ, куда отрисуем всю расширенную страницу в уменьшенном виде
+        scaled_doc = fitz.open()
+        scaled_page = scaled_doc.new_page(width=scaled_w, height=scaled_h)
+        target_rect = fitz.Rect(0, 0, scaled_w, scaled_h)
+
+        # Рисуем ВСЮ страницу (clip=None) — теперь MediaBox расширена, поэтому ничего не обрежется
+        scaled_page.show_pdf_page(target_rect, src_full, 0, clip=None)
+
+        # Вставляем в итоговый документ (как в вашем основном потоке)
+        # new_page уже создан выше
+
+        adjusted_rect = fitz.Rect(
+            (page.rect.width - scaled_w) / 2 + image_offset_x,
+            (page.rect.height - scaled_h) / 2 + image_offset_y,
+            (page.rect.width - scaled_w) / 2 + image_offset_x + scaled_w,
+            (page.rect.height - scaled_h) / 2 + image_offset_y + scaled_h
+        )
+
+        # Сохраняем прежнюю логику поворота при вставке
+        new_page.show_pdf_page(adjusted_rect, scaled_doc, 0, rotate=rotate_param)
+
+        # Закрываем временные документы и удаляем временный файл
+        src_full.close()
+        scaled_doc.close()
+        try:
+            os.remove(tmp_no_crop_path)
+        except Exception:
+            pass
+        # ---- END ----
         
-        # 🔧 Определяем угол поворота из сырых результатов OCR
-        rotation_angle = 0
-        if raw_ret and isinstance(raw_ret, list) and len(raw_ret) > 0:
-            if isinstance(raw_ret[0], dict) and 'doc_preprocessor_res' in raw_ret[0]:
-                doc_preprocessor = raw_ret[0]['doc_preprocessor_res']
-                if 'angle' in doc_preprocessor:
-                    rotation_angle = doc_preprocessor['angle']
-                    log_message(f"  Detected rotation angle: {rotation_angle} degrees")
+        # === Добавляем OCR текст для vector_based ===
+        if hide_text:
+            # Сначала вставляем скрытый текст ПОД изображением
+            for line in ocr_results:
+                try:
+                    if not (isinstance(line, (list, tuple)) and len(line) >= 2):
+                        continue
+                    bbox = line[0]
+                    text_info = line[1]
+                    text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
+                    xs = [float(pt[0]) for pt in bbox]
+                    ys = [float(pt[1]) for pt in bbox]
+                    xmin, xmax = min(xs), max(xs)
+                    ymin, ymax = min(ys), max(ys)
+                    
+                    # 🔧 Коррекция координат с учетом поворота изображения
                     if rotation_angle in [90, 270]:
-                        log_message(f"  Auto-applying flip operations for vertical page")
+                        # При повороте на 90 градусов по часовой стрелке:
+                        # координаты текста даны в повернутой системе координат
+                        # нужно преобразовать их обратно к исходной системе
+                        orig_width, orig_height = img.shape[1], img.shape[0]
+                        # Поворачиваем координаты обратно на -90 градусов
+                        # При повороте на -90 градусов: (x,y) -> (y, width-x)
+                        new_xmin = ymin
+                        new_xmax = ymax
+                        new_ymin = orig_width - xmax
+                        new_ymax = orig_width - xmin
+                        xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                    elif rotation_angle == 270:
+                        # При повороте на 270 градусов (против часовой стрелки):
+                        # координаты текста даны в повернутой системе координат
+                        # нужно преобразовать их обратно к исходной системе
+                        orig_width, orig_height = img.shape[1], img.shape[0]
+                        # Поворачиваем координаты обратно на -270 градусов (по часовой стрелке на 90)
+                        # При повороте на 90 градусов: (x,y) -> (y, width-x)
+                        new_xmin = ymin
+                        new_xmax = ymax
+                        new_ymin = orig_width - xmax
+                        new_ymax = orig_width - xmin
+                        xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                        
+                        # 🔧 Смещение текста вверх для вертикальных страниц
+                        y_offset = orig_height *-0.48  # Смещение на -52% высоты вверх
+                        ymin += y_offset
+                        ymax += y_offset
+                    
+                    scale_x = page.rect.width / img.shape[1]
+                    scale_y = page.rect.height / img.shape[0]
+                    
+                    # 🔧 Для страниц с вертикальными блоками автоматически применяем flip операции
+                    if rotation_angle == 90:
+                        # Для вертикальных страниц (90°) применяем flip операции
+                        px1 = page.rect.width - (xmin * scale_x)
+                        px2 = page.rect.width - (xmax * scale_x)
+                        py1 = page.rect.height - (ymin * scale_y)
+                        py2 = page.rect.height - (ymax * scale_y)
+                        
+                        # 🔧 Смещение текста вниз для вертикальных страниц после flip
+                        y_offset = page.rect.height * 0.43  # Смещение на 40% высоты вниз
+                        py1 += y_offset
+                        py2 += y_offset
+                        
+                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            py1 -= top_shift_px
+                            py2 -= top_shift_px
+                    elif rotation_angle == 270:
+                        # Для страниц с поворотом 270° НЕ применяем flip операции
+                        px1 = xmin * scale_x
+                        px2 = xmax * scale_x
+                        py1 = ymin * scale_y
+                        py2 = ymax * scale_y
+                        
+                        # 🔧 Смещение текста вверх для 270° на уровне страницы
+                        y_offset_page = page.rect.height * -0.48  # Смещение на -52% высоты вверх
+                        py1 += y_offset_page
+                        py2 += y_offset_page
+                        
+                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            py1 -= top_shift_px
+                            py2 -= top_shift_px
                     elif rotation_angle == 180:
-                        log_message(f"  Auto-applying flip operations for 180° rotated page")
+                        # Для страниц с поворотом 180° принудительно применяем flip операции
+                        px1 = page.rect.width - (xmin * scale_x)
+                        px2 = page.rect.width - (xmax * scale_x)
+                        py1 = page.rect.height - (ymin * scale_y)
+                        py2 = page.rect.height - (ymax * scale_y)
+                        
+                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            # Для листов с rotation 180° добавляем поправку +13 к top_shift_px
+                            adjusted_shift = top_shift_px + 23
+                            py1 -= adjusted_shift
+                            py2 -= adjusted_shift
+                    else:
+                        # Для обычных страниц применяем flip операции согласно настройкам GUI
+                        if flip_x:
+                            px1 = page.rect.width - (xmin * scale_x)
+                            px2 = page.rect.width - (xmax * scale_x)
+                        else:
+                            px1 = xmin * scale_x
+                            px2 = xmax * scale_x
+                        if flip_y:
+                            py1 = page.rect.height - (ymin * scale_y)
+                            py2 = page.rect.height - (ymax * scale_y)
+                        else:
+                            py1 = ymin * scale_y
+                            py2 = ymax * scale_y
+                    
+                    # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                    page_middle = page.rect.height / 2
+                    if min(py1, py2) < page_middle:
+                        py1 -= top_shift_px
+                        py2 -= top_shift_px
+                    
+                    left = min(px1, px2)
+                    right = max(px1, px2)
+                    top = min(py1, py2)
+                    bottom = max(py1, py2)
+                    rect = fitz.Rect(left, top, right, bottom)
+                    new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), render_mode=3)
+                except Exception:
+                    continue
+        else:
+            # Видимый текст поверх изображения
+            for line in ocr_results:
+                try:
+                    if not (isinstance(line, (list, tuple)) and len(line) >= 2):
+                        continue
+                    bbox = line[0]
+                    text_info = line[1]
+                    text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
+                    xs = [float(pt[0]) for pt in bbox]
+                    ys = [float(pt[1]) for pt in bbox]
+                    xmin, xmax = min(xs), max(xs)
+                    ymin, ymax = min(ys), max(ys)
+                    
+                    # 🔧 Коррекция координат с учетом поворота изображения
+                    if rotation_angle == 90:
+                        # При повороте на 90 градусов по часовой стрелке:
+                        # координаты текста даны в повернутой системе координат
+                        # нужно преобразовать их обратно к исходной системе
+                        orig_width, orig_height = img.shape[1], img.shape[0]
+                        # Поворачиваем координаты обратно на -90 градусов
+                        # При повороте на -90 градусов: (x,y) -> (y, width-x)
+                        new_xmin = ymin
+                        new_xmax = ymax
+                        new_ymin = orig_width - xmax
+                        new_ymax = orig_width - xmin
+                        xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                        
+                        # 🔧 Смещение текста вниз для вертикальных страниц
+                        y_offset = orig_height * 0.3  # Смещение на 30% высоты вниз
+                        ymin += y_offset
+                        ymax += y_offset
                     elif rotation_angle == 270:
-                        log_message(f"  Auto-applying flip operations for 270° rotated page")
-        log_message(f"  OCR blocks: {len(ocr_results)}")
-
-        if dump_debug_first_page and i == 0:
-            try:
-                input_basename = os.path.splitext(os.path.basename(input_path))[0]
-                dbg_path = os.path.join(os.path.dirname(input_path), f'{input_basename}_page1_ocr_normalized.json')
-                with open(dbg_path, 'w', encoding='utf-8') as fh:
-                    json.dump(ocr_results, fh, ensure_ascii=False, indent=2)
-                print(f"  Wrote debug normalized OCR: {dbg_path}")
-            except Exception:
-                pass
-        total_blocks += len(ocr_results)
-
-        # Создаем новую страницу
-        new_page = new_doc.new_page(width=page.rect.width, height=page.rect.height)
-
-        # Apply different algorithms depending on page type
-        if page_type == "vector_based":
-            log_message(f"  🔧 Using precise positioning for vector graphics")
-            # Сложная логика с pikepdf для точного позиционирования (строки 124-231 из оригинала)
-            import pikepdf
-            import tempfile
-
-            # Получаем оригинальные размеры через fitz (points)
-            _tmp_doc = fitz.open(input_path)
-            _src_page_for_size = _tmp_doc[i]
-            src_w, src_h = _src_page_for_size.rect.width, _src_page_for_size.rect.height
-            _tmp_doc.close()
-
-            # Подбираем запас (margin) — минимум 72pt (1"), плюс небольшой процент размера страницы
-            margin_x = max(300, src_w * 0.12)   # запас по горизонтали (влево и вправо)
-            margin_y = max(300, src_h * 0.12)   # запас по вертикали (вверх и вниз)
-
-            # Создаём временный файл и копируем в него страницу, меняя MediaBox
-            tmp_no_crop = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
-            tmp_no_crop_path = tmp_no_crop.name
-            tmp_no_crop.close()
-
-            with pikepdf.open(input_path) as src_pdf:
-                new_pdf = pikepdf.Pdf.new()
-                new_pdf.pages.append(src_pdf.pages[i])
-                pg = new_pdf.pages[0].obj
-
-                # Удаляем обрезающие box'ы, если есть
-                for key in ("/CropBox", "/TrimBox", "/BleedBox", "/ArtBox"):
-                    if key in pg:
-                        try:
-                            del pg[key]
-                        except Exception:
-                            pass
-
-                # Устанавливаем расширенную MediaBox: двустороннее расширение
-                # MediaBox = [llx lly urx ury]
-                new_llx = -margin_x
-                new_lly = -margin_y
-                new_urx = src_w + margin_x
-                new_ury = src_h + margin_y
-                pg["/MediaBox"] = pikepdf.Array([new_llx, new_lly, new_urx, new_ury])
-
-                new_pdf.save(tmp_no_crop_path)
-
-            # Открываем модифицированный PDF через fitz и уменьшаем страницу
-            src_full = fitz.open(tmp_no_crop_path)
-            full_page = src_full[0]
-            full_w, full_h = full_page.rect.width, full_page.rect.height
-
-            # Настройки позиционирования для разных углов поворота
-            # 90 уже настроен корректно у вас — сохраняем его поведение
-            if rotation_angle == 90:
-                page_scale = 1.22
-                image_offset_x = -22
-                image_offset_y = -275
-                rotate_param = rotation_angle  # сохраняем прежний поворот
-            elif rotation_angle == 0: # Настроен для 0, проверен
-                # блок для 0°
-                page_scale = 1
-                image_offset_x = 0
-                image_offset_y = 0
-                rotate_param = 0
-            elif rotation_angle == 180:
-                # блок для 180°
-                page_scale = 1
-                image_offset_x = 0
-                image_offset_y = 0
-                rotate_param = 0
-            elif rotation_angle == 270: # Настроен для 270, проверен
-                # блок для 270°
-                page_scale = 1.22
-                image_offset_x = -22
-                image_offset_y = -275
-                rotate_param = (-rotation_angle)
-            else:
-                # дефолтные параметры для других углов
-                page_scale = 1.22
-                image_offset_x = -22
-                image_offset_y = -275
-                rotate_param = (rotation_angle)
-
-            scaled_w = full_w * page_scale
-            scaled_h = full_h * page_scale
-
-            # Создаём временный документ, куда отрисуем всю расширенную страницу в уменьшенном виде
-            scaled_doc = fitz.open()
-            scaled_page = scaled_doc.new_page(width=scaled_w, height=scaled_h)
-            target_rect = fitz.Rect(0, 0, scaled_w, scaled_h)
-
-            # Рисуем ВСЮ страницу (clip=None) — теперь MediaBox расширена, поэтому ничего не обрежется
-            scaled_page.show_pdf_page(target_rect, src_full, 0, clip=None)
-
-            # Вставляем в итоговый документ (как в вашем основном потоке)
-            # new_page уже создан выше
-
-            adjusted_rect = fitz.Rect(
-                (page.rect.width - scaled_w) / 2 + image_offset_x,
-                (page.rect.height - scaled_h) / 2 + image_offset_y,
-                (page.rect.width - scaled_w) / 2 + image_offset_x + scaled_w,
-                (page.rect.height - scaled_h) / 2 + image_offset_y + scaled_h
-            )
-
-            # Сохраняем прежнюю логику поворота при вставке
-            new_page.show_pdf_page(adjusted_rect, scaled_doc, 0, rotate=rotate_param)
-
-            # Закрываем временные документы и удаляем временный файл
-            src_full.close()
-            scaled_doc.close()
-            try:
-                os.remove(tmp_no_crop_path)
-            except Exception:
-                pass
-            # ---- END ----
-            
-            # === Добавляем OCR текст для vector_based ===
-            if hide_text:
-                # Сначала вставляем скрытый текст ПОД изображением
+                        # При повороте на 270 градусов (против часовой стрелки):
+                        # координаты текста даны в повернутой системе координат
+                        # нужно преобразовать их обратно к исходной системе
+                        orig_width, orig_height = img.shape[1], img.shape[0]
+                        # Поворачиваем координаты обратно на -270 градусов (по часовой стрелке на 90)
+                        # При повороте на 90 градусов: (x,y) -> (y, width-x)
+                        new_xmin = ymin
+                        new_xmax = ymax
+                        new_ymin = orig_width - xmax
+                        new_ymax = orig_width - xmin
+                        xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                    
+                    scale_x = page.rect.width / img.shape[1]
+                    scale_y = page.rect.height / img.shape[0]
+                    
+                    # 🔧 Для страниц с вертикальными блоками автоматически применяем flip операции
+                    if rotation_angle == 90:
+                        # Для вертикальных страниц (90°) применяем flip операции
+                        px1 = page.rect.width - (xmin * scale_x)
+                        px2 = page.rect.width - (xmax * scale_x)
+                        py1 = page.rect.height - (ymin * scale_y)
+                        py2 = page.rect.height - (ymax * scale_y)
+                        
+                        # 🔧 Смещение текста вниз для вертикальных страниц после flip
+                        y_offset = page.rect.height * 0.54  # Смещение на 50% высоты вниз
+                        py1 += y_offset
+                        py2 += y_offset
+                        
+                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            py1 -= top_shift_px
+                            py2 -= top_shift_px
+                        
+                        # 🔧 Дополнительное смещение текста вниз для вертикальных страниц
+                        y_offset = page.rect.height * 0.2  # Смещение на 20% высоты вниз
+                        py1 += y_offset
+                        py2 += y_offset
+                    elif rotation_angle == 270:
+                        # Для страниц с поворотом 270° НЕ применяем flip операции
+                        px1 = xmin * scale_x
+                        px2 = xmax * scale_x
+                        py1 = ymin * scale_y
+                        py2 = ymax * scale_y
+                        
+                        # 🔧 Смещение текста вверх для 270° на уровне страницы
+                        y_offset_page = page.rect.height * -0.48  # Смещение на -52% высоты вверх
+                        py1 += y_offset_page
+                        py2 += y_offset_page
+                        
+                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            py1 -= top_shift_px
+                            py2 -= top_shift_px
+                    elif rotation_angle == 180:
+                        # Для страниц с поворотом 180° принудительно применяем flip операции
+                        px1 = page.rect.width - (xmin * scale_x)
+                        px2 = page.rect.width - (xmax * scale_x)
+                        py1 = page.rect.height - (ymin * scale_y)
+                        py2 = page.rect.height - (ymax * scale_y)
+                        
+                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            # Для листов с rotation 180° добавляем поправку +13 к top_shift_px
+                            adjusted_shift = top_shift_px + 23
+                            py1 -= adjusted_shift
+                            py2 -= adjusted_shift
+                    else:
+                        # Для обычных страниц применяем flip операции согласно настройкам GUI
+                        if flip_x:
+                            px1 = page.rect.width - (xmin * scale_x)
+                            px2 = page.rect.width - (xmax * scale_x)
+                        else:
+                            px1 = xmin * scale_x
+                            px2 = xmax * scale_x
+                        if flip_y:
+                            py1 = page.rect.height - (ymin * scale_y)
+                            py2 = page.rect.height - (ymax * scale_y)
+                        else:
+                            py1 = ymin * scale_y
+                            py2 = ymax * scale_y
+                    
+                    # 🔧 Применяем top_shift_px только для блоков выше середины листа
+                    page_middle = page.rect.height / 2
+                    if min(py1, py2) < page_middle:
+                        py1 -= top_shift_px
+                        py2 -= top_shift_px
+                    
+                    left = min(px1, px2)
+                    right = max(px1, px2)
+                    top = min(py1, py2)
+                    bottom = max(py1, py2)
+                    rect = fitz.Rect(left, top, right, bottom)
+                    new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), overlay=True)
+                except Exception as ex:
+                    print(f"  Error inserting text: {ex}")
+                    continue
+    else:
+        if overlay_page is not None:
+            log_message("  🔧 Original page kept, adding the text layer only")
+        else:
+            log_message(f"  🔧 Applying full processing logic for type: {page_type}")
+        # Full logic with flips, shifts and rotation
+        if hide_text:
+            page_is_landscape = page.rect.width >= page.rect.height
+            if page_is_landscape:
+                # Сначала вставляем скрытый текст
                 for line in ocr_results:
                     try:
                         if not (isinstance(line, (list, tuple)) and len(line) >= 2):
@@ -324,92 +728,61 @@ def process_pdf(input_path: str,
                         ys = [float(pt[1]) for pt in bbox]
                         xmin, xmax = min(xs), max(xs)
                         ymin, ymax = min(ys), max(ys)
-                        
                         # 🔧 Коррекция координат с учетом поворота изображения
                         if rotation_angle in [90, 270]:
-                            # При повороте на 90 градусов по часовой стрелке:
-                            # координаты текста даны в повернутой системе координат
-                            # нужно преобразовать их обратно к исходной системе
                             orig_width, orig_height = img.shape[1], img.shape[0]
-                            # Поворачиваем координаты обратно на -90 градусов
-                            # При повороте на -90 градусов: (x,y) -> (y, width-x)
                             new_xmin = ymin
                             new_xmax = ymax
                             new_ymin = orig_width - xmax
                             new_ymax = orig_width - xmin
                             xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
                         elif rotation_angle == 270:
-                            # При повороте на 270 градусов (против часовой стрелки):
-                            # координаты текста даны в повернутой системе координат
-                            # нужно преобразовать их обратно к исходной системе
                             orig_width, orig_height = img.shape[1], img.shape[0]
-                            # Поворачиваем координаты обратно на -270 градусов (по часовой стрелке на 90)
-                            # При повороте на 90 градусов: (x,y) -> (y, width-x)
                             new_xmin = ymin
                             new_xmax = ymax
                             new_ymin = orig_width - xmax
                             new_ymax = orig_width - xmin
                             xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                            
-                            # 🔧 Смещение текста вверх для вертикальных страниц
-                            y_offset = orig_height *-0.48  # Смещение на -52% высоты вверх
+                            y_offset = orig_height *-0.48
                             ymin += y_offset
                             ymax += y_offset
-                        
                         scale_x = page.rect.width / img.shape[1]
                         scale_y = page.rect.height / img.shape[0]
-                        
-                        # 🔧 Для страниц с вертикальными блоками автоматически применяем flip операции
                         if rotation_angle == 90:
-                            # Для вертикальных страниц (90°) применяем flip операции
                             px1 = page.rect.width - (xmin * scale_x)
                             px2 = page.rect.width - (xmax * scale_x)
                             py1 = page.rect.height - (ymin * scale_y)
                             py2 = page.rect.height - (ymax * scale_y)
-                            
-                            # 🔧 Смещение текста вниз для вертикальных страниц после flip
-                            y_offset = page.rect.height * 0.43  # Смещение на 40% высоты вниз
+                            y_offset = page.rect.height * 0.43
                             py1 += y_offset
                             py2 += y_offset
-                            
-                            # 🔧 Применяем top_shift_px только для блоков выше середины листа
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
                         elif rotation_angle == 270:
-                            # Для страниц с поворотом 270° НЕ применяем flip операции
                             px1 = xmin * scale_x
                             px2 = xmax * scale_x
                             py1 = ymin * scale_y
                             py2 = ymax * scale_y
-                            
-                            # 🔧 Смещение текста вверх для 270° на уровне страницы
-                            y_offset_page = page.rect.height * -0.48  # Смещение на -52% высоты вверх
+                            y_offset_page = page.rect.height * -0.48
                             py1 += y_offset_page
                             py2 += y_offset_page
-                            
-                            # 🔧 Применяем top_shift_px только для блоков выше середины листа
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
                         elif rotation_angle == 180:
-                            # Для страниц с поворотом 180° принудительно применяем flip операции
                             px1 = page.rect.width - (xmin * scale_x)
                             px2 = page.rect.width - (xmax * scale_x)
                             py1 = page.rect.height - (ymin * scale_y)
                             py2 = page.rect.height - (ymax * scale_y)
-                            
-                            # 🔧 Применяем top_shift_px только для блоков выше середины листа
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
-                                # Для листов с rotation 180° добавляем поправку +13 к top_shift_px
                                 adjusted_shift = top_shift_px + 23
                                 py1 -= adjusted_shift
                                 py2 -= adjusted_shift
                         else:
-                            # Для обычных страниц применяем flip операции согласно настройкам GUI
                             if flip_x:
                                 px1 = page.rect.width - (xmin * scale_x)
                                 px2 = page.rect.width - (xmax * scale_x)
@@ -422,13 +795,10 @@ def process_pdf(input_path: str,
                             else:
                                 py1 = ymin * scale_y
                                 py2 = ymax * scale_y
-                        
-                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
                         page_middle = page.rect.height / 2
                         if min(py1, py2) < page_middle:
                             py1 -= top_shift_px
                             py2 -= top_shift_px
-                        
                         left = min(px1, px2)
                         right = max(px1, px2)
                         top = min(py1, py2)
@@ -438,7 +808,7 @@ def process_pdf(input_path: str,
                     except Exception:
                         continue
             else:
-                # Видимый текст поверх изображения
+                # Портретная ориентация — используем те же правила позиционирования (копия логики)
                 for line in ocr_results:
                     try:
                         if not (isinstance(line, (list, tuple)) and len(line) >= 2):
@@ -450,97 +820,60 @@ def process_pdf(input_path: str,
                         ys = [float(pt[1]) for pt in bbox]
                         xmin, xmax = min(xs), max(xs)
                         ymin, ymax = min(ys), max(ys)
-                        
-                        # 🔧 Коррекция координат с учетом поворота изображения
-                        if rotation_angle == 90:
-                            # При повороте на 90 градусов по часовой стрелке:
-                            # координаты текста даны в повернутой системе координат
-                            # нужно преобразовать их обратно к исходной системе
+                        if rotation_angle in [90, 270]:
                             orig_width, orig_height = img.shape[1], img.shape[0]
-                            # Поворачиваем координаты обратно на -90 градусов
-                            # При повороте на -90 градусов: (x,y) -> (y, width-x)
                             new_xmin = ymin
                             new_xmax = ymax
                             new_ymin = orig_width - xmax
                             new_ymax = orig_width - xmin
                             xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                            
-                            # 🔧 Смещение текста вниз для вертикальных страниц
-                            y_offset = orig_height * 0.3  # Смещение на 30% высоты вниз
-                            ymin += y_offset
-                            ymax += y_offset
                         elif rotation_angle == 270:
-                            # При повороте на 270 градусов (против часовой стрелки):
-                            # координаты текста даны в повернутой системе координат
-                            # нужно преобразовать их обратно к исходной системе
                             orig_width, orig_height = img.shape[1], img.shape[0]
-                            # Поворачиваем координаты обратно на -270 градусов (по часовой стрелке на 90)
-                            # При повороте на 90 градусов: (x,y) -> (y, width-x)
                             new_xmin = ymin
                             new_xmax = ymax
                             new_ymin = orig_width - xmax
                             new_ymax = orig_width - xmin
                             xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                        
+                            y_offset = orig_height *-0.48
+                            ymin += y_offset
+                            ymax += y_offset
                         scale_x = page.rect.width / img.shape[1]
                         scale_y = page.rect.height / img.shape[0]
-                        
-                        # 🔧 Для страниц с вертикальными блоками автоматически применяем flip операции
                         if rotation_angle == 90:
-                            # Для вертикальных страниц (90°) применяем flip операции
                             px1 = page.rect.width - (xmin * scale_x)
                             px2 = page.rect.width - (xmax * scale_x)
                             py1 = page.rect.height - (ymin * scale_y)
                             py2 = page.rect.height - (ymax * scale_y)
-                            
-                            # 🔧 Смещение текста вниз для вертикальных страниц после flip
-                            y_offset = page.rect.height * 0.54  # Смещение на 50% высоты вниз
+                            y_offset = page.rect.height * -0.31
                             py1 += y_offset
                             py2 += y_offset
-                            
-                            # 🔧 Применяем top_shift_px только для блоков выше середины листа
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
-                            
-                            # 🔧 Дополнительное смещение текста вниз для вертикальных страниц
-                            y_offset = page.rect.height * 0.2  # Смещение на 20% высоты вниз
-                            py1 += y_offset
-                            py2 += y_offset
                         elif rotation_angle == 270:
-                            # Для страниц с поворотом 270° НЕ применяем flip операции
                             px1 = xmin * scale_x
                             px2 = xmax * scale_x
                             py1 = ymin * scale_y
                             py2 = ymax * scale_y
-                            
-                            # 🔧 Смещение текста вверх для 270° на уровне страницы
-                            y_offset_page = page.rect.height * -0.48  # Смещение на -52% высоты вверх
+                            y_offset_page = page.rect.height * 0.28
                             py1 += y_offset_page
                             py2 += y_offset_page
-                            
-                            # 🔧 Применяем top_shift_px только для блоков выше середины листа
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
                         elif rotation_angle == 180:
-                            # Для страниц с поворотом 180° принудительно применяем flip операции
                             px1 = page.rect.width - (xmin * scale_x)
                             px2 = page.rect.width - (xmax * scale_x)
                             py1 = page.rect.height - (ymin * scale_y)
                             py2 = page.rect.height - (ymax * scale_y)
-                            
-                            # 🔧 Применяем top_shift_px только для блоков выше середины листа
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
-                                # Для листов с rotation 180° добавляем поправку +13 к top_shift_px
                                 adjusted_shift = top_shift_px + 23
                                 py1 -= adjusted_shift
                                 py2 -= adjusted_shift
                         else:
-                            # Для обычных страниц применяем flip операции согласно настройкам GUI
                             if flip_x:
                                 px1 = page.rect.width - (xmin * scale_x)
                                 px2 = page.rect.width - (xmax * scale_x)
@@ -553,447 +886,868 @@ def process_pdf(input_path: str,
                             else:
                                 py1 = ymin * scale_y
                                 py2 = ymax * scale_y
-                        
-                        # 🔧 Применяем top_shift_px только для блоков выше середины листа
                         page_middle = page.rect.height / 2
                         if min(py1, py2) < page_middle:
                             py1 -= top_shift_px
                             py2 -= top_shift_px
-                        
                         left = min(px1, px2)
                         right = max(px1, px2)
                         top = min(py1, py2)
                         bottom = max(py1, py2)
                         rect = fitz.Rect(left, top, right, bottom)
-                        new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), overlay=True)
-                    except Exception as ex:
-                        print(f"  Error inserting text: {ex}")
+                        new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), render_mode=3)
+                    except Exception:
                         continue
+            # Затем вставляем изображение поверх текста
+            if overlay_page is None:
+                new_page.insert_image(page.rect, stream=img_data)
         else:
-            log_message(f"  🔧 Applying full processing logic for type: {page_type}")
-            # Full logic with flips, shifts and rotation
-            if hide_text:
-                page_is_landscape = page.rect.width >= page.rect.height
-                if page_is_landscape:
-                    # Сначала вставляем скрытый текст
-                    for line in ocr_results:
-                        try:
-                            if not (isinstance(line, (list, tuple)) and len(line) >= 2):
-                                continue
-                            bbox = line[0]
-                            text_info = line[1]
-                            text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
-                            xs = [float(pt[0]) for pt in bbox]
-                            ys = [float(pt[1]) for pt in bbox]
-                            xmin, xmax = min(xs), max(xs)
-                            ymin, ymax = min(ys), max(ys)
-                            # 🔧 Коррекция координат с учетом поворота изображения
-                            if rotation_angle in [90, 270]:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                            elif rotation_angle == 270:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                                y_offset = orig_height *-0.48
-                                ymin += y_offset
-                                ymax += y_offset
-                            scale_x = page.rect.width / img.shape[1]
-                            scale_y = page.rect.height / img.shape[0]
-                            if rotation_angle == 90:
-                                px1 = page.rect.width - (xmin * scale_x)
-                                px2 = page.rect.width - (xmax * scale_x)
-                                py1 = page.rect.height - (ymin * scale_y)
-                                py2 = page.rect.height - (ymax * scale_y)
-                                y_offset = page.rect.height * 0.43
-                                py1 += y_offset
-                                py2 += y_offset
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                            elif rotation_angle == 270:
-                                px1 = xmin * scale_x
-                                px2 = xmax * scale_x
-                                py1 = ymin * scale_y
-                                py2 = ymax * scale_y
-                                y_offset_page = page.rect.height * -0.48
-                                py1 += y_offset_page
-                                py2 += y_offset_page
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                            elif rotation_angle == 180:
-                                px1 = page.rect.width - (xmin * scale_x)
-                                px2 = page.rect.width - (xmax * scale_x)
-                                py1 = page.rect.height - (ymin * scale_y)
-                                py2 = page.rect.height - (ymax * scale_y)
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    adjusted_shift = top_shift_px + 23
-                                    py1 -= adjusted_shift
-                                    py2 -= adjusted_shift
-                            else:
-                                if flip_x:
-                                    px1 = page.rect.width - (xmin * scale_x)
-                                    px2 = page.rect.width - (xmax * scale_x)
-                                else:
-                                    px1 = xmin * scale_x
-                                    px2 = xmax * scale_x
-                                if flip_y:
-                                    py1 = page.rect.height - (ymin * scale_y)
-                                    py2 = page.rect.height - (ymax * scale_y)
-                                else:
-                                    py1 = ymin * scale_y
-                                    py2 = ymax * scale_y
+            page_is_landscape = page.rect.width >= page.rect.height
+            # Сначала вставляем изображение
+            if overlay_page is None:
+                new_page.insert_image(page.rect, stream=img_data)
+            # Затем добавляем видимый текст поверх изображения
+            if page_is_landscape:
+                for line in ocr_results:
+                    try:
+                        if not (isinstance(line, (list, tuple)) and len(line) >= 2):
+                            continue
+                        bbox = line[0]
+                        text_info = line[1]
+                        text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
+                        xs = [float(pt[0]) for pt in bbox]
+                        ys = [float(pt[1]) for pt in bbox]
+                        xmin, xmax = min(xs), max(xs)
+                        ymin, ymax = min(ys), max(ys)
+                        # 🔧 Коррекция координат с учетом поворота изображения
+                        if rotation_angle == 90:
+                            orig_width, orig_height = img.shape[1], img.shape[0]
+                            new_xmin = ymin
+                            new_xmax = ymax
+                            new_ymin = orig_width - xmax
+                            new_ymax = orig_width - xmin
+                            xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                            y_offset = orig_height * 0.3
+                            ymin += y_offset
+                            ymax += y_offset
+                        elif rotation_angle == 270:
+                            orig_width, orig_height = img.shape[1], img.shape[0]
+                            new_xmin = ymin
+                            new_xmax = ymax
+                            new_ymin = orig_width - xmax
+                            new_ymax = orig_width - xmin
+                            xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                        scale_x = page.rect.width / img.shape[1]
+                        scale_y = page.rect.height / img.shape[0]
+                        if rotation_angle == 90:
+                            px1 = page.rect.width - (xmin * scale_x)
+                            px2 = page.rect.width - (xmax * scale_x)
+                            py1 = page.rect.height - (ymin * scale_y)
+                            py2 = page.rect.height - (ymax * scale_y)
+                            y_offset = page.rect.height * 0.54
+                            py1 += y_offset
+                            py2 += y_offset
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
-                            left = min(px1, px2)
-                            right = max(px1, px2)
-                            top = min(py1, py2)
-                            bottom = max(py1, py2)
-                            rect = fitz.Rect(left, top, right, bottom)
-                            new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), render_mode=3)
-                        except Exception:
-                            continue
-                else:
-                    # Портретная ориентация — используем те же правила позиционирования (копия логики)
-                    for line in ocr_results:
-                        try:
-                            if not (isinstance(line, (list, tuple)) and len(line) >= 2):
-                                continue
-                            bbox = line[0]
-                            text_info = line[1]
-                            text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
-                            xs = [float(pt[0]) for pt in bbox]
-                            ys = [float(pt[1]) for pt in bbox]
-                            xmin, xmax = min(xs), max(xs)
-                            ymin, ymax = min(ys), max(ys)
-                            if rotation_angle in [90, 270]:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                            elif rotation_angle == 270:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                                y_offset = orig_height *-0.48
-                                ymin += y_offset
-                                ymax += y_offset
-                            scale_x = page.rect.width / img.shape[1]
-                            scale_y = page.rect.height / img.shape[0]
-                            if rotation_angle == 90:
-                                px1 = page.rect.width - (xmin * scale_x)
-                                px2 = page.rect.width - (xmax * scale_x)
-                                py1 = page.rect.height - (ymin * scale_y)
-                                py2 = page.rect.height - (ymax * scale_y)
-                                y_offset = page.rect.height * -0.31
-                                py1 += y_offset
-                                py2 += y_offset
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                            elif rotation_angle == 270:
-                                px1 = xmin * scale_x
-                                px2 = xmax * scale_x
-                                py1 = ymin * scale_y
-                                py2 = ymax * scale_y
-                                y_offset_page = page.rect.height * 0.28
-                                py1 += y_offset_page
-                                py2 += y_offset_page
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                            elif rotation_angle == 180:
-                                px1 = page.rect.width - (xmin * scale_x)
-                                px2 = page.rect.width - (xmax * scale_x)
-                                py1 = page.rect.height - (ymin * scale_y)
-                                py2 = page.rect.height - (ymax * scale_y)
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    adjusted_shift = top_shift_px + 23
-                                    py1 -= adjusted_shift
-                                    py2 -= adjusted_shift
-                            else:
-                                if flip_x:
-                                    px1 = page.rect.width - (xmin * scale_x)
-                                    px2 = page.rect.width - (xmax * scale_x)
-                                else:
-                                    px1 = xmin * scale_x
-                                    px2 = xmax * scale_x
-                                if flip_y:
-                                    py1 = page.rect.height - (ymin * scale_y)
-                                    py2 = page.rect.height - (ymax * scale_y)
-                                else:
-                                    py1 = ymin * scale_y
-                                    py2 = ymax * scale_y
+                            y_offset = page.rect.height * 0.2
+                            py1 += y_offset
+                            py2 += y_offset
+                        elif rotation_angle == 270:
+                            px1 = xmin * scale_x
+                            px2 = xmax * scale_x
+                            py1 = ymin * scale_y
+                            py2 = ymax * scale_y
+                            y_offset_page = page.rect.height * -0.48
+                            py1 += y_offset_page
+                            py2 += y_offset_page
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
-                            left = min(px1, px2)
-                            right = max(px1, px2)
-                            top = min(py1, py2)
-                            bottom = max(py1, py2)
-                            rect = fitz.Rect(left, top, right, bottom)
-                            new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), render_mode=3)
-                        except Exception:
-                            continue
-                # Затем вставляем изображение поверх текста
-                new_page.insert_image(page.rect, stream=img_data)
-            else:
-                page_is_landscape = page.rect.width >= page.rect.height
-                # Сначала вставляем изображение
-                new_page.insert_image(page.rect, stream=img_data)
-                # Затем добавляем видимый текст поверх изображения
-                if page_is_landscape:
-                    for line in ocr_results:
-                        try:
-                            if not (isinstance(line, (list, tuple)) and len(line) >= 2):
-                                continue
-                            bbox = line[0]
-                            text_info = line[1]
-                            text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
-                            xs = [float(pt[0]) for pt in bbox]
-                            ys = [float(pt[1]) for pt in bbox]
-                            xmin, xmax = min(xs), max(xs)
-                            ymin, ymax = min(ys), max(ys)
-                            # 🔧 Коррекция координат с учетом поворота изображения
-                            if rotation_angle == 90:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                                y_offset = orig_height * 0.3
-                                ymin += y_offset
-                                ymax += y_offset
-                            elif rotation_angle == 270:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                            scale_x = page.rect.width / img.shape[1]
-                            scale_y = page.rect.height / img.shape[0]
-                            if rotation_angle == 90:
+                        elif rotation_angle == 180:
+                            px1 = page.rect.width - (xmin * scale_x)
+                            px2 = page.rect.width - (xmax * scale_x)
+                            py1 = page.rect.height - (ymin * scale_y)
+                            py2 = page.rect.height - (ymax * scale_y)
+                            page_middle = page.rect.height / 2
+                            if min(py1, py2) < page_middle:
+                                adjusted_shift = top_shift_px + 23
+                                py1 -= adjusted_shift
+                                py2 -= adjusted_shift
+                        else:
+                            if flip_x:
                                 px1 = page.rect.width - (xmin * scale_x)
                                 px2 = page.rect.width - (xmax * scale_x)
-                                py1 = page.rect.height - (ymin * scale_y)
-                                py2 = page.rect.height - (ymax * scale_y)
-                                y_offset = page.rect.height * 0.54
-                                py1 += y_offset
-                                py2 += y_offset
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                                y_offset = page.rect.height * 0.2
-                                py1 += y_offset
-                                py2 += y_offset
-                            elif rotation_angle == 270:
+                            else:
                                 px1 = xmin * scale_x
                                 px2 = xmax * scale_x
-                                py1 = ymin * scale_y
-                                py2 = ymax * scale_y
-                                y_offset_page = page.rect.height * -0.48
-                                py1 += y_offset_page
-                                py2 += y_offset_page
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                            elif rotation_angle == 180:
-                                px1 = page.rect.width - (xmin * scale_x)
-                                px2 = page.rect.width - (xmax * scale_x)
+                            if flip_y:
                                 py1 = page.rect.height - (ymin * scale_y)
                                 py2 = page.rect.height - (ymax * scale_y)
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    adjusted_shift = top_shift_px + 23
-                                    py1 -= adjusted_shift
-                                    py2 -= adjusted_shift
                             else:
-                                if flip_x:
-                                    px1 = page.rect.width - (xmin * scale_x)
-                                    px2 = page.rect.width - (xmax * scale_x)
-                                else:
-                                    px1 = xmin * scale_x
-                                    px2 = xmax * scale_x
-                                if flip_y:
-                                    py1 = page.rect.height - (ymin * scale_y)
-                                    py2 = page.rect.height - (ymax * scale_y)
-                                else:
-                                    py1 = ymin * scale_y
-                                    py2 = ymax * scale_y
+                                py1 = ymin * scale_y
+                                py2 = ymax * scale_y
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            py1 -= top_shift_px
+                            py2 -= top_shift_px
+                        left = min(px1, px2)
+                        right = max(px1, px2)
+                        top = min(py1, py2)
+                        bottom = max(py1, py2)
+                        rect = fitz.Rect(left, top, right, bottom)
+                        new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), overlay=True)
+                    except Exception as ex:
+                        print(f"  Error inserting text: {ex}")
+                        continue
+            else:
+                # Портретная ориентация — используем те же правила позиционирования (копия логики)
+                for line in ocr_results:
+                    try:
+                        if not (isinstance(line, (list, tuple)) and len(line) >= 2):
+                            continue
+                        bbox = line[0]
+                        text_info = line[1]
+                        text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
+                        xs = [float(pt[0]) for pt in bbox]
+                        ys = [float(pt[1]) for pt in bbox]
+                        xmin, xmax = min(xs), max(xs)
+                        ymin, ymax = min(ys), max(ys)
+                        if rotation_angle == 90:
+                            orig_width, orig_height = img.shape[1], img.shape[0]
+                            new_xmin = ymin
+                            new_xmax = ymax
+                            new_ymin = orig_width - xmax
+                            new_ymax = orig_width - xmin
+                            xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                            y_offset = orig_height * 0.3
+                            ymin += y_offset
+                            ymax += y_offset
+                        elif rotation_angle == 270:
+                            orig_width, orig_height = img.shape[1], img.shape[0]
+                            new_xmin = ymin
+                            new_xmax = ymax
+                            new_ymin = orig_width - xmax
+                            new_ymax = orig_width - xmin
+                            xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
+                        scale_x = page.rect.width / img.shape[1]
+                        scale_y = page.rect.height / img.shape[0]
+                        if rotation_angle == 90:
+                            px1 = page.rect.width - (xmin * scale_x)
+                            px2 = page.rect.width - (xmax * scale_x)
+                            py1 = page.rect.height - (ymin * scale_y)
+                            py2 = page.rect.height - (ymax * scale_y)
+                            y_offset = page.rect.height * -0.21
+                            py1 += y_offset
+                            py2 += y_offset
                             page_middle = page.rect.height / 2
                             if min(py1, py2) < page_middle:
                                 py1 -= top_shift_px
                                 py2 -= top_shift_px
-                            left = min(px1, px2)
-                            right = max(px1, px2)
-                            top = min(py1, py2)
-                            bottom = max(py1, py2)
-                            rect = fitz.Rect(left, top, right, bottom)
-                            new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), overlay=True)
-                        except Exception as ex:
-                            print(f"  Error inserting text: {ex}")
-                            continue
-                else:
-                    # Портретная ориентация — используем те же правила позиционирования (копия логики)
-                    for line in ocr_results:
-                        try:
-                            if not (isinstance(line, (list, tuple)) and len(line) >= 2):
-                                continue
-                            bbox = line[0]
-                            text_info = line[1]
-                            text = text_info[0] if isinstance(text_info, (list, tuple)) and len(text_info) >= 1 else str(text_info)
-                            xs = [float(pt[0]) for pt in bbox]
-                            ys = [float(pt[1]) for pt in bbox]
-                            xmin, xmax = min(xs), max(xs)
-                            ymin, ymax = min(ys), max(ys)
-                            if rotation_angle == 90:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                                y_offset = orig_height * 0.3
-                                ymin += y_offset
-                                ymax += y_offset
-                            elif rotation_angle == 270:
-                                orig_width, orig_height = img.shape[1], img.shape[0]
-                                new_xmin = ymin
-                                new_xmax = ymax
-                                new_ymin = orig_width - xmax
-                                new_ymax = orig_width - xmin
-                                xmin, xmax, ymin, ymax = new_xmin, new_xmax, new_ymin, new_ymax
-                            scale_x = page.rect.width / img.shape[1]
-                            scale_y = page.rect.height / img.shape[0]
-                            if rotation_angle == 90:
+                            y_offset = page.rect.height * 0.2
+                            py1 += y_offset
+                            py2 += y_offset
+                        elif rotation_angle == 270:
+                            px1 = xmin * scale_x
+                            px2 = xmax * scale_x
+                            py1 = ymin * scale_y
+                            py2 = ymax * scale_y
+                            y_offset_page = page.rect.height * 0.28
+                            py1 += y_offset_page
+                            py2 += y_offset_page
+                            page_middle = page.rect.height / 2
+                            if min(py1, py2) < page_middle:
+                                py1 -= top_shift_px
+                                py2 -= top_shift_px
+                        elif rotation_angle == 180:
+                            px1 = page.rect.width - (xmin * scale_x)
+                            px2 = page.rect.width - (xmax * scale_x)
+                            py1 = page.rect.height - (ymin * scale_y)
+                            py2 = page.rect.height - (ymax * scale_y)
+                            page_middle = page.rect.height / 2
+                            if min(py1, py2) < page_middle:
+                                adjusted_shift = top_shift_px + 23
+                                py1 -= adjusted_shift
+                                py2 -= adjusted_shift
+                        else:
+                            if flip_x:
                                 px1 = page.rect.width - (xmin * scale_x)
                                 px2 = page.rect.width - (xmax * scale_x)
-                                py1 = page.rect.height - (ymin * scale_y)
-                                py2 = page.rect.height - (ymax * scale_y)
-                                y_offset = page.rect.height * -0.21
-                                py1 += y_offset
-                                py2 += y_offset
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                                y_offset = page.rect.height * 0.2
-                                py1 += y_offset
-                                py2 += y_offset
-                            elif rotation_angle == 270:
+                            else:
                                 px1 = xmin * scale_x
                                 px2 = xmax * scale_x
-                                py1 = ymin * scale_y
-                                py2 = ymax * scale_y
-                                y_offset_page = page.rect.height * 0.28
-                                py1 += y_offset_page
-                                py2 += y_offset_page
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    py1 -= top_shift_px
-                                    py2 -= top_shift_px
-                            elif rotation_angle == 180:
-                                px1 = page.rect.width - (xmin * scale_x)
-                                px2 = page.rect.width - (xmax * scale_x)
+                            if flip_y:
                                 py1 = page.rect.height - (ymin * scale_y)
                                 py2 = page.rect.height - (ymax * scale_y)
-                                page_middle = page.rect.height / 2
-                                if min(py1, py2) < page_middle:
-                                    adjusted_shift = top_shift_px + 23
-                                    py1 -= adjusted_shift
-                                    py2 -= adjusted_shift
                             else:
-                                if flip_x:
-                                    px1 = page.rect.width - (xmin * scale_x)
-                                    px2 = page.rect.width - (xmax * scale_x)
-                                else:
-                                    px1 = xmin * scale_x
-                                    px2 = xmax * scale_x
-                                if flip_y:
-                                    py1 = page.rect.height - (ymin * scale_y)
-                                    py2 = page.rect.height - (ymax * scale_y)
-                                else:
-                                    py1 = ymin * scale_y
-                                    py2 = ymax * scale_y
-                            page_middle = page.rect.height / 2
-                            if min(py1, py2) < page_middle:
-                                py1 -= top_shift_px
-                                py2 -= top_shift_px
-                            left = min(px1, px2)
-                            right = max(px1, px2)
-                            top = min(py1, py2)
-                            bottom = max(py1, py2)
-                            rect = fitz.Rect(left, top, right, bottom)
-                            new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), overlay=True)
-                        except Exception as ex:
-                            print(f"  Error inserting text: {ex}")
-                            continue
+                                py1 = ymin * scale_y
+                                py2 = ymax * scale_y
+                        page_middle = page.rect.height / 2
+                        if min(py1, py2) < page_middle:
+                            py1 -= top_shift_px
+                            py2 -= top_shift_px
+                        left = min(px1, px2)
+                        right = max(px1, px2)
+                        top = min(py1, py2)
+                        bottom = max(py1, py2)
+                        rect = fitz.Rect(left, top, right, bottom)
+                        new_page.insert_text(rect.tl, text, fontsize=font_size, color=(0, 0, 0), overlay=True)
+                    except Exception as ex:
+                        print(f"  Error inserting text: {ex}")
+                        continue
+    return new_page
+
+
+def recognize_preview_page(page, ocr, processor, dpi: int = 300, color_mode: str = 'rgb',
+                           clip_to_content: bool = True, orientation: str = 'prepass',
+                           text_overlay: bool = False):
+    """OCR of one page with the same decisions as process_pdf, for the layout preview.
+
+    Same render (DPI, color mode, content clip of pages not stored as an
+    image) and the same orientation pre-pass; returns (results in full-page
+    raster coordinates, raw engine output, full-page raster shape).
+    """
+    raster_out = analyze_page_content(page) != "vector_based" and not text_overlay
+    clip = content_clip(page) if clip_to_content and not raster_out else None
+    img, _ = render_page(page, dpi, clip, color_mode, encode=False)
+    angle = None
+    if orientation == 'prepass' and engine_accepts_options(ocr):
+        classifier = getattr(ocr, 'doc_orient', None) or get_orientation_classifier()
+        if classifier is not None:
+            angle = page_orientation(page, classifier)
+    results, raw = ocr_page(img, ocr, processor, angle)
+    shape = page_raster_shape(page, dpi)
+    if clip is not None:
+        results = processor.map_to_page(results, clip_offset(page, clip, dpi), img.shape, shape,
+                                        rotation_from_raw(raw))
+    return results, raw, shape
 
 
+def render_preview(page, page_index, input_path, ocr_results, rotation_angle, ocr_shape,
+                   hide_text=False, flip_x=False, flip_y=True, top_shift_px=20.0,
+                   font_size=8, preview_dpi=60, text_overlay=False):
+    """Low-DPI PNG of a page with its OCR text layer drawn on top, for layout tuning.
 
-    new_doc.save(output_path)
-    new_doc.close()
-    doc.close()
-    print(f"Done. Pages: {total_pages}, OCR blocks: {total_blocks}")
-    print(f"Saved output: {output_path}")
-    # Удаляем служебные файлы после записи выходного PDF
+    ocr_results/rotation_angle come from an earlier full-resolution OCR pass
+    whose image had shape ocr_shape; the boxes are scaled to the preview
+    raster and placed by assemble_page, so the overlay matches the final
+    output while no inference is run again. text_overlay=True adds the text
+    to a copy of the original page, as process_pdf(text_overlay=True) does.
+    """
+    page_type = analyze_page_content(page)
+    img, img_data = render_page(page, preview_dpi)
+    sx = img.shape[1] / float(ocr_shape[1])
+    sy = img.shape[0] / float(ocr_shape[0])
+    scaled = [[[[float(pt[0]) * sx, float(pt[1]) * sy] for pt in line[0]], line[1]] for line in ocr_results]
+    ocr_texts = {line[1][0] for line in ocr_results}
+
+    scratch = fitz.open()
     try:
-        input_basename = os.path.splitext(os.path.basename(input_path))[0]
-        src_dir = os.path.dirname(input_path)
-        tmp_files = [
-            os.path.join(src_dir, f"{input_basename}_page1_ocr_raw.txt"),
-            os.path.join(src_dir, f"{input_basename}_page1_ocr_normalized.json"),
-        ]
-        for tmp in tmp_files:
-            if os.path.exists(tmp):
-                os.remove(tmp)
-                print(f"Removed temp file: {tmp}")
-    except Exception as cleanup_err:
-        print(f"Warning: failed to remove temp files: {cleanup_err}")
+        overlay_page = None
+        if text_overlay:
+            scratch.insert_pdf(page.parent, from_page=page.number, to_page=page.number)
+            overlay_page = scratch[0]
+        out_page = assemble_page(scratch, page, page_index, input_path, page_type, img, img_data,
+                                 scaled, rotation_angle, hide_text, flip_x, flip_y,
+                                 top_shift_px, font_size, log_message=lambda msg: None,
+                                 overlay_page=overlay_page)
+        # Make the (possibly invisible) OCR text layer visible: box + red text
+        for block in out_page.get_text('dict')['blocks']:
+            for line in block.get('lines', []):
+                for span in line['spans']:
+                    if span['text'] not in ocr_texts:
+                        continue
+                    out_page.draw_rect(fitz.Rect(span['bbox']), color=(1, 0, 0), width=0.5, overlay=True)
+                    out_page.insert_text(span['origin'], span['text'], fontsize=span['size'],
+                                         color=(1, 0, 0), overlay=True)
+        mat = fitz.Matrix(preview_dpi / 72, preview_dpi / 72)
+        return out_page.get_pixmap(matrix=mat).tobytes('png')
+    finally:
+        scratch.close()
 
 
-def main():
+def process_pdf(input_path: str,
+                output_path: str,
+                hide_text: bool = False,
+                flip_x: bool = False,
+                flip_y: bool = True,
+                top_shift_px: float = 20.0,
+                font_size: int = 8,
+                dump_debug_first_page: bool = True,
+                dpi: int = 300,
+                log_callback=None,
+                ocr_engine=None,
+                cpu_threads=None,
+                rec_cache: int = 0,
+                crop_to_ink: bool = True,
+                ink_threshold: int = 200,
+                progress_callback=None,
+                cancel_event=None,
+                clip_to_content: bool = True,
+                color_mode: str = 'rgb',
+                page_index=None,
+                near_duplicates=None,
+                previous_source=None,
+                previous_output=None,
+                hybrid_text: bool = False,
+                orientation: str = 'prepass',
+                page_range=None,
+                render_process=False,
+                memory_budget=None,
+                page_timeout=None,
+                retry_dpi=None,
+                profile=False,
+                garbage: int = 3,
+                linearize: bool = False,
+                text_overlay: bool = False):
+    """Process a PDF and produce a searchable PDF using PaddleOCR.
+
+    progress_callback, if given, receives structured events as dicts:
+    {'event': 'start', 'pages'}, {'event': 'page', 'page', 'pages',
+    'page_type', 'blocks', 'rotation', 'seconds'} and {'event': 'saved',
+    'output', 'pages', 'blocks'} (plus {'event': 'cancelled', 'page',
+    'pages'} when stopped early).
+
+    cancel_event (threading.Event-like) is checked before every page; once
+    set, processing stops after the current page and the pages finished so
+    far are saved to output_path.
+
+    clip_to_content renders vector pages only inside their drawn-content
+    bounding box; OCR boxes are shifted back to full-page coordinates.
+
+    color_mode ('rgb', 'gray' or 'bitonal') selects the render colorspace;
+    in gray/bitonal mode scanned pages are also stored in that form.
+
+    page_index reuses OCR results of pages seen before (see page_index.py):
+    None or False (default) uses no index, True keeps an in-memory index for
+    this call (repeated sheets within the file), a path opens a shared
+    SQLite index; a PageIndex instance is used as is. near_duplicates additionally matches
+    visually identical pages within that many dhash bits.
+
+    previous_source/previous_output: the last version of this set and the
+    searchable PDF made from it. Pages whose content hash matches a page of
+    the previous source are copied from the previous output with their text
+    layer instead of being OCRed again (the previous output must have been
+    made with the same options).
+
+    hybrid_text: native text lines of the PDF are masked out of the raster
+    so OCR only reads what the text layer does not cover (stamps, raster
+    insets); a page fully covered by native text is not OCRed at all. On
+    pages stored as images the native lines are inserted as the text layer,
+    vector pages keep them through the re-drawn source.
+
+    orientation='prepass' decides the page orientation before OCR: pages
+    with /Rotate are trusted as they are, others are classified on a small
+    thumbnail, and the image is turned before detection with the engine's
+    own classifier switched off. 'engine' leaves it to the OCR pipeline
+    (also used when the engine has no per-call options).
+
+    page_range=(start, stop) processes only pages start..stop-1 (0-based)
+    into output_path, e.g. one shard of a large document (shard_cluster.py).
+
+    render_process=True renders pages in a separate process, a few pages
+    ahead of OCR, and hands the rasters over in shared memory (see
+    shm_transport.py). The process of the calling thread is kept for the
+    next files (get_renderer); a RenderProcess instance is used as is.
+
+    memory_budget (MB, or a MemoryGovernor) admits pages only when they fit
+    the budget and the free system memory; image pages that would not fit
+    are rendered at a lower DPI, vector pages are OCRed in bands
+    (see memory_governor.py).
+
+    page_timeout (seconds) runs OCR in a supervised worker process (see
+    ocr_supervisor.py): a page that takes longer or crashes the worker is
+    retried once at retry_dpi (default: two thirds of dpi, at least 100),
+    and if that fails too it is kept without a text layer and listed in
+    the 'failed_pages' statistics. A worker that cannot load the models
+    fails the whole file (ocr_supervisor.StartFailed).
+
+    rec_cache: line crops cached by the engine loaded here or in the
+    supervised worker (see create_ocr_engine); ignored with ocr_engine.
+
+    crop_to_ink feeds the engine only the inked part of a raster and skips
+    pages without ink (logged per page); a pixel darker than ink_threshold
+    (gray level 0-255) counts as ink. crop_to_ink=False sends every page
+    whole (faint scans, light-gray drawings).
+
+    profile=True profiles every stage of every page (cProfile and a sampling
+    thread, see profiler.py) into <output>_profile/ (or the folder given
+    instead of True) and logs the top hotspots; the statistics get a
+    'profile' entry.
+
+    text_overlay=True keeps every source page as it is: the pages are copied
+    into the output in one pass (shared fonts and images are copied once)
+    and only the OCR text layer is added, instead of storing a re-rendered
+    PNG for image pages and re-drawing vector pages. The render then only
+    feeds OCR.
+
+    The output is written by pdf_output.save_pdf: garbage collected with
+    duplicate objects merged (garbage, 4 also compares streams), compressed
+    and with linearize=True linearized for fast web view; the size goes to
+    'output_bytes', the linearization time to timings['linearize'].
+
+    Returns a dict with per-file statistics (pages, OCR blocks and stage
+    timings in seconds, 'cancelled' flag) for batch summaries. 'saved' is
+    False when no page was processed (empty page range, cancelled before
+    the first page): output_path is not written then.
+    """
+
+    def log_message(msg):
+        """Log message using callback or print"""
+        if log_callback:
+            log_callback(msg)
+        else:
+            print(msg)
+
+    def report(event, **data):
+        """Send a structured progress event (never breaks processing)"""
+        if progress_callback:
+            try:
+                progress_callback(dict(event=event, **data))
+            except Exception as cb_err:
+                print(f"Progress callback error: {cb_err}")
+
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file not found: {input_path}")
+
+    t_start = time.perf_counter()
+    profiler = None
+    if profile:
+        profiler = Profiler(profile if isinstance(profile, str) else profile_dir(output_path)).start('init')
+
+    def stage(name, page=None):
+        if profiler is not None:
+            profiler.switch(name, page)
+
+    # Закрываются в finally, в том числе после ошибки страницы или записи
+    index = prev_out = doc = new_doc = renderer = governor = None
+    own_index = False
     try:
-        process_pdf(
-            INPUT,
-            OUTPUT,
-            hide_text=False,
-            flip_x=True,
-            flip_y=True,
-            top_shift_px=-23.0,
-            font_size=4,
-            dump_debug_first_page=True,
-            dpi=300
-        )
-    except Exception as e:
-        print(f"Processing failed: {e}")
+        # Reuse a caller-provided engine (batch/CLI workers) or load the local models
+        # Под надзором модели загружаются в отдельном процессе, здесь движок не нужен
+        supervisor = get_supervisor(page_timeout, cpu_threads, rec_cache) if page_timeout else None
+        if ocr_engine is not None:
+            ocr = ocr_engine
+        elif supervisor is not None:
+            ocr = None
+        else:
+            ocr = create_ocr_engine(cpu_threads=cpu_threads, rec_cache=rec_cache)
+        rec_counts = (ocr.hits, ocr.misses) if isinstance(ocr, SplitOCREngine) else None
+        if retry_dpi is None:
+            retry_dpi = max(100, dpi * 2 // 3)
+        failed_pages = []
+
+        ink_options = {'crop_to_ink': crop_to_ink, 'ink_threshold': ink_threshold}
+        processor = TechnicalOCRProcessor(**ink_options)
+        FONT_SIZE = 4
+
+        # Индекс повторяющихся страниц (свой для вызова, общий файл или готовый объект)
+        own_index = page_index not in (None, False) and not isinstance(page_index, PageIndex)
+        if page_index in (None, False):
+            index = None
+        elif own_index:
+            index = PageIndex(None if page_index is True else page_index, near_distance=near_duplicates)
+        else:
+            index = page_index
+        reused_pages = 0
+
+        # Ориентация страницы: отдельный дешёвый этап вместо классификатора внутри ocr.ocr
+        classifier = None
+        if orientation == 'prepass' and (supervisor is not None or engine_accepts_options(ocr)):
+            classifier = getattr(ocr, 'doc_orient', None) or get_orientation_classifier(cpu_threads)
+        if orientation == 'prepass' and classifier is None:
+            log_message("⚠️ Orientation pre-pass is not available, the OCR engine classifies pages itself")
+
+        # Предыдущая версия комплекта: неизменённые листы копируются из готового результата
+        previous_pages, prev_out = {}, None
+        carried_pages = 0
+        if previous_source and previous_output:
+            if os.path.exists(previous_source) and os.path.exists(previous_output):
+                prev_out = fitz.open(previous_output)
+                with fitz.open(previous_source) as prev_src:
+                    if len(prev_src) != len(prev_out):
+                        # A page_range or cancelled output: page j is not page j of the source
+                        log_message(f"⚠️ Previous output has {len(prev_out)} of {len(prev_src)} pages, "
+                                    "processing all pages")
+                        prev_out.close()
+                        prev_out = None
+                    else:
+                        prev_digests = {}
+                        for j in range(len(prev_src)):
+                            previous_pages.setdefault(page_fingerprint(prev_src[j], prev_digests), j)
+                if prev_out is not None:
+                    log_message(f"♻️ Comparing with previous version {os.path.basename(previous_source)} "
+                                f"({len(previous_pages)} known pages)")
+            else:
+                log_message("⚠️ Previous version not found, processing all pages")
+
+        doc = fitz.open(input_path)
+        new_doc = fitz.open()
+        total_pages = len(doc)
+        first_page, stop_page = 0, total_pages
+        if page_range is not None:
+            first_page, stop_page = max(0, int(page_range[0])), min(total_pages, int(page_range[1]))
+        total_blocks = 0
+        index_mode = color_mode + ('/hybrid' if hybrid_text else '')
+
+        # Рендер в отдельном процессе: растры передаются через общую память
+        renderer = None
+        if render_process:
+            renderer = render_process if isinstance(render_process, RenderProcess) else get_renderer()
+        # Бюджет памяти: допуск страниц, понижение DPI или OCR полосами
+        governor = None
+        if isinstance(memory_budget, MemoryGovernor):
+            governor = memory_budget
+        elif memory_budget:
+            governor = get_governor(int(memory_budget))
+        lowered_pages = tiled_pages = 0
+        plans = {}
+        digests = {}  # object digests of this document, shared by the fingerprints of its pages
+
+        def recognize_page(pg, img, clip, page_dpi, tiles, angle, native_lines):
+            """OCR of one page in full-page raster coordinates at page_dpi"""
+            if supervisor is not None:
+                recognize = lambda ocr_img, ocr_angle: supervisor.ocr_page(ocr_img, ocr_angle, ink_options)
+            else:
+                recognize = lambda ocr_img, ocr_angle: ocr_page(ocr_img, ocr, processor, ocr_angle)
+            if tiles:
+                return ocr_page_tiled(pg, ocr, processor, page_dpi, tiles, angle, color_mode, native_lines,
+                                      recognize=recognize)
+            ocr_img = img
+            if native_lines:
+                # OCR only sees what the native text layer does not cover
+                offset = clip_offset(pg, clip, page_dpi) if clip is not None else (0, 0)
+                ocr_img = mask_boxes(img, native_lines, offset)
+            results, raw = recognize(ocr_img, angle)
+            if clip is not None:
+                results = processor.map_to_page(results, clip_offset(pg, clip, page_dpi), img.shape,
+                                                page_raster_shape(pg, page_dpi), rotation_from_raw(raw))
+            return results, raw
+
+        def plan(k):
+            """Decisions about page k shared by the loop and the render look-ahead"""
+            if k not in plans:
+                pg = doc[k]
+                p = {'fingerprint': None, 'carry': None}
+                if previous_pages:
+                    p['fingerprint'] = page_fingerprint(pg, digests)
+                    p['carry'] = previous_pages.get(p['fingerprint'])
+                if p['carry'] is None:
+                    p['page_type'] = analyze_page_content(pg)
+                    # Whether the raster itself goes into the output (image pages without text_overlay)
+                    p['raster_out'] = p['page_type'] != "vector_based" and not text_overlay
+                    if index is not None:
+                        p['fingerprint'] = p['fingerprint'] or page_fingerprint(pg, digests)
+                    p['clip'] = content_clip(pg) if clip_to_content and not p['raster_out'] else None
+                    p['dpi'], p['tiles'] = dpi, None
+                    if governor is not None:
+                        p['dpi'], p['tiles'] = governor.plan_page(pg, dpi, color_mode, can_tile=not p['raster_out'])
+                        if p['tiles']:
+                            p['clip'] = None
+                plans[k] = p
+            return plans[k]
+
+        def request_render(k):
+            """Queue page k in the render process; False if it is not rendered there"""
+            p = plan(k)
+            if p['carry'] is not None or p['tiles']:
+                return False
+            if (not p['raster_out'] and index is not None
+                    and index.contains(p['fingerprint'], p['dpi'], index_mode)):
+                return False
+            return renderer.request(k, input_path, k, p['dpi'], p['clip'], color_mode,
+                                    encode=p['raster_out'],
+                                    max_bytes=int(np.prod(page_raster_shape(doc[k], p['dpi']))))
+
+        timings = {'init': time.perf_counter() - t_start, 'render': 0.0, 'ocr': 0.0, 'assemble': 0.0, 'save': 0.0}
+        report('start', pages=total_pages)
+        pages_done = 0
+        cancelled = False
+        if text_overlay and stop_page > first_page:
+            # Все исходные страницы копируются одним вызовом: общие ресурсы переносятся один раз
+            t_stage = time.perf_counter()
+            new_doc.insert_pdf(doc, from_page=first_page, to_page=stop_page - 1)
+            timings['assemble'] += time.perf_counter() - t_stage
+
+        for i in range(first_page, stop_page):
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                log_message(f"⏹ Cancelled after {pages_done}/{total_pages} pages")
+                report('cancelled', page=pages_done, pages=total_pages)
+                if text_overlay:
+                    # Copies of the pages not reached are not part of the partial result
+                    new_doc.delete_pages(from_page=i - first_page, to_page=new_doc.page_count - 1)
+                break
+            t_page = time.perf_counter()
+            FONT_SIZE = 8
+            page = doc[i]
+            if renderer is not None:
+                # Keep the next pages rendering while this one is recognized
+                for k in range(i, min(stop_page, i + renderer.slots)):
+                    request_render(k)
+            p = plan(i)
+            fingerprint = p['fingerprint']
+
+            j = p['carry']
+            if j is not None:
+                t_stage = time.perf_counter()
+                stage('assemble', i)
+                if text_overlay:
+                    # Replace the copy of the source page by the finished page
+                    new_doc.delete_page(i - first_page)
+                    new_doc.insert_pdf(prev_out, from_page=j, to_page=j, start_at=i - first_page)
+                else:
+                    new_doc.insert_pdf(prev_out, from_page=j, to_page=j)
+                timings['assemble'] += time.perf_counter() - t_stage
+                carried_pages += 1
+                metrics.PAGES.inc(type='unchanged')
+                pages_done += 1
+                log_message(f"📄 Page {i+1}: unchanged (page {j+1} of the previous version), text layer carried over")
+                report('page', page=i + 1, pages=total_pages, page_type='unchanged', blocks=0,
+                       rotation=0, seconds=round(time.perf_counter() - t_page, 3))
+                continue
+        
+            # Analyze page content type
+            page_type = p['page_type']
+            raster_out = p['raster_out']
+            log_message(f"📄 Page {i+1}: type = {page_type}")
+        
+            page_dpi, tiles = p['dpi'], p['tiles']
+            if page_dpi != dpi:
+                lowered_pages += 1
+                log_message(f"  🧠 Not enough memory for {dpi} dpi, rendering at {page_dpi} dpi")
+            if tiles:
+                tiled_pages += 1
+                log_message(f"  🧠 Not enough memory for the whole page, OCR in {tiles} bands")
+            if governor is not None:
+                governor.admit(page_cost(page, page_dpi, color_mode, tiles))
+
+            t_stage = time.perf_counter()
+            stage('render', i)
+            dhash = cached = None
+            if index is not None:
+                fingerprint = fingerprint or page_fingerprint(page, digests)
+                cached = index.lookup(fingerprint, page_dpi, index_mode)
+            clip = None
+            if (cached is not None or tiles) and not raster_out:
+                # Known sheet: OCR is reused and the raster would not be used at all
+                # (tiled pages are rendered band by band during OCR)
+                img, img_data = np.broadcast_to(np.uint8(255), page_raster_shape(page, page_dpi)), None
+            else:
+                # Vector sheets are re-drawn from the source, so the raster only feeds OCR
+                # and empty borders need not be rendered at all
+                clip = p['clip']
+                if renderer is not None and request_render(i):
+                    img, img_data = renderer.result(i)
+                else:
+                    # The PNG is only needed when the raster itself goes into the output page
+                    img, img_data = render_page(page, page_dpi, clip, color_mode, encode=raster_out)
+                if index is not None and cached is None:
+                    dhash = difference_hash(img)
+                    cached = index.lookup_near(page, dhash, page_dpi, index_mode)
+            timings['render'] += time.perf_counter() - t_stage
+            t_stage = time.perf_counter()
+            stage('ocr', i)
+
+            # ⚙️ Process page (includes vertical text correction)
+            log_message(f"📄 Processing page {i+1}/{total_pages}")
+            if index is not None:
+                metrics.CACHE_LOOKUPS.inc(cache='page_index')
+            if cached is not None:
+                log_message("  ♻️ Reusing OCR results of an identical page")
+                ocr_results, raw_ret = cached[0], [{'doc_preprocessor_res': {'angle': cached[1]}}]
+                reused_pages += 1
+                metrics.CACHE_HITS.inc(cache='page_index')
+            native_lines = native_text_lines(page, page_dpi) if hybrid_text else []
+            page_failed = False
+            if cached is None:
+                page_angle = page_orientation(page, classifier) if classifier is not None else None
+                try:
+                    ocr_results, raw_ret = recognize_page(page, img, clip, page_dpi, tiles, page_angle, native_lines)
+                except PageFailed as e:
+                    log_message(f"  ⚠️ {e}; retrying at {retry_dpi} dpi")
+                    page_dpi = retry_dpi
+                    native_lines = native_text_lines(page, page_dpi) if hybrid_text else []
+                    try:
+                        retry_img = None
+                        if not tiles:
+                            retry_img, _ = render_page(page, page_dpi, clip, color_mode, encode=False)
+                        ocr_results, raw_ret = recognize_page(page, retry_img, clip, page_dpi, tiles, page_angle,
+                                                              native_lines)
+                    except PageFailed as e:
+                        page_failed = True
+                        ocr_results, raw_ret = [], []
+                        failed_pages.append({'page': i + 1, 'error': str(e)})
+                        metrics.PAGE_FAILURES.inc()
+                        log_message(f"  ❌ Page {i+1} is kept without OCR: {e}")
+                        report('page_failed', page=i + 1, pages=total_pages, error=str(e))
+                    # Boxes are now in the raster frame of retry_dpi; the output image stays as rendered
+                    img = np.broadcast_to(np.uint8(255), page_raster_shape(page, page_dpi))
+                if is_blank_raw(raw_ret):
+                    why = "no ink outside the native text" if native_lines else f"nothing darker than {ink_threshold}"
+                    log_message(f"  ⬜ Page {i+1} is blank ({why}), OCR skipped")
+                if index is not None and not page_failed:
+                    index.store(page, fingerprint, dhash, page_dpi, index_mode, ocr_results, rotation_from_raw(raw_ret))
+            if native_lines:
+                log_message(f"  🔤 Native text lines: {len(native_lines)}")
+                if raster_out:
+                    # Страница сохраняется картинкой: нативный текст добавляется как текстовый слой
+                    ocr_results = processor.rotate_boxes(native_lines, rotation_from_raw(raw_ret),
+                                                         page_raster_shape(page, page_dpi)) + ocr_results
+            if clip is not None:
+                # assemble_page only needs the size of the full-page raster
+                img = np.broadcast_to(np.uint8(255), page_raster_shape(page, page_dpi))
+
+            if dump_debug_first_page and i == 0:
+                try:
+                    input_basename = os.path.splitext(os.path.basename(input_path))[0]
+                    raw_dbg = os.path.join(os.path.dirname(input_path), f'{input_basename}_page1_ocr_raw.txt')
+                    with open(raw_dbg, 'w', encoding='utf-8') as fh:
+                        fh.write(repr(raw_ret))
+                    print(f"  Wrote raw OCR dump: {raw_dbg}")
+                except Exception:
+                    pass
+
+            # 🔧 Определяем угол поворота из сырых результатов OCR
+            rotation_angle = 0
+            detected_angle = rotation_from_raw(raw_ret)
+            if detected_angle is not None:
+                rotation_angle = detected_angle
+                log_message(f"  Detected rotation angle: {rotation_angle} degrees")
+                if rotation_angle in [90, 270]:
+                    log_message(f"  Auto-applying flip operations for vertical page")
+                elif rotation_angle == 180:
+                    log_message(f"  Auto-applying flip operations for 180° rotated page")
+                elif rotation_angle == 270:
+                    log_message(f"  Auto-applying flip operations for 270° rotated page")
+            log_message(f"  OCR blocks: {len(ocr_results)}")
+
+            if dump_debug_first_page and i == 0:
+                try:
+                    input_basename = os.path.splitext(os.path.basename(input_path))[0]
+                    dbg_path = os.path.join(os.path.dirname(input_path), f'{input_basename}_page1_ocr_normalized.json')
+                    with open(dbg_path, 'w', encoding='utf-8') as fh:
+                        json.dump(ocr_results, fh, ensure_ascii=False, indent=2)
+                    print(f"  Wrote debug normalized OCR: {dbg_path}")
+                except Exception:
+                    pass
+            total_blocks += len(ocr_results)
+            ocr_seconds = time.perf_counter() - t_stage
+            timings['ocr'] += ocr_seconds
+            if cached is None:
+                metrics.PAGE_OCR_SECONDS.observe(ocr_seconds)
+            t_stage = time.perf_counter()
+            stage('assemble', i)
+
+            assemble_page(new_doc, page, i, input_path, page_type, img, img_data,
+                          ocr_results, rotation_angle, hide_text, flip_x, flip_y,
+                          top_shift_px, font_size, log_message,
+                          overlay_page=new_doc[i - first_page] if text_overlay else None)
+            timings['assemble'] += time.perf_counter() - t_stage
+            if renderer is not None:
+                renderer.release(i)
+            if governor is not None:
+                governor.done()
+            pages_done += 1
+            metrics.PAGES.inc(type=page_type)
+            metrics.PAGE_BLOCKS.observe(len(ocr_results))
+            report('page', page=i + 1, pages=total_pages, page_type=page_type, blocks=len(ocr_results),
+                   rotation=rotation_angle, seconds=round(time.perf_counter() - t_page, 3))
+
+        t_stage = time.perf_counter()
+        stage('save')
+        saved = None
+        if pages_done > 0:
+            # A cancelled run keeps the pages finished so far
+            saved = save_pdf(new_doc, output_path, garbage, linearize)
+            log_message(describe_save(saved))
+        timings['save'] = time.perf_counter() - t_stage
+        if saved is not None and linearize:
+            timings['save'] -= saved['linearize']
+            timings['linearize'] = saved['linearize']
+        if pages_done > 0:
+            report('saved', output=output_path, pages=pages_done, blocks=total_blocks)
+            log_message(f"Done. Pages: {pages_done}, OCR blocks: {total_blocks}")
+            log_message(f"Saved output: {output_path}")
+        else:
+            log_message(f"⚠️ No pages processed, {output_path} was not written")
+        # Удаляем служебные файлы после записи выходного PDF
+        try:
+            input_basename = os.path.splitext(os.path.basename(input_path))[0]
+            src_dir = os.path.dirname(input_path)
+            tmp_files = [
+                os.path.join(src_dir, f"{input_basename}_page1_ocr_raw.txt"),
+                os.path.join(src_dir, f"{input_basename}_page1_ocr_normalized.json"),
+            ]
+            for tmp in tmp_files:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                    log_message(f"Removed temp file: {tmp}")
+        except Exception as cleanup_err:
+            log_message(f"Warning: failed to remove temp files: {cleanup_err}")
+
+        profile_stats = None
+        if profiler is not None:
+            profile_stats = profiler.finish()
+            log_message(f"🔥 Top hotspots (own time, profile in {profile_stats['dir']}):")
+            for spot in profile_stats['hotspots'][:10]:
+                log_message(f"  {spot['tottime']:8.3f}s own {spot['cumtime']:8.3f}s cum "
+                            f"{spot['calls']:>8} calls  {spot['function']}")
+    finally:
+        # The render process, its shared memory and the documents must not outlive a failed file
+        if new_doc is not None:
+            new_doc.close()
+        if doc is not None:
+            doc.close()
+        if prev_out is not None:
+            prev_out.close()
+        if own_index and index is not None:
+            index.close()
+        if renderer is not None:
+            # the render process stays up for the next file (get_renderer)
+            renderer.release_all()
+        if governor is not None:
+            governor.done()  # the admission of a page that failed midway
+        if profiler is not None:
+            profiler.close()  # after finish() nothing is left to stop
+
+    timings['total'] = time.perf_counter() - t_start
+    for name, seconds in timings.items():
+        if name != 'total':
+            metrics.STAGE_SECONDS.inc(seconds, stage=name)
+    if isinstance(ocr, SplitOCREngine):
+        hits, misses = ocr.hits - rec_counts[0], ocr.misses - rec_counts[1]
+        metrics.CACHE_LOOKUPS.inc(hits + misses, cache='rec')
+        metrics.CACHE_HITS.inc(hits, cache='rec')
+    metrics.FILES.inc(status='cancelled' if cancelled else 'ok' if saved is not None else 'failed')
+    stats = {
+        'input': input_path,
+        'output': output_path,
+        'pages': pages_done,
+        'total_pages': total_pages,
+        'blocks': total_blocks,
+        'reused_pages': reused_pages,
+        'carried_pages': carried_pages,
+        'lowered_pages': lowered_pages,
+        'tiled_pages': tiled_pages,
+        'failed_pages': failed_pages,
+        'output_bytes': saved['bytes'] if saved is not None else 0,
+        'saved': saved is not None,
+        'cancelled': cancelled,
+        'timings': {k: round(v, 3) for k, v in timings.items()},
+    }
+    if profile_stats is not None:
+        stats['profile'] = profile_stats
+    return stats
+
+
+def main():
+    """Command line entry point (see batch_cli.py for the options)."""
+    from batch_cli import main as cli_main
+    return cli_main()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
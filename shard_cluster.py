@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-node processing of large documents through a shared folder.
+
+The coordinator splits every document into page-range shards and writes one
+task file per shard into a folder all nodes can reach (SMB/NFS share). Any
+number of workers, on any machine, claim shards by creating a lease file,
+process their page range with process_pdf and publish the partial PDF. The
+coordinator merges the parts of each document into the final searchable PDF
+and puts shards of dead workers back into play once their lease is stale.
+
+Shared folder layout (plain files, no server needed):
+
+    <root>/jobs/    one descriptor per document (status, shard count, output)
+    <root>/tasks/   one descriptor per shard: page range, options, attempts
+    <root>/leases/  <task> while a worker holds it; its mtime is the heartbeat
+    <root>/parts/   searchable PDF of each finished shard
+    <root>/done/    result record of each finished shard
+    <root>/failed/  shards that used up their attempts
+    <root>/files/   inputs copied in with --stage
+
+Example (one share, several machines):
+
+    python shard_cluster.py submit --root //nas/ocr -o //nas/out --shard-pages 50 archive/*.pdf
+    python shard_cluster.py worker --root //nas/ocr              # on every node
+    python shard_cluster.py coordinator --root //nas/ocr         # merges results
+
+Or everything on one machine, with local processes standing in for nodes:
+
+    python shard_cluster.py local --root .cluster --nodes 4 -o out archive/*.pdf
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import fitz
+
+from batch_cli import (add_option_arguments, default_output_path, expand_inputs, init_worker,
+                       option_defaults, run_job)
+from pdf_output import save_pdf
+
+FOLDERS = ('jobs', 'tasks', 'leases', 'parts', 'done', 'failed', 'files')
+
+
+def _write_json_atomic(path: str, data: dict):
+    # Unique temp name: several nodes may publish the same record at once
+    tmp = f"{path}.{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str):
+    """Load a descriptor; None if it vanished or is being replaced"""
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ShardStore:
+    """File-based task board shared by the coordinator and all workers.
+
+    Paths inside descriptors are relative to root where possible, so nodes
+    may mount the share under different names.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        for name in FOLDERS:
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def path(self, folder: str, name: str = '') -> str:
+        return os.path.join(self.root, folder, name)
+
+    def resolve(self, path: str) -> str:
+        return os.path.join(self.root, path)  # absolute paths stay as they are
+
+    def names(self, folder: str) -> list:
+        return sorted(name[:-5] for name in os.listdir(self.path(folder)) if name.endswith('.json'))
+
+    def task(self, name: str):
+        return _read_json(self.path('tasks', f"{name}.json"))
+
+    def finished(self, name: str) -> bool:
+        return (os.path.exists(self.path('done', f"{name}.json"))
+                or os.path.exists(self.path('failed', f"{name}.json")))
+
+    def open_tasks(self) -> list:
+        return [name for name in self.names('tasks') if not self.finished(name)]
+
+    # --- leases -----------------------------------------------------------
+
+    def acquire(self, name: str, worker_id: str) -> bool:
+        """Create the lease of a task; only one node can succeed (O_EXCL)"""
+        try:
+            fd = os.open(self.path('leases', name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            json.dump({'worker': worker_id, 'acquired': time.time()}, fh)
+        return True
+
+    def lease_owner(self, name: str):
+        lease = _read_json(self.path('leases', name))
+        return lease.get('worker') if lease else None
+
+    def release(self, name: str, worker_id: str):
+        if self.lease_owner(name) == worker_id:
+            _remove(self.path('leases', name))
+
+    def recover_stale(self, timeout: float) -> list:
+        """Drop leases whose heartbeat is older than timeout; the shard is retried"""
+        recovered = []
+        now = time.time()
+        for name in os.listdir(self.path('leases')):
+            lease = self.path('leases', name)
+            try:
+                age = now - os.path.getmtime(lease)
+            except OSError:
+                continue
+            if age < timeout:
+                continue
+            _remove(lease)
+            if self.finished(name):
+                continue
+            task = self.task(name)
+            if task is not None:
+                # A shard that keeps killing its node must not be retried forever
+                self.count_attempt(task, f"Lease expired after {age:.0f}s (worker lost)")
+            recovered.append(name)
+        return recovered
+
+    def count_attempt(self, task: dict, error: str):
+        task['attempts'] = task.get('attempts', 0) + 1
+        task['last_error'] = error
+        if task['attempts'] >= task.get('max_attempts', 2):
+            _write_json_atomic(self.path('failed', f"{task['name']}.json"), {
+                'task': task['name'], 'error': error, 'attempts': task['attempts'], 'time': time.time()})
+        _write_json_atomic(self.path('tasks', f"{task['name']}.json"), task)
+
+
+class Heartbeat:
+    """Refresh a lease's mtime in the background while its shard is processed"""
+
+    def __init__(self, store: ShardStore, name: str, worker_id: str, interval: float):
+        self.store = store
+        self.name = name
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{name}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.store.lease_owner(self.name) != self.worker_id:
+                self.lost = True
+                return
+            try:
+                os.utime(self.store.path('leases', self.name))
+            except OSError:
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# --- coordinator --------------------------------------------------------------
+
+def submit(store: ShardStore, inputs, output_dir: str = None, options: dict = None,
+           shard_pages: int = 50, max_attempts: int = 2, stage: bool = False, log=print) -> list:
+    """Split documents into page-range tasks; returns the created job descriptors"""
+    options = options or {}
+    shard_pages = max(1, int(shard_pages))
+    jobs = []
+    for input_path in inputs:
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        with fitz.open(input_path) as doc:
+            pages = len(doc)
+        source = os.path.abspath(input_path)
+        if stage:
+            shutil.copyfile(input_path, store.path('files', f"{job_id}.pdf"))
+            source = os.path.join('files', f"{job_id}.pdf")
+        job = {
+            'id': job_id,
+            'name': os.path.basename(input_path),
+            'input': source,
+            'output': os.path.abspath(default_output_path(input_path, options.get('hide_text', False), output_dir)),
+            'pages': pages,
+            'shards': [],
+            'options': options,
+            'status': 'queued',
+            'submitted': time.time(),
+        }
+        for shard, start in enumerate(range(0, pages, shard_pages)):
+            name = f"{job_id}.{shard:04d}"
+            job['shards'].append(name)
+            _write_json_atomic(store.path('tasks', f"{name}.json"), {
+                'name': name,
+                'job': job_id,
+                'input': source,
+                'output': os.path.join('parts', f"{name}.pdf"),
+                'page_range': [start, min(start + shard_pages, pages)],
+                'options': options,
+                'attempts': 0,
+                'max_attempts': max(1, int(max_attempts)),
+            })
+        # The job descriptor goes last: the coordinator never sees a job with missing tasks
+        _write_json_atomic(store.path('jobs', f"{job_id}.json"), job)
+        jobs.append(job)
+        log(f"📤 {job['name']}: {pages} pages in {len(job['shards'])} shard(s) as {job_id}")
+    return jobs
+
+
+def merge_job(store: ShardStore, job: dict) -> dict:
+    """Concatenate the shard outputs of a job into its final PDF"""
+    merged = fitz.open()
+    blocks = 0
+    try:
+        for name in job['shards']:
+            record = _read_json(store.path('done', f"{name}.json")) or {}
+            blocks += record.get('blocks', 0)
+            with fitz.open(store.path('parts', f"{name}.pdf")) as part:
+                merged.insert_pdf(part)
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        tmp = f"{job['output']}.part"
+        # Parts embed the same OCR font; garbage collection keeps a single copy
+        save_pdf(merged, tmp, max(3, job['options'].get('garbage', 3)), job['options'].get('linearize', False))
+        os.replace(tmp, job['output'])
+    finally:
+        merged.close()
+    return {'pages': job['pages'], 'blocks': blocks}
+
+
+def _cleanup_job(store: ShardStore, job: dict):
+    for name in job['shards']:
+        for folder, suffix in (('tasks', '.json'), ('done', '.json'), ('parts', '.pdf')):
+            _remove(store.path(folder, f"{name}{suffix}"))
+    if job['input'] == os.path.join('files', f"{job['id']}.pdf"):
+        _remove(store.resolve(job['input']))
+
+
+def coordinate_once(store: ShardStore, lease_timeout: float = 60.0, log=print) -> int:
+    """One coordinator pass: recover stale leases, merge finished jobs; returns open jobs"""
+    for name in store.recover_stale(lease_timeout):
+        log(f"♻️ Lease of {name} expired, shard re-queued")
+    open_jobs = 0
+    for job_id in store.names('jobs'):
+        job_file = store.path('jobs', f"{job_id}.json")
+        job = _read_json(job_file)
+        if job is None or job['status'] in ('done', 'failed'):
+            continue
+        failed = [name for name in job['shards'] if os.path.exists(store.path('failed', f"{name}.json"))]
+        if failed:
+            errors = [(_read_json(store.path('failed', f"{name}.json")) or {}).get('error') for name in failed]
+            job.update(status='failed', error=f"{len(failed)} shard(s) failed: {errors[0]}", finished=time.time())
+            _write_json_atomic(job_file, job)
+            log(f"❌ {job['name']}: {job['error']}")
+            continue
+        done = sum(1 for name in job['shards'] if os.path.exists(store.path('done', f"{name}.json")))
+        if done < len(job['shards']):
+            if job['status'] == 'queued' and (done or any(
+                    os.path.exists(store.path('leases', name)) for name in job['shards'])):
+                job['status'] = 'running'
+                _write_json_atomic(job_file, job)
+            open_jobs += 1
+            continue
+        try:
+            stats = merge_job(store, job)
+        except Exception as e:
+            job.update(status='failed', error=f"Merge failed: {type(e).__name__}: {e}", finished=time.time())
+            _write_json_atomic(job_file, job)
+            log(f"❌ {job['name']}: {job['error']}")
+            continue
+        job.update(status='done', blocks=stats['blocks'], finished=time.time())
+        _write_json_atomic(job_file, job)
+        _cleanup_job(store, job)
+        log(f"✅ {job['name']}: {job['pages']} pages, {stats['blocks']} blocks "
+            f"in {job['finished'] - job['submitted']:.1f}s -> {job['output']}")
+    return open_jobs
+
+
+def coordinate(store: ShardStore, lease_timeout: float = 60.0, poll: float = 2.0,
+               follow: bool = False, log=print):
+    """Run coordinator passes until no job is open (forever with follow=True)"""
+    while True:
+        if coordinate_once(store, lease_timeout, log) == 0 and not follow:
+            return
+        time.sleep(poll)
+
+
+# --- worker -------------------------------------------------------------------
+
+def work(store: ShardStore, worker_id: str = None, lease_timeout: float = 60.0, poll: float = 2.0,
+         exit_when_idle: bool = False, quiet: bool = False, log=print) -> int:
+    """Claim and process shards until stopped; returns the number of shards processed"""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    processed = 0
+    log(f"🛠️ Worker {worker_id} on {store.root}")
+    while True:
+        claimed = None
+        pending = store.open_tasks()
+        for name in pending:
+            if not store.acquire(name, worker_id):
+                continue
+            # The shard may have been finished between listing and acquiring
+            task = store.task(name)
+            if task is None or store.finished(name):
+                store.release(name, worker_id)
+                continue
+            claimed = task
+            break
+        if claimed is None:
+            if exit_when_idle and not pending:
+                return processed
+            time.sleep(poll)
+            continue
+
+        name = claimed['name']
+        start, stop = claimed['page_range']
+        part = store.resolve(claimed['output'])
+        tmp = f"{part}.{worker_id}.tmp.pdf"
+        log(f"⚙️ {name}: pages {start + 1}-{stop} (attempt {claimed['attempts'] + 1})")
+        job = {
+            'input': store.resolve(claimed['input']),
+            'output': tmp,
+            # Parts are merged later: only the final file is linearized
+            'options': dict(claimed['options'], page_range=[start, stop], linearize=False),
+        }
+        with Heartbeat(store, name, worker_id, max(1.0, lease_timeout / 3)) as heartbeat:
+            record = run_job(job, quiet)
+        if record['status'] == 'ok':
+            os.replace(tmp, part)
+            record.update(task=name, worker=worker_id, output=claimed['output'], page_range=[start, stop])
+            _write_json_atomic(store.path('done', f"{name}.json"), record)
+            processed += 1
+            note = " (lease was lost meanwhile)" if heartbeat.lost else ""
+            log(f"✅ {name}: {record['blocks']} blocks in {record['elapsed']}s{note}")
+        else:
+            _remove(tmp)
+            if not heartbeat.lost:
+                store.count_attempt(claimed, record['error'])
+            log(f"❌ {name}: {record['error']}")
+        store.release(name, worker_id)
+
+
+# --- command line -------------------------------------------------------------
+
+def _spawn_local_workers(args) -> list:
+    procs = []
+    for n in range(args.nodes):
+        cmd = [sys.executable, os.path.abspath(__file__), 'worker', '--root', args.root,
+               '--id', f"node{n + 1}", '--lease-timeout', str(args.lease_timeout),
+               '--poll', str(args.poll), '--rec-cache', str(args.rec_cache), '--exit-when-idle']
+        if args.cpu_threads:
+            cmd += ['--cpu-threads', str(args.cpu_threads)]
+        if args.quiet:
+            cmd.append('--quiet')
+        procs.append(subprocess.Popen(cmd))
+    return procs
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Process large PDF sets on several nodes through a shared folder.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def common(p):
+        p.add_argument('--root', required=True, help='Shared cluster folder reachable by all nodes')
+        p.add_argument('--lease-timeout', type=float, default=60.0,
+                       help='Seconds without heartbeat before a shard is taken from its worker (default: 60)')
+        p.add_argument('--poll', type=float, default=2.0, help='Polling interval in seconds')
+        p.add_argument('-q', '--quiet', action='store_true', help='Do not print per-page progress')
+
+    def submitting(p):
+        p.add_argument('inputs', nargs='+', help='PDF files, directories or glob patterns')
+        p.add_argument('-o', '--output-dir', help='Directory for results (default: next to each input)')
+        p.add_argument('--settings', help='settings.json to use as default options (GUI format)')
+        p.add_argument('--shard-pages', type=int, default=50, help='Pages per shard (default: 50)')
+        p.add_argument('--max-attempts', type=int, default=2, help='Attempts per shard before the file fails')
+        p.add_argument('--stage', action='store_true', help='Copy inputs into the shared folder first')
+        add_option_arguments(p)
+
+    def working(p):
+        p.add_argument('--cpu-threads', type=int, help='CPU threads per worker (default: CPU count)')
+        p.add_argument('--rec-cache', type=int, default=0, metavar='N', help='Recognized line crop cache per worker')
+
+    p = sub.add_parser('submit', help='Split documents into shard tasks')
+    common(p)
+    submitting(p)
+    p = sub.add_parser('coordinator', help='Recover stale shards and merge finished documents')
+    common(p)
+    p.add_argument('--follow', action='store_true', help='Keep running when no job is open')
+    p = sub.add_parser('worker', help='Claim and process shards')
+    common(p)
+    working(p)
+    p.add_argument('--id', help='Worker name (default: host-pid)')
+    p.add_argument('--exit-when-idle', action='store_true', help='Exit once every shard is finished')
+    p = sub.add_parser('local', help='Submit, run N local worker processes and merge (single machine)')
+    common(p)
+    submitting(p)
+    working(p)
+    p.add_argument('--nodes', type=int, default=2, help='Local worker processes (default: 2)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    store = ShardStore(args.root)
+
+    submitted = []
+    if args.command in ('submit', 'local'):
+        inputs = expand_inputs(args.inputs)
+        if not inputs:
+            print("No PDF files found", file=sys.stderr)
+            return 2
+        submitted = submit(store, inputs, args.output_dir, option_defaults(args), args.shard_pages,
+               args.max_attempts, args.stage)
+        if args.command == 'submit':
+            return 0
+
+    if args.command == 'worker':
+        init_worker(args.cpu_threads or os.cpu_count() or 1, args.rec_cache)
+        try:
+            work(store, args.id, args.lease_timeout, args.poll, args.exit_when_idle, args.quiet)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.command == 'local':
+        if not args.cpu_threads:
+            args.cpu_threads = max(1, (os.cpu_count() or 1) // max(1, args.nodes))
+        procs = _spawn_local_workers(args)
+        try:
+            coordinate(store, args.lease_timeout, args.poll)
+        finally:
+            for proc in procs:
+                proc.wait()
+    else:
+        coordinate(store, args.lease_timeout, args.poll, args.follow)
+
+    job_ids = [job['id'] for job in submitted] or store.names('jobs')
+    failed = [job for job in (_read_json(store.path('jobs', f"{job_id}.json")) for job_id in job_ids)
+              if job and job['status'] == 'failed']
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
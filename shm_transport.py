@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared-memory transport of page rasters between a render process and OCR.
+
+A page raster of a large sheet is hundreds of megabytes; sending it through
+a multiprocessing pipe would pickle and copy it twice. Here the consumer owns
+a few multiprocessing.shared_memory slots, the render process writes the
+raster straight into a free slot and only a small handle (slot name, shape,
+dtype) travels over the queue. The consumer wraps the slot in a numpy array
+without copying and gives the slot back with release() once the page is
+assembled; a free slot is also what allows the next page to be rendered
+ahead, so the number of slots bounds the look-ahead and the memory used.
+
+    renderer = RenderProcess(slots=3)
+    renderer.request(0, 'in.pdf', 0, dpi=300, max_bytes=page_bytes)
+    img, img_data = renderer.result(0)   # numpy view into shared memory
+    ...
+    renderer.release(0)
+    renderer.close()
+
+get_renderer() keeps one render process per thread for all the files it
+processes, so a service does not spawn a process for every file.
+"""
+import atexit
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _render_worker(requests, replies):
+    """Render process: open documents on demand, write rasters into the given slots"""
+    import fitz
+    from page_render import render_page
+
+    doc = doc_key = None
+    attached = {}
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        key, path, index, dpi, clip, color_mode, encode, slot_name, retired = request
+        for name in retired:
+            # Slots the consumer replaced by bigger ones
+            shm = attached.pop(name, None)
+            if shm is not None:
+                shm.close()
+        try:
+            # A long-lived renderer serves many files: reopen when the file was replaced
+            st = os.stat(path)
+            stamp = (path, st.st_mtime_ns, st.st_size)
+            if stamp != doc_key:
+                if doc is not None:
+                    doc.close()
+                doc, doc_key = fitz.open(path), stamp
+            img, img_data = render_page(doc[index], dpi, fitz.Rect(clip) if clip else None, color_mode, encode)
+            shm = attached.get(slot_name)
+            if shm is None:
+                shm = attached[slot_name] = shared_memory.SharedMemory(name=slot_name)
+            if img.nbytes <= shm.size:
+                np.copyto(np.ndarray(img.shape, img.dtype, buffer=shm.buf), img)
+                replies.put(('ok', key, img.shape, img.dtype.str, None, img_data))
+            else:
+                # Larger than estimated: send it the slow way rather than fail the page
+                replies.put(('ok', key, img.shape, img.dtype.str, img, img_data))
+            del img
+        except Exception as e:
+            replies.put(('error', key, None, None, None, f"{type(e).__name__}: {e}"))
+    for shm in attached.values():
+        shm.close()
+    if doc is not None:
+        doc.close()
+
+
+class RenderProcess:
+    """Render pages in a separate process and hand them over in shared memory.
+
+    slots is the number of rasters that can exist at once (the page being
+    recognized plus slots-1 pages rendered ahead). Slots grow to the largest
+    raster requested and are reused for the following pages.
+    """
+
+    def __init__(self, slots: int = 3):
+        ctx = mp.get_context('spawn')  # no fork of a process that holds Paddle threads
+        self.requests = ctx.Queue()
+        self.replies = ctx.Queue()
+        self.process = ctx.Process(target=_render_worker, args=(self.requests, self.replies),
+                                   name='pdf-render', daemon=True)
+        self.process.start()
+        self.slots = max(2, int(slots))
+        self.free = [None] * self.slots  # unused slots (None: not created yet)
+        self.busy = {}      # key -> slot
+        self.pending = set()
+        self.results = {}   # key -> reply that arrived before it was asked for
+        self.retired = []   # names of replaced slots the renderer still has open
+
+    def request(self, key, path: str, index: int, dpi: int = 300, clip=None, color_mode: str = 'rgb',
+                encode: bool = True, max_bytes: int = 0) -> bool:
+        """Queue a page render; False if every slot is in use (request it later)"""
+        if key in self.busy:
+            return True
+        if not self.free:
+            return False
+        shm = self.free.pop()
+        if shm is None or shm.size < max_bytes:
+            if shm is not None:
+                self.retired.append(shm.name)
+                self._dispose(shm)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(max_bytes)))
+        self.busy[key] = shm
+        self.pending.add(key)
+        self.requests.put((key, path, index, dpi, tuple(clip) if clip is not None else None,
+                           color_mode, encode, shm.name, self.retired))
+        self.retired = []
+        return True
+
+    def result(self, key):
+        """Wait for a requested page; returns (image, PNG bytes or None) like render_page"""
+        while key not in self.results:
+            if not self.process.is_alive():
+                raise RuntimeError(f"Render process exited with code {self.process.exitcode}")
+            try:
+                reply = self.replies.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self.results[reply[1]] = reply
+        status, _, shape, dtype, inline, payload = self.results.pop(key)
+        self.pending.discard(key)
+        if status != 'ok':
+            raise RuntimeError(f"Render failed: {payload}")
+        if inline is not None:
+            return inline, payload
+        return np.ndarray(shape, np.dtype(dtype), buffer=self.busy[key].buf), payload
+
+    def release(self, key):
+        """Give the slot of a page back (its image must no longer be used)"""
+        shm = self.busy.get(key)
+        if shm is None:
+            return
+        if key in self.pending:
+            # Still being written: wait so the slot is not reused under the renderer
+            try:
+                self.result(key)
+            except RuntimeError:
+                pass
+        del self.busy[key]
+        self.free.append(shm)
+
+    def release_all(self):
+        for key in list(self.busy):
+            self.release(key)
+
+    @staticmethod
+    def _dispose(shm):
+        try:
+            shm.close()
+        except BufferError:
+            pass  # a view is still referenced; the mapping goes away with it
+        shm.unlink()
+
+    def close(self):
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+        for shm in list(self.busy.values()) + self.free:
+            if shm is not None:
+                self._dispose(shm)
+        self.busy.clear()
+        self.free = []
+        self.requests.close()
+        self.replies.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_RENDERERS = threading.local()
+_STARTED = []  # every shared renderer, closed at interpreter exit
+
+
+@atexit.register
+def _close_all():
+    for renderer in _STARTED:
+        renderer.close()
+
+
+def get_renderer() -> RenderProcess:
+    """Render process of the calling thread, kept for the following files"""
+    renderer = getattr(_RENDERERS, 'renderer', None)
+    if renderer is None or not renderer.process.is_alive():
+        if renderer is not None:
+            renderer.close()
+            _STARTED.remove(renderer)
+        renderer = _RENDERERS.renderer = RenderProcess()
+        _STARTED.append(renderer)
+    return renderer
@@ -0,0 +1,34 @@
+import fitz
+
+from page_index import PageIndex, page_fingerprint
+
+
+def _document(*notes):
+    """One identical sheet per entry, annotated with the note if it is not None"""
+    doc = fitz.open()
+    for note in notes:
+        page = doc.new_page()
+        page.insert_text((50, 50), "Sheet A-101")
+        if note:
+            page.add_freetext_annot(fitz.Rect(100, 100, 200, 150), note)
+    return doc
+
+
+def test_annotated_page_misses_index():
+    doc = _document(None, None, "REV B", "REV C")
+    index = PageIndex()
+    index.store(doc[0], page_fingerprint(doc[0]), '0' * 256, 200, 'rgb', [{'text': 'A-101'}], 0)
+
+    assert index.lookup(page_fingerprint(doc[1]), 200, 'rgb') is not None
+    assert index.lookup(page_fingerprint(doc[2]), 200, 'rgb') is None
+    assert page_fingerprint(doc[2]) != page_fingerprint(doc[3])
+    index.close()
+
+
+def test_shared_memo_matches_fresh_fingerprints():
+    doc = _document(None, "REV B", None, "REV B")
+    memo = {}
+    shared = [page_fingerprint(doc[i], memo) for i in range(len(doc))]
+
+    assert shared == [page_fingerprint(doc[i]) for i in range(len(doc))]
+    assert memo
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch-folder ingestion service for PDF2Searchable.
+
+Polls one or more input directories, moves every new (fully written) PDF
+into a persistent on-disk queue and processes the queue with a pool of
+worker processes built on process_pdf. Results go to the output folder,
+failed sources (with an .error.txt note) to the error folder.
+
+Queue layout (survives restarts, jobs left in running/ are re-queued):
+
+    <queue>/files/    staged source PDFs (and descriptors of jobs being staged)
+    <queue>/pending/  job descriptors waiting for a worker
+    <queue>/running/  job descriptors being processed
+
+Example:
+    python watch_service.py --input scans --output searchable --error failed --queue .queue --workers 2
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from batch_cli import add_option_arguments, default_output_path, init_worker, option_defaults, run_job
+
+logger = logging.getLogger(__name__)
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _unique_path(path: str) -> str:
+    """path, or 'name (2).pdf', 'name (3).pdf'... if it is taken (same name from another source)"""
+    base, ext = os.path.splitext(path)
+    n = 1
+    while os.path.exists(path):
+        n += 1
+        path = f"{base} ({n}){ext}"
+    return path
+
+
+def _init_service_worker(cpu_threads):
+    """Workers ignore Ctrl+C; the service drains them on shutdown itself"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(cpu_threads)
+
+
+def _run_service_job(work: dict) -> dict:
+    """run_job in a pool worker; the metrics it produced travel back with the record"""
+    record = run_job(work, True)
+    record['metrics'] = metrics.REGISTRY.drain()
+    return record
+
+
+class JobQueue:
+    """Persistent FIFO job queue stored as one JSON file per job.
+
+    State changes are atomic renames between the pending/ and running/
+    folders, so a crash never loses a job: recover() puts interrupted jobs
+    back into pending/ on the next start.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files_dir = os.path.join(root, 'files')
+        self.pending_dir = os.path.join(root, 'pending')
+        self.running_dir = os.path.join(root, 'running')
+        for path in (self.files_dir, self.pending_dir, self.running_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def recover(self) -> int:
+        """Move jobs interrupted by a restart back to pending"""
+        count = 0
+        for name in os.listdir(self.files_dir):
+            if not name.endswith('.json'):
+                continue
+            draft = os.path.join(self.files_dir, name)
+            if os.path.exists(f"{draft[:-5]}.pdf"):
+                # Crashed after the file was staged: the job is complete
+                os.replace(draft, os.path.join(self.pending_dir, name))
+                count += 1
+            else:
+                # Crashed before: the source is still in its input folder
+                os.remove(draft)
+        for name in os.listdir(self.running_dir):
+            if name.endswith('.json'):
+                os.replace(os.path.join(self.running_dir, name), os.path.join(self.pending_dir, name))
+                count += 1
+        return count
+
+    def depth(self) -> int:
+        return sum(1 for name in os.listdir(self.pending_dir) if name.endswith('.json'))
+
+    def enqueue(self, source_path: str, options: dict = None) -> dict:
+        """Move a source file into the queue storage and register a job for it"""
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        staged = os.path.join(self.files_dir, f"{job_id}.pdf")
+        job = {
+            'id': job_id,
+            'name': os.path.basename(source_path),
+            'source': source_path,
+            'staged': staged,
+            'options': options or {},
+            'attempts': 0,
+            'enqueued_at': time.time(),
+        }
+        # Descriptor first: a crash after the move leaves a job recover() can find, not an orphaned file
+        draft = os.path.join(self.files_dir, f"{job_id}.json")
+        _write_json_atomic(draft, job)
+        try:
+            # Fails while the producer still holds the file (Windows); retried on the next poll
+            shutil.move(source_path, staged)
+        except OSError:
+            os.remove(draft)
+            raise
+        os.replace(draft, os.path.join(self.pending_dir, f"{job_id}.json"))
+        return job
+
+    def claim(self):
+        """Take the oldest pending job (None if the queue is empty)"""
+        for name in sorted(os.listdir(self.pending_dir)):
+            if not name.endswith('.json'):
+                continue
+            running = os.path.join(self.running_dir, name)
+            try:
+                os.replace(os.path.join(self.pending_dir, name), running)
+            except OSError:
+                continue
+            with open(running, 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        return None
+
+    def release(self, job: dict, retry: bool = False):
+        """Finish a running job; with retry=True it goes back to pending"""
+        running = os.path.join(self.running_dir, f"{job['id']}.json")
+        if retry:
+            _write_json_atomic(running, job)
+            os.replace(running, os.path.join(self.pending_dir, f"{job['id']}.json"))
+        elif os.path.exists(running):
+            os.remove(running)
+
+
+class WatchService:
+    """Poll input folders, feed the job queue and run it on a process pool"""
+
+    def __init__(self, input_dirs, output_dir, error_dir, queue_dir,
+                 options=None, workers=1, cpu_threads=None, max_queue=100,
+                 poll_interval=2.0, max_attempts=2, archive_dir=None):
+        self.input_dirs = list(input_dirs)
+        self.output_dir = output_dir
+        self.error_dir = error_dir
+        self.archive_dir = archive_dir
+        self.options = options or {}
+        self.workers = max(1, int(workers))
+        self.cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.max_queue = max(1, int(max_queue))
+        self.poll_interval = float(poll_interval)
+        self.max_attempts = max(1, int(max_attempts))
+        self.queue = JobQueue(queue_dir)
+        self._seen = {}  # path -> (size, mtime) from the previous poll
+        self._throttled = False
+        self._stopping = False
+        for path in [output_dir, error_dir, archive_dir] + self.input_dirs:
+            if path:
+                os.makedirs(path, exist_ok=True)
+
+    def stop(self, *_):
+        if not self._stopping:
+            logger.info("Stop requested, finishing running jobs...")
+        self._stopping = True
+
+    def scan(self) -> int:
+        """Enqueue files that did not change since the previous poll.
+
+        Applies backpressure: once the queue holds max_queue jobs, new files
+        are left in the input folders until workers catch up.
+        """
+        room = self.max_queue - self.queue.depth()
+        if room <= 0:
+            if not self._throttled:
+                logger.warning(f"Queue is full ({self.max_queue} jobs), pausing ingestion")
+            self._throttled = True
+            return 0
+        if self._throttled:
+            logger.info("Queue has room again, resuming ingestion")
+            self._throttled = False
+
+        added = 0
+        current = {}
+        for folder in self.input_dirs:
+            try:
+                names = sorted(os.listdir(folder))
+            except OSError as e:
+                logger.error(f"Cannot list {folder}: {e}")
+                continue
+            for name in names:
+                if not name.lower().endswith('.pdf'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                signature = (st.st_size, st.st_mtime)
+                current[path] = signature
+                # A file is picked up only once its size/mtime are stable across two polls
+                if added >= room or self._seen.get(path) != signature or st.st_size == 0:
+                    continue
+                try:
+                    job = self.queue.enqueue(path, self.options)
+                except OSError as e:
+                    logger.debug(f"Not ready yet: {path} ({e})")
+                    continue
+                current.pop(path, None)
+                added += 1
+                logger.info(f"📥 Queued {name} as {job['id']}")
+        self._seen = current
+        return added
+
+    def _output_path(self, job: dict) -> str:
+        options = dict(self.options)
+        options.update(job.get('options') or {})
+        return default_output_path(job['name'], options.get('hide_text', False), self.output_dir)
+
+    def _submit(self, pool, job: dict):
+        job['attempts'] += 1
+        work = {
+            'input': job['staged'],
+            'output': os.path.join(self.output_dir, f".{job['id']}.part.pdf"),
+            'options': job.get('options') or {},
+        }
+        logger.info(f"⚙️ Processing {job['name']} ({job['id']}, attempt {job['attempts']})")
+        return pool.submit(_run_service_job, work)
+
+    def _finish(self, job: dict, record: dict):
+        metrics.REGISTRY.merge(record.pop('metrics', None))
+        partial = os.path.join(self.output_dir, f".{job['id']}.part.pdf")
+        retry = True
+        if record.get('status') == 'ok':
+            try:
+                final = _unique_path(self._output_path(job))
+                os.replace(partial, final)
+                if self.archive_dir:
+                    shutil.move(job['staged'], _unique_path(os.path.join(self.archive_dir, job['name'])))
+                else:
+                    os.remove(job['staged'])
+            except OSError as e:
+                # Processing worked, storing the result did not: another attempt would not help
+                record = {'status': 'failed', 'error': f"Cannot store the result: {e}"}
+                retry = False
+            else:
+                self.queue.release(job)
+                logger.info(f"✅ {job['name']}: {record['pages']} pages, {record['blocks']} blocks "
+                            f"in {record.get('elapsed', 0)}s -> {final}")
+                return
+
+        try:
+            if os.path.exists(partial):
+                os.remove(partial)
+        except OSError as e:
+            logger.warning(f"Cannot remove {partial}: {e}")
+        if retry and job['attempts'] < self.max_attempts:
+            logger.warning(f"Retrying {job['name']}: {record.get('error')}")
+            self.queue.release(job, retry=True)
+            return
+        try:
+            target = _unique_path(os.path.join(self.error_dir, job['name']))
+            if os.path.exists(job['staged']):
+                shutil.move(job['staged'], target)
+            with open(f"{target}.error.txt", 'w', encoding='utf-8') as fh:
+                fh.write(f"{record.get('error')}\n")
+        except OSError as e:
+            logger.error(f"Cannot move {job['name']} to {self.error_dir}: {e}")
+        self.queue.release(job)
+        logger.error(f"❌ {job['name']} failed after {job['attempts']} attempt(s): {record.get('error')}")
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker,
+                                   initargs=(self.cpu_threads,))
+
+    def run(self):
+        recovered = self.queue.recover()
+        if recovered:
+            logger.info(f"Recovered {recovered} interrupted job(s)")
+        logger.info(f"👀 Watching {', '.join(self.input_dirs)} with {self.workers} worker(s)")
+
+        pool = self._new_pool()
+        in_flight = {}
+        metrics.QUEUE_LENGTH.set_function(self.queue.depth, queue='watch')
+        metrics.JOBS_RUNNING.set_function(lambda: len(in_flight), queue='watch')
+        try:
+            while not self._stopping or in_flight:
+                if not self._stopping:
+                    self.scan()
+                    while len(in_flight) < self.workers:
+                        job = self.queue.claim()
+                        if job is None:
+                            break
+                        in_flight[self._submit(pool, job)] = job
+
+                if not in_flight:
+                    time.sleep(self.poll_interval)
+                    continue
+                done, _ = wait(list(in_flight), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool as e:
+                        # A native crash kills the worker; count it as a failed attempt
+                        record = {'status': 'failed', 'error': f"Worker process crashed: {e}"}
+                        metrics.FILES.inc(status='failed')
+                        broken = True
+                    self._finish(job, record)
+                if broken:
+                    for future, job in list(in_flight.items()):
+                        self._finish(job, {'status': 'failed', 'error': 'Worker pool restarted'})
+                    in_flight.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._new_pool()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        logger.info("Service stopped")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Watch folders and convert new PDFs to searchable PDFs.')
+    parser.add_argument('-i', '--input', action='append', required=True, help='Input folder to watch (repeatable)')
+    parser.add_argument('-o', '--output', required=True, help='Folder for searchable PDFs')
+    parser.add_argument('-e', '--error', required=True, help='Folder for failed sources')
+    parser.add_argument('-q', '--queue', default='.queue', help='Persistent queue folder (default: .queue)')
+    parser.add_argument('--archive', help='Move processed sources here instead of deleting them')
+    parser.add_argument('--settings', help='settings.json to use as default options (GUI format)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Files processed concurrently')
+    parser.add_argument('--cpu-threads', type=int, help='CPU threads per worker (default: CPU count / workers)')
+    parser.add_argument('--max-queue', type=int, default=100, help='Pause ingestion above this many queued jobs')
+    parser.add_argument('--poll', type=float, default=2.0, help='Polling interval in seconds')
+    parser.add_argument('--max-attempts', type=int, default=2, help='Attempts per file before it is moved to errors')
+    metrics.add_metrics_arguments(parser)
+    add_option_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    _, exporter = metrics.start_exporters(args, logger.info)
+    service = WatchService(args.input, args.output, args.error, args.queue,
+                           options=option_defaults(args),
+                           workers=args.workers,
+                           cpu_threads=args.cpu_threads,
+                           max_queue=args.max_queue,
+                           poll_interval=args.poll,
+                           max_attempts=args.max_attempts,
+                           archive_dir=args.archive)
+    signal.signal(signal.SIGINT, service.stop)
+    signal.signal(signal.SIGTERM, service.stop)
+    service.run()
+    if exporter is not None:
+        exporter.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())